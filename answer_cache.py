@@ -0,0 +1,181 @@
+"""
+Semantic answer cache, scoped per document.
+
+Users ask the same questions in different words. Answers to standalone
+questions (no chat history involved) are remembered together with the query
+embedding that retrieval computes anyway; a later question about the same
+document whose embedding has cosine similarity above ANSWER_CACHE_THRESHOLD
+to a remembered one gets the stored answer and sources without an LLM call.
+Entries expire after a TTL and the cache is bounded by LRU eviction. Each
+document's unit vectors are kept in one matrix that is updated in place as
+entries come and go, so a lookup is a single matrix-vector product.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from monitor import Monitor
+
+
+class CachedAnswer:
+    __slots__ = ("question", "vector", "answer", "sources", "created")
+
+    def __init__(self, question, vector, answer, sources):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.sources = sources
+        self.created = time.time()
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _DocumentVectors:
+    """
+    Unit vectors and creation times of one document's entries, one row per
+    entry. A removed row is filled with the last one, so rows stay packed.
+    """
+
+    def __init__(self, dim):
+        self.ids = []
+        self.rows = {}
+        self.vectors = np.empty((8, dim), dtype=np.float32)
+        self.created = np.empty(8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, entry_id, vector, created):
+        row = len(self.ids)
+        if row == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.empty_like(self.vectors)])
+            self.created = np.concatenate([self.created, np.empty_like(self.created)])
+        self.vectors[row] = vector
+        self.created[row] = created
+        self.ids.append(entry_id)
+        self.rows[entry_id] = row
+
+    def remove(self, entry_id):
+        row = self.rows.pop(entry_id)
+        last = len(self.ids) - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.created[row] = self.created[last]
+            self.ids[row] = self.ids[last]
+            self.rows[self.ids[row]] = row
+        self.ids.pop()
+
+    def matrix(self):
+        return self.vectors[:len(self.ids)]
+
+    def expired(self, cutoff):
+        return [self.ids[row] for row in np.flatnonzero(self.created[:len(self.ids)] < cutoff)]
+
+
+class AnswerCache:
+    """
+    Nearest-neighbour lookup over past questions, per document. Thread-safe.
+    """
+
+    def __init__(self, threshold=None, ttl_s=None, max_entries=None):
+        self.threshold = config.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl_s = config.ANSWER_CACHE_TTL_S if ttl_s is None else ttl_s
+        self.max_entries = max_entries or config.ANSWER_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        # (document key, entry id) -> CachedAnswer, least recently used first
+        self._entries = OrderedDict()
+        # document key -> _DocumentVectors of its entries
+        self._documents = {}
+
+    def lookup(self, document_key, query_vector, monitor=None):
+        """
+        The cached answer closest to the query, if it is similar enough and
+        not expired; None otherwise.
+        """
+        query = _unit(query_vector)
+        with self._lock:
+            vectors = self._live_vectors(document_key)
+            found, similarity = None, 0.0
+            if vectors is not None:
+                similarities = vectors.matrix() @ query
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                if similarity >= self.threshold:
+                    key = (document_key, vectors.ids[best])
+                    self._entries.move_to_end(key)
+                    found = self._entries[key]
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            hits, misses = self.hits, self.misses
+        (monitor or Monitor()).log_answer_cache(found is not None, similarity, hits, misses)
+        return found
+
+    def put(self, document_key, query_vector, question, answer, sources):
+        vector = _unit(query_vector)
+        with self._lock:
+            vectors = self._live_vectors(document_key)
+            if vectors is not None and float(np.max(vectors.matrix() @ vector)) >= 0.9999:
+                # Already remembered (e.g. by a coalesced session answering the same question)
+                return
+            entry_id = next(self._ids)
+            entry = self._entries[(document_key, entry_id)] = CachedAnswer(question, vector, answer, sources)
+            if vectors is None:
+                vectors = self._documents[document_key] = _DocumentVectors(len(vector))
+            vectors.add(entry_id, vector, entry.created)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _live_vectors(self, document_key):
+        # Expired entries are dropped first, so they never shadow a fresher near-match
+        vectors = self._documents.get(document_key)
+        if vectors is not None:
+            for entry_id in vectors.expired(time.time() - self.ttl_s):
+                self._remove((document_key, entry_id))
+        return self._documents.get(document_key)
+
+    def _remove(self, key):
+        del self._entries[key]
+        document_key, entry_id = key
+        vectors = self._documents[document_key]
+        vectors.remove(entry_id)
+        if not len(vectors):
+            del self._documents[document_key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_answer_cache():
+    """
+    The process-wide AnswerCache shared by all Streamlit sessions.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache()
+        return _default_cache
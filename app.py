@@ -1,15 +1,12 @@
 from dotenv import load_dotenv
 import os
 import streamlit as st
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.chains.question_answering import load_qa_chain
-from pydantic import SecretStr
+import config
+from rate_limits import is_rate_limit_error
+from history import ChatHistory
 from monitor import Monitor
+from library import read_manifest
+from ui import show_batch_qa, show_ingest_progress, show_trace
 
 
 def main():
@@ -20,63 +17,102 @@ def main():
     
     # upload file
     pdf = st.file_uploader("Upload your PDF", type="pdf")
+    # Without an upload, questions go to the library pre-built by bulk_ingest.py
+    library = read_manifest(config.LIBRARY_DIR) if config.LIBRARY_DIR and pdf is None else None
     
-    # extract the text
-    if pdf is not None:
-      monitor.log_pdf_upload(pdf.name)
-      pdf_reader = PdfReader(pdf)
-      text = ""
-      for page in pdf_reader.pages:
-        text += page.extract_text()
-      monitor.log_text_extraction(len(pdf_reader.pages), text[:200])
-        
-      # split into chunks
-      text_splitter = CharacterTextSplitter(
-        separator="\n",
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-      )
-      chunks = text_splitter.split_text(text)
-      monitor.log_text_chunking(len(chunks), [len(chunk) for chunk in chunks])
+    if pdf is not None or library is not None:
+      # LangChain, FAISS, PyPDF2 and the Gemini client load here, on first use,
+      # so the upload page renders without waiting for them
+      from pipeline import acquire_ingest, acquire_library, shared_chain, shared_embeddings, shared_llm
+      from qa import ask_stream
+      from service_client import default_client
 
-      # Create embeddings using Gemini API
+      # With QA_SERVICE_URL set, service.py indexes and answers; this app is only the UI
+      remote = default_client() if config.QA_SERVICE_URL else None
+      # Create embeddings using Gemini API (one client shared by all sessions)
       api_key = os.getenv("GOOGLE_API_KEY")
-      if api_key:
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=SecretStr(api_key))
-        sample_embedding = embeddings.embed_query("sample")  # or use the first real embedding if available
-        monitor.log_embedding_creation(len(chunks), len(sample_embedding))
+      if remote is not None:
+        embeddings = None
+      elif api_key:
+        embeddings = shared_embeddings(api_key, monitor=monitor)
       else:
         st.error("GOOGLE_API_KEY not found in environment variables")
         return
+
+      # extract, split and embed the text into a FAISS vector store in the
+      # background (reused from the on-disk index cache when this PDF was seen
+      # before); the job survives reruns so it only starts once per upload,
+      # and sessions uploading the same PDF share one job and one index
+      source_id = pdf.file_id if pdf is not None else f"library:{library['version']}"
+      if st.session_state.get("ingest_file_id") != source_id:
+        if pdf is not None:
+          monitor.log_pdf_upload(pdf.name)
+        if remote is not None:
+          st.session_state.ingest_lease = remote.ingest(pdf.getvalue()) if pdf is not None else remote.library()
+        elif pdf is not None:
+          st.session_state.ingest_lease = acquire_ingest(pdf.getvalue(), embeddings, monitor=monitor)
+        else:
+          st.session_state.ingest_lease = acquire_library(config.LIBRARY_DIR, embeddings, monitor=monitor)
+        st.session_state.ingest_file_id = source_id
+      job = st.session_state.ingest_lease.value
+      if library is not None:
+        st.caption(f"Library: {library['num_documents']} documents, {library['num_pages']} pages (version {library['version']})")
+
+      if job.error is not None:
+        st.error(f"Error processing PDF: {job.error}")
+        return
+      if not job.done:
+        show_ingest_progress(job)
+      if job.knowledge_base is None:
+        return
+      # Until indexing finishes, questions are answered from the partial index
+      knowledge_base = job.knowledge_base if job.done else job
       
-      # Create FAISS vector store
-      knowledge_base = FAISS.from_texts(chunks, embeddings)
-      monitor.log_vector_store_creation(len(chunks))
-      
-      # Create conversational chain
-      llm = GoogleGenerativeAI(model="gemini-1.5-flash")
-      chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=knowledge_base.as_retriever()
-      )
-      monitor.log_chain_creation("ConversationalRetrievalChain")
+      # Create conversational chain (built once per document and shared)
+      if remote is None:
+        chain = shared_chain(job, shared_llm(api_key))
+        monitor.log_chain_creation("ConversationalRetrievalChain")
+
+      # A whole list of questions at once: one batched retrieval, concurrent LLM calls
+      if job.done:
+        if remote is None:
+          from batch_qa import answer_batch
+          answer_all = lambda questions, on_result: answer_batch(
+            chain, job.knowledge_base, questions, monitor=monitor, document_key=job.key, on_result=on_result
+          )
+        else:
+          answer_all = lambda questions, on_result: job.ask_batch(questions)
+        show_batch_qa(answer_all, job.key)
       
-      # Initialize chat history
+      # Initialize chat history (recent turns plus a rolling summary, within a token budget)
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = ChatHistory()
     
     # Show chat interface
     user_question = st.text_input("Ask a question about your PDF:")
     
-    if user_question:
+    if user_question and pdf is None and library is None:
+        # Nothing to answer from yet
+        st.error("Please upload a PDF before asking a question.")
+    elif user_question:
         try:
+            # --- Retrieval ---
+            # The question is embedded once and searched once; the same
+            # results feed the monitor and the answer chain.
+            # Identical questions asked concurrently about the same PDF share one answer
+            if remote is None:
+                response, answer_tokens = ask_stream(chain, knowledge_base, user_question, st.session_state.chat_history.pairs(), monitor=monitor, document_key=job.key)
+            else:
+                response, answer_tokens = job.ask_stream(user_question, st.session_state.chat_history.pairs())
+
             # --- Monitoring: Query Embedding ---
-            query_embedding = embeddings.embed_query(user_question)
-            monitor.log_query_embedding(user_question, query_embedding)
+            # (None when the lexical fast path answered without embedding)
+            query_embedding = response["query_embedding"]
+            if query_embedding is not None:
+                monitor.log_query_embedding(response["generated_question"], query_embedding)
 
             # --- Monitoring: Semantic Search ---
-            docs_and_scores = knowledge_base.similarity_search_with_score(user_question, k=4)
+            docs_and_scores = response["docs_and_scores"]
             monitor.log_semantic_search(query_embedding, docs_and_scores)
 
             # --- Monitoring: Knowledge Base Search ---
@@ -84,24 +120,22 @@ def main():
             monitor.log_knowledge_base_search(retrieved_chunks)
 
             # --- Monitoring: Ranked Results ---
-            ranked_chunks = sorted(docs_and_scores, key=lambda x: x[1])
+            # retrieve() returns results best first (hybrid scores are not distances)
+            ranked_chunks = list(docs_and_scores)
             monitor.log_ranked_results(ranked_chunks)
 
-            # --- LLM Response ---
-            response = chain.invoke({
-                "question": user_question,
-                "chat_history": st.session_state.chat_history
-            })
+            # --- LLM Response (streamed token by token) ---
+            st.write("**Answer:**")
+            st.write_stream(answer_tokens)
             monitor.log_llm_response(response["answer"])
+            # Where the time went: embedding, search, condensing, LLM
+            show_trace(response["trace"])
             
             # Update chat history
-            st.session_state.chat_history.append((user_question, response["answer"]))
-            
-            # Display response
-            st.write("**Answer:**", response["answer"])
+            st.session_state.chat_history.append(user_question, response["answer"])
             
         except Exception as e:
-            if "quota" in str(e).lower() or "429" in str(e):
+            if is_rate_limit_error(e):
                 st.error("Rate limit exceeded. Please wait a moment and try again, or upgrade your API plan.")
             else:
                 st.error(f"Error: {str(e)}")
@@ -109,7 +143,9 @@ def main():
         # Display chat history
         if st.session_state.chat_history:
             st.write("**Chat History:**")
-            for question, answer in st.session_state.chat_history:
+            if st.session_state.chat_history.summary:
+                st.caption(f"Earlier: {st.session_state.chat_history.summary}")
+            for question, answer in st.session_state.chat_history.turns:
                 st.write(f"**Q:** {question}")
                 st.write(f"**A:** {answer}")
                 st.write("---")
@@ -0,0 +1,371 @@
+"""
+Batch question answering: a fixed list of questions against one document.
+
+qa.ask() answers one question at a time, each an embedding request, a search
+and an LLM call in sequence. answer_batch() answers a whole checklist:
+
+- all questions are embedded in one batched call (embedding_client.embed_queries),
+- one index search runs over the matrix of query vectors (fused with BM25 per
+  question in hybrid mode, like qa.retrieve()),
+- each question's context is packed as usual (context.py), and
+- the LLM calls run concurrently, at most BATCH_QA_CONCURRENCY in flight and
+  paced to LLM_REQUESTS_PER_MINUTE / LLM_TOKENS_PER_MINUTE, retrying 429s,
+
+so throughput grows with the allowed concurrency instead of being one question
+at a time. Questions are answered standalone (without chat history), repeated
+questions are answered once and the per-document answer cache is used as by
+qa.ask(). Results are written as CSV or JSON:
+
+    python batch_qa.py questions.txt --pdf contract.pdf --output answers.csv
+    python batch_qa.py questions.csv --library library/ --output answers.json
+    python batch_qa.py questions.txt --pdf contract.pdf --fake    # no API key
+
+Question files are plain text (one question per line, # for comments), CSV
+(the "question" column, else the first) or a JSON list.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+import config
+from answer_cache import default_answer_cache
+from context import pack_context
+from embedding_client import embed_queries, estimate_tokens
+from lexical import lexical_fast_path, reciprocal_rank_fusion
+from monitor import Monitor
+from qa import DEFAULT_K
+from rate_limits import is_rate_limit_error, shared_bucket
+from singleflight import normalize
+
+FORMATS = ("csv", "json")
+
+
+def parse_questions(text, name=""):
+    """
+    The questions in a question file's text; the format is taken from the
+    file name (.json, .csv, anything else is one question per line).
+    """
+    suffix = Path(name).suffix.lower()
+    if suffix == ".json":
+        items = json.loads(text)
+        questions = [item["question"] if isinstance(item, dict) else item for item in items]
+    elif suffix == ".csv":
+        rows = list(csv.reader(io.StringIO(text)))
+        header = [cell.strip().lower() for cell in rows[0]] if rows else []
+        column = header.index("question") if "question" in header else 0
+        if "question" in header:
+            rows = rows[1:]
+        questions = [row[column] for row in rows if len(row) > column]
+    else:
+        questions = [line for line in text.splitlines() if not line.lstrip().startswith("#")]
+    return [question.strip() for question in questions if question and question.strip()]
+
+
+def retrieve_batch(knowledge_base, questions, k=DEFAULT_K, monitor=None, mode=None):
+    """
+    qa.retrieve() for many questions at once: one embedding call for every
+    question that needs a vector and one index search over all of them.
+    Returns [(query embedding, [(document, score), ...])] in question order,
+    with the same embeddings and scores qa.retrieve() would return.
+    """
+    return [(vector, docs_and_scores) for vector, docs_and_scores, _ in _retrieve_batch(
+        knowledge_base, questions, k, monitor, mode
+    )]
+
+
+def _retrieve_batch(knowledge_base, questions, k, monitor=None, mode=None, lookup=None):
+    """
+    retrieve_batch(), with the answer cache checked between embedding and
+    searching (like qa._retrieve()): questions for which lookup(query
+    embedding) finds a cached answer are left out of the index search.
+    Returns [(query embedding, [(document, score), ...], cached answer or None)].
+    """
+    monitor = monitor or Monitor()
+    mode = mode or config.RETRIEVAL_MODE
+    lexical_index = getattr(knowledge_base, "lexical_index", None)
+    hybrid = lexical_index is not None and mode != "vector"
+    results = [None] * len(questions)
+    lexical_hits = [None] * len(questions)
+
+    if hybrid:
+        with monitor.span("retrieve_lexical", k=k, questions=len(questions)):
+            lexical_hits = [lexical_index.search(question, config.HYBRID_CANDIDATES) for question in questions]
+        for i, hits in enumerate(lexical_hits):
+            if mode == "lexical" or (config.LEXICAL_FAST_PATH and lexical_fast_path(questions[i], hits, lexical_index)):
+                results[i] = (None, [(knowledge_base.document(doc_id), score) for doc_id, score in hits[:k]], None)
+        fast = sum(result is not None for result in results)
+        if fast:
+            monitor.event("lexical_fast_path", questions=fast)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+    with monitor.span("embed_query", questions=len(pending)):
+        vectors = embed_queries(knowledge_base.embeddings, [questions[i] for i in pending])
+    if lookup is not None:
+        searched = []
+        for i, vector in zip(pending, vectors):
+            cached = lookup(vector)
+            if cached is None:
+                searched.append((i, vector))
+            else:
+                results[i] = (vector, [], cached)
+        if not searched:
+            return results
+        pending, vectors = [i for i, _ in searched], [vector for _, vector in searched]
+    with monitor.span("retrieve", k=k, hybrid=hybrid, questions=len(pending)):
+        distances, ids = knowledge_base.index.search(
+            np.asarray(vectors, dtype=np.float32), config.HYBRID_CANDIDATES if hybrid else k
+        )
+        for row, i in enumerate(pending):
+            if hybrid:
+                fused = reciprocal_rank_fusion(
+                    [int(doc_id) for doc_id in ids[row] if doc_id >= 0], [doc_id for doc_id, _ in lexical_hits[i]]
+                )
+                docs_and_scores = [(knowledge_base.document(doc_id), score) for doc_id, score in fused[:k]]
+            else:
+                docs_and_scores = [
+                    (knowledge_base.document(int(doc_id)), float(distance))
+                    for doc_id, distance in zip(ids[row], distances[row]) if doc_id >= 0
+                ]
+            results[i] = (vectors[row], docs_and_scores, None)
+    return results
+
+
+def _invoke(combine_docs_chain, inputs, prompt_tokens, requests, tokens):
+    """
+    One LLM call under the LLM quota, retrying 429s with jittered exponential
+    backoff. Returns (answer, retries).
+    """
+    attempt = 0
+    while True:
+        requests.acquire(1)
+        tokens.acquire(prompt_tokens)
+        try:
+            return combine_docs_chain.invoke(inputs)[combine_docs_chain.output_key], attempt
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= config.LLM_MAX_RETRIES:
+                raise
+            delay = min(config.EMBED_BACKOFF_MAX_S, config.EMBED_BACKOFF_BASE_S * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+            attempt += 1
+
+
+def answer_batch(chain, knowledge_base, questions, k=DEFAULT_K, monitor=None, document_key=None,
+                 concurrency=None, on_result=None):
+    """
+    Answers every question. Returns one result per question, in order:
+    {"question", "answer", "sources", "answer_cache", "seconds", "retries",
+    "error"}. A question whose LLM call fails gets its error instead of
+    failing the batch. on_result(done, total) is called in the calling
+    thread as answers arrive, for progress reporting.
+    """
+    monitor = monitor or Monitor()
+    concurrency = concurrency or config.BATCH_QA_CONCURRENCY
+    start = time.perf_counter()
+
+    # Each distinct question is retrieved and answered once
+    keys = [normalize(question) for question in questions]
+    unique = {}
+    for key, question in zip(keys, questions):
+        unique.setdefault(key, question)
+    unique_questions = list(unique.values())
+
+    candidates = max(k, config.CONTEXT_CANDIDATES) if config.CONTEXT_PACKING else k
+    # Cached answers are found right after embedding, before the index search
+    lookup = None
+    if config.ANSWER_CACHE and document_key is not None and getattr(knowledge_base, "done", True):
+        lookup = lambda vector: default_answer_cache().lookup(document_key, vector, monitor)
+    retrieved = _retrieve_batch(knowledge_base, unique_questions, candidates, monitor, lookup=lookup)
+    answers = {}
+    work = []
+    with monitor.span("pack_context", questions=len(unique_questions)):
+        for key, question, (query_embedding, docs_and_scores, cached) in zip(unique, unique_questions, retrieved):
+            result = {
+                "question": question, "answer": None, "sources": None, "answer_cache": None,
+                "seconds": 0.0, "retries": 0, "error": None,
+            }
+            answers[key] = result
+            if cached is not None:
+                result.update(answer=cached.answer, sources=cached.sources, answer_cache="hit")
+                continue
+            if lookup is not None and query_embedding is not None:
+                result["answer_cache"] = "miss"
+            docs = [doc for doc, _ in docs_and_scores]
+            if config.CONTEXT_PACKING:
+                docs = pack_context(knowledge_base, docs, query_embedding)
+            else:
+                docs = docs[:k]
+            result["sources"] = docs
+            work.append((result, query_embedding))
+
+    combine_docs_chain = chain.combine_docs_chain
+    requests = shared_bucket(f"{config.LLM_MODEL}:requests", config.LLM_REQUESTS_PER_MINUTE)
+    tokens = shared_bucket(f"{config.LLM_MODEL}:tokens", config.LLM_TOKENS_PER_MINUTE)
+    done = [len(answers) - len(work)]
+
+    def answer(result, query_embedding):
+        inputs = {"input_documents": result["sources"], "question": result["question"], "chat_history": ""}
+        prompt_tokens = estimate_tokens(result["question"] + "".join(doc.page_content for doc in result["sources"]))
+        call_start = time.perf_counter()
+        try:
+            result["answer"], result["retries"] = _invoke(combine_docs_chain, inputs, prompt_tokens, requests, tokens)
+        except Exception as e:
+            result["error"] = str(e)
+            monitor.log_error(f"Batch question failed: {e}")
+        result["seconds"] = time.perf_counter() - call_start
+        monitor.record(
+            "llm", result["seconds"], context_chunks=len(result["sources"]), prompt_tokens=prompt_tokens,
+            batch=True, retries=result["retries"],
+        )
+        if result["answer_cache"] == "miss" and result["error"] is None:
+            default_answer_cache().put(
+                document_key, query_embedding, result["question"], result["answer"], result["sources"]
+            )
+
+    if on_result is not None and done[0]:
+        on_result(done[0], len(answers))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-qa") as pool:
+        futures = [pool.submit(answer, result, query_embedding) for result, query_embedding in work]
+        for future in as_completed(futures):
+            future.result()
+            done[0] += 1
+            if on_result is not None:
+                on_result(done[0], len(answers))
+
+    seconds = time.perf_counter() - start
+    monitor.record(
+        "batch_qa", seconds, questions=len(questions), unique=len(answers), llm_calls=len(work),
+        concurrency=concurrency, errors=sum(result["error"] is not None for result in answers.values()),
+    )
+    return [dict(answers[key], question=question) for key, question in zip(keys, questions)]
+
+
+def source_label(doc):
+    """
+    "file.pdf p. 3" / "p. 3-4" for a source passage.
+    """
+    start, end = doc.metadata.get("page_start"), doc.metadata.get("page_end")
+    pages = "" if start is None else f"p. {start}" if start == end or end is None else f"p. {start}-{end}"
+    return " ".join(part for part in (doc.metadata.get("source", ""), pages) if part)
+
+
+def to_record(result):
+    """
+    A result as plain JSON data (the JSON output and the service's response).
+    """
+    return {
+        "question": result["question"], "answer": result["answer"], "error": result["error"],
+        "answer_cache": result["answer_cache"], "seconds": round(result["seconds"], 3),
+        "sources": [{"content": doc.page_content, "metadata": doc.metadata} for doc in result["sources"]],
+    }
+
+
+def write_results(results, file, fmt="csv"):
+    """
+    Writes answers with their sources to an open text file: CSV (one row per
+    question, sources as page labels) or JSON (sources with their text).
+    """
+    if fmt == "json":
+        json.dump([to_record(result) for result in results], file, indent=2)
+    elif fmt == "csv":
+        writer = csv.writer(file)
+        writer.writerow(["question", "answer", "sources", "error", "answer_cache", "seconds"])
+        for result in results:
+            writer.writerow([
+                result["question"], result["answer"] or "", "; ".join(source_label(doc) for doc in result["sources"]),
+                result["error"] or "", result["answer_cache"] or "", f"{result['seconds']:.3f}",
+            ])
+    else:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def format_results(results, fmt="csv"):
+    buffer = io.StringIO()
+    write_results(results, buffer, fmt)
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a list of questions about a PDF or a library.")
+    parser.add_argument("questions", help="question file: .txt (one per line), .csv or .json")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--pdf", help="PDF to ask about (indexed, or loaded from the index cache)")
+    source.add_argument("--library", help="library directory built by bulk_ingest.py")
+    parser.add_argument("--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="csv or json (default: from --output, else csv)")
+    parser.add_argument("--concurrency", type=int, default=0, help="LLM calls in flight (0 = BATCH_QA_CONCURRENCY)")
+    parser.add_argument("-k", type=int, default=DEFAULT_K, help="chunks retrieved per question without context packing")
+    parser.add_argument("--fake", action="store_true", help="use local stand-in embeddings and LLM (no API key needed)")
+    args = parser.parse_args(argv)
+
+    # Only what a run needs; importing the pipeline pulls in LangChain and FAISS
+    from pipeline import acquire_ingest, acquire_library, create_embeddings, shared_chain, shared_embeddings, shared_llm
+
+    questions = parse_questions(Path(args.questions).read_text(encoding="utf-8"), args.questions)
+    if not questions:
+        print(f"No questions in {args.questions}", file=sys.stderr)
+        return 1
+    monitor = Monitor()
+    if args.fake:
+        from benchmarks.fakes import FakeLLM
+
+        embeddings, llm = create_embeddings(monitor=monitor, backend="fake"), FakeLLM()
+    else:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            print("GOOGLE_API_KEY not found in environment variables", file=sys.stderr)
+            return 1
+        embeddings, llm = shared_embeddings(api_key, monitor=monitor), shared_llm(api_key)
+
+    if args.pdf:
+        lease = acquire_ingest(Path(args.pdf).read_bytes(), embeddings, monitor=monitor)
+    else:
+        try:
+            lease = acquire_library(args.library, embeddings, monitor=monitor)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+    job = lease.value
+    while not job.done:
+        time.sleep(0.1)
+    if job.error is not None:
+        print(f"Error processing {args.pdf or args.library}: {job.error}", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    results = answer_batch(
+        shared_chain(job, llm), job.knowledge_base, questions, k=args.k, monitor=monitor,
+        document_key=job.key, concurrency=args.concurrency or None,
+        on_result=lambda done, total: print(f"\r{done}/{total} answered", end="", file=sys.stderr),
+    )
+    seconds = time.perf_counter() - start
+    lease.release()
+
+    fmt = args.format or ("json" if args.output.endswith(".json") else "csv")
+    if args.output == "-":
+        write_results(results, sys.stdout, fmt)
+    else:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            write_results(results, f, fmt)
+    errors = sum(result["error"] is not None for result in results)
+    print(
+        f"\n{len(results)} questions answered in {seconds:.1f}s ({len(results) / seconds:.1f}/s)"
+        + (f", {errors} failed" if errors else ""),
+        file=sys.stderr,
+    )
+    return 1 if errors == len(results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3 @@
+"""
+Offline benchmarks for the PDF Q&A pipeline (no network, no API key).
+"""
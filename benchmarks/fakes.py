@@ -0,0 +1,102 @@
+"""
+Deterministic local stand-ins for GoogleGenerativeAIEmbeddings and
+GoogleGenerativeAI with configurable latency, for benchmarks and offline runs.
+"""
+
+import hashlib
+import random
+import re
+import time
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+_WORD = re.compile(r"\w+")
+
+
+class FakeRateLimitError(Exception):
+    """
+    Stand-in for the API's 429 / quota-exhausted error.
+    """
+
+    code = 429
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words vectors: texts that share words get similar vectors, so
+    retrieval behaves sensibly. Each call sleeps `latency` seconds plus
+    `latency_per_text` per text and fails with a 429 at `rate_limit_rate`.
+    """
+
+    def __init__(self, dim=768, latency=0.0, latency_per_text=0.0, rate_limit_rate=0.0,
+                 model="fake/embedding", seed=0):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.rate_limit_rate = rate_limit_rate
+        self.model = model
+        self._random = random.Random(seed)
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _request(self, texts):
+        time.sleep(self.latency + self.latency_per_text * len(texts))
+        if self.rate_limit_rate and self._random.random() < self.rate_limit_rate:
+            raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+        return [self._vector(text) for text in texts]
+
+    def embed_documents(self, texts):
+        return self._request(texts)
+
+    def embed_query(self, text):
+        return self._request([text])[0]
+
+    def embed_queries(self, texts):
+        return self._request(texts)
+
+
+class FakeLLM(LLM):
+    """
+    Answers with the first sentences of the prompt's context, after a fixed
+    time-to-first-token and a per-token delay. Supports streaming.
+    """
+
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 64
+    model: str = "fake/llm"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _tokens(self, prompt):
+        words = prompt.split()
+        # Skip the instruction preamble so answers quote the document
+        return (words[20:] or words)[:self.answer_tokens]
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+              **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens(prompt)):
+            if i:
+                time.sleep(self.token_latency)
+            chunk = GenerationChunk(text=token + " ")
+            if run_manager is not None:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,181 @@
+"""
+Headless benchmark of the app.py pipeline against local fake backends.
+
+Drives the same code as the Streamlit apps (pipeline.start_ingest and qa.ask)
+with synthetic PDFs and deterministic stand-ins for the Gemini embedding and
+LLM APIs, so it runs without network access. Results are written as JSON so
+runs can be compared:
+
+    python -m benchmarks.run --pages 10 100 1000 --questions 50 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain.chains import ConversationalRetrievalChain
+
+from benchmarks.fakes import FakeEmbeddings, FakeLLM
+from benchmarks.synthetic_pdf import make_pdf, make_questions
+from embedding_cache import EmbeddingStore
+from history import ChatHistory
+from index_cache import IndexCache
+from monitor import Monitor
+from pipeline import index_cache_key, start_ingest, wrap_embeddings
+from qa import ask
+from registry import estimate_bytes
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and of its finished children (MB).
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+def latency_summary(seconds):
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def make_backends(args):
+    embeddings = FakeEmbeddings(
+        dim=args.dim,
+        latency=args.embed_latency,
+        latency_per_text=args.embed_latency_per_text,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    llm = FakeLLM(first_token_latency=args.llm_latency, token_latency=args.llm_token_latency)
+    return embeddings, llm
+
+
+def bench_document(num_pages, args, workdir, monitor):
+    """
+    Ingests one synthetic PDF (cold, then again from the index cache) and
+    answers the question set against it.
+    """
+    pdf_bytes = make_pdf(num_pages, seed=args.seed)
+    fake_embeddings, llm = make_backends(args)
+    # A fresh embedding store per document, so ingestion really embeds
+    store = EmbeddingStore(root=workdir / f"embeddings-{num_pages}")
+    embeddings = wrap_embeddings(fake_embeddings, monitor=monitor, store=store)
+    cache = IndexCache(root=workdir / "indexes")
+
+    start = time.perf_counter()
+    knowledge_base, meta = start_ingest(pdf_bytes, embeddings, monitor=monitor, cache=cache).wait()
+    ingest_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    start_ingest(pdf_bytes, embeddings, monitor=monitor, cache=cache).wait()
+    cached_ingest_s = time.perf_counter() - start
+
+    # The cache entry is the persisted index (in the INDEX_STORE format)
+    index_dir = cache.root / index_cache_key(pdf_bytes, embeddings)
+
+    chain = ConversationalRetrievalChain.from_llm(llm=llm, retriever=knowledge_base.as_retriever())
+    query_latencies = []
+    chat_history = ChatHistory(max_turns=args.history)
+    for question in make_questions(args.questions, seed=args.seed):
+        start = time.perf_counter()
+        response = ask(chain, knowledge_base, question, chat_history.pairs(), monitor=monitor)
+        query_latencies.append(time.perf_counter() - start)
+        if args.history:
+            chat_history.append(question, response["answer"])
+
+    return {
+        "pages": meta["num_pages"],
+        "chunks": meta["num_chunks"],
+        "pdf_bytes": len(pdf_bytes),
+        "ingest_s": round(ingest_s, 3),
+        "pages_per_s": round(meta["num_pages"] / ingest_s, 2),
+        "chunks_per_s": round(meta["num_chunks"] / ingest_s, 2),
+        "cached_ingest_s": round(cached_ingest_s, 4),
+        "index_bytes": dir_size(index_dir),
+        "index_heap_bytes": estimate_bytes(knowledge_base),
+        "query_latency": latency_summary(query_latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the PDF Q&A pipeline.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100], help="page counts of the synthetic PDFs")
+    parser.add_argument("--questions", type=int, default=20, help="questions asked per document")
+    parser.add_argument("--history", type=int, default=0, help="chat turns kept as history (0 = none)")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--embed-latency-per-text", type=float, default=0.0005, help="extra seconds per embedded text")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of embedding requests failing with 429")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds to the first LLM token")
+    parser.add_argument("--llm-token-latency", type=float, default=0.005, help="seconds per further LLM token")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    monitor = Monitor()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="pdfqa-bench-") as tmp:
+        for num_pages in args.pages:
+            result = bench_document(num_pages, args, Path(tmp), monitor)
+            results.append(result)
+            print(
+                f"{result['pages']:>6} pages  {result['chunks']:>6} chunks  "
+                f"ingest {result['ingest_s']:>8.2f}s ({result['pages_per_s']:.1f} pages/s)  "
+                f"query p50 {result['query_latency'].get('p50_ms', 0):.0f}ms "
+                f"p95 {result['query_latency'].get('p95_ms', 0):.0f}ms  "
+                f"index {result['index_bytes'] / 1e6:.1f}MB ({result['index_heap_bytes'] / 1e6:.1f}MB heap)"
+            )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": vars(args),
+        "results": results,
+        "stages": Monitor.metrics(),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Synthetic PDFs of any page count, written without extra dependencies.
+"""
+
+import random
+
+_WORDS = (
+    "agreement party clause payment term notice liability warranty section schedule "
+    "invoice delivery service report revenue quarter growth risk policy customer "
+    "supplier license renewal termination audit compliance data security budget"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(num_pages, lines_per_page=45, words_per_line=12, seed=0):
+    """
+    Returns the bytes of a PDF with `num_pages` pages of pseudo-random prose.
+    Every line carries an identifier (e.g. "clause 12.7") so lexical lookups
+    have something exact to find.
+    """
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(num_pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>")
+    font_id = 3 + 2 * num_pages
+    for page in range(num_pages):
+        lines = [f"Report page {page + 1}"]
+        for line in range(lines_per_page):
+            words = " ".join(rng.choice(_WORDS) for _ in range(words_per_line))
+            lines.append(f"clause {page + 1}.{line + 1} {words}.")
+        content = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * page} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    ).encode("latin-1")
+    return bytes(out)
+
+
+def make_questions(num_questions, seed=0):
+    """
+    Questions phrased with the same vocabulary as make_pdf().
+    """
+    rng = random.Random(seed)
+    return [
+        f"What does the {rng.choice(_WORDS)} {rng.choice(_WORDS)} say about {rng.choice(_WORDS)}?"
+        for _ in range(num_questions)
+    ]
@@ -0,0 +1,301 @@
+"""
+Headless bulk ingestion of a directory of PDFs into a library.
+
+Extraction and chunking of whole PDFs are spread over a process pool, while
+the main process embeds the resulting chunks in large batches through the
+rate-limited, cached embedding client. The combined FAISS + BM25 index is
+published as a new library version (see library.py) that app.py and
+deploy/streamlit_app.py load when LIBRARY_DIR points at it:
+
+    python bulk_ingest.py docs/ --output library/
+    LIBRARY_DIR=library/ streamlit run app.py
+
+With --incremental the library is kept as segments (see index_manager.py)
+and later runs only embed PDFs that are new or changed since the last one:
+
+    python bulk_ingest.py docs/ --output library/ --incremental
+
+With EMBEDDING_BACKEND=local (see embedding_backends.py) no API key is needed.
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import config
+from chunking import iter_chunks
+from embedding_backends import needs_api_key
+from extraction import iter_pages
+from index_factory import optimize_index
+from index_manager import IndexManager
+from lexical import BM25Builder, HybridFAISS
+from library import publish
+from monitor import Monitor
+from pipeline import create_embeddings, index_settings
+
+
+def find_pdfs(root):
+    return sorted(p for p in Path(root).rglob("*") if p.is_file() and p.suffix.lower() == ".pdf")
+
+
+def _process_pdf(path, root):
+    """
+    Runs in a worker process: extracts and chunks one PDF.
+    Returns its stats plus its Chunk objects.
+    """
+    start = time.perf_counter()
+    pdf_bytes = Path(path).read_bytes()
+    num_pages = 0
+
+    def pages():
+        nonlocal num_pages
+        # One process per PDF already; no nested pool
+        for page in iter_pages(pdf_bytes, workers=1):
+            num_pages += 1
+            yield page
+
+    chunks = list(iter_chunks(pages()))
+    return {
+        "path": str(Path(path).relative_to(root)),
+        "sha256": hashlib.sha256(pdf_bytes).hexdigest(),
+        "bytes": len(pdf_bytes),
+        "pages": num_pages,
+        "chunks": len(chunks),
+        "seconds": round(time.perf_counter() - start, 3),
+    }, chunks
+
+
+def iter_processed(paths, root, workers):
+    """
+    Yields (path, stats, chunks) or (path, error, None) in input order, keeping
+    two PDFs per worker in flight so embedding overlaps with extraction.
+    """
+    # "spawn" matches extraction.py; forked children would inherit client threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        paths = iter(paths)
+        pending = deque(
+            (path, pool.submit(_process_pdf, str(path), str(root)))
+            for _, path in zip(range(workers * 2), paths)
+        )
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(_process_pdf, str(next_path), str(root))))
+            try:
+                stats, chunks = future.result()
+            except Exception as e:
+                yield path, e, None
+            else:
+                yield path, stats, chunks
+
+
+class LibraryBuilder:
+    """
+    Embeds chunks in batches and appends them to one FAISS + BM25 index.
+    """
+
+    def __init__(self, embeddings, batch_size, monitor):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.monitor = monitor
+        self.knowledge_base = None
+        self.lexical = BM25Builder()
+        self.chunk_sizes = []
+        self.text_sample = ""
+        self._texts, self._metadatas = [], []
+
+    def add(self, source, chunks):
+        for chunk in chunks:
+            self._texts.append(chunk.text)
+            self._metadatas.append({"source": source, **chunk.metadata()})
+            if len(self._texts) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self._texts:
+            return
+        texts, metadatas = self._texts, self._metadatas
+        self._texts, self._metadatas = [], []
+        with self.monitor.span("embed", chunks=len(texts)):
+            vectors = self.embeddings.embed_documents(texts)
+        with self.monitor.span("index_build", chunks=len(texts)):
+            text_embeddings = list(zip(texts, vectors))
+            if self.knowledge_base is None:
+                self.knowledge_base = HybridFAISS.from_embeddings(
+                    text_embeddings, self.embeddings, metadatas=metadatas
+                )
+            else:
+                self.knowledge_base.add_embeddings(text_embeddings, metadatas=metadatas)
+            self.lexical.add(texts)
+        self.chunk_sizes += [len(text) for text in texts]
+        self.text_sample = self.text_sample or texts[0][:200]
+
+    def finish(self):
+        self.flush()
+        if self.knowledge_base is None:
+            raise ValueError("No text could be extracted from any PDF.")
+        with self.monitor.span("index_optimize", vectors=len(self.chunk_sizes)):
+            optimize_index(self.knowledge_base, monitor=self.monitor)
+        with self.monitor.span("lexical_build", chunks=len(self.chunk_sizes)):
+            self.knowledge_base.lexical_index = self.lexical.build()
+        return self.knowledge_base
+
+
+def build_library(pdf_dir, output_dir, embeddings, workers=None, batch_size=None,
+                  keep_versions=None, monitor=None, log=print):
+    """
+    Ingests every PDF under pdf_dir and publishes the result to output_dir.
+    Returns the manifest that was written.
+    """
+    monitor = monitor or Monitor()
+    workers = workers or config.EXTRACT_WORKERS or os.cpu_count() or 1
+    batch_size = batch_size or config.EMBED_BATCH_SIZE * config.EMBED_MAX_CONCURRENCY
+    paths = find_pdfs(pdf_dir)
+    if not paths:
+        raise ValueError(f"No PDF files found under {pdf_dir}.")
+
+    start = time.perf_counter()
+    builder = LibraryBuilder(embeddings, batch_size, monitor)
+    documents, failed = [], []
+    for number, (path, stats, chunks) in enumerate(iter_processed(paths, pdf_dir, workers), start=1):
+        if chunks is None:
+            relative = str(path.relative_to(pdf_dir))
+            failed.append({"path": relative, "error": str(stats)})
+            monitor.log_error(f"Bulk ingestion of {relative} failed: {stats}")
+            log(f"[{number}/{len(paths)}] {relative}: FAILED ({stats})")
+            continue
+        builder.add(stats["path"], chunks)
+        documents.append(stats)
+        monitor.event("bulk_ingest_document", **stats)
+        log(f"[{number}/{len(paths)}] {stats['path']}: {stats['pages']} pages, {stats['chunks']} chunks")
+
+    knowledge_base = builder.finish()
+    meta = {
+        "num_pages": sum(d["pages"] for d in documents),
+        "num_chunks": len(builder.chunk_sizes),
+        "chunk_sizes": builder.chunk_sizes,
+        "text_sample": builder.text_sample,
+    }
+    manifest = publish(output_dir, knowledge_base, meta, {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "source_dir": str(Path(pdf_dir).resolve()),
+        "settings": index_settings(embeddings),
+        "num_documents": len(documents),
+        "num_pages": meta["num_pages"],
+        "num_chunks": meta["num_chunks"],
+        "seconds": round(time.perf_counter() - start, 3),
+        "documents": documents,
+        "failed": failed,
+    }, keep_versions=keep_versions)
+    monitor.event("bulk_ingest", **{k: v for k, v in manifest.items() if k not in ("documents", "settings")})
+    return manifest
+
+
+def sync_library(pdf_dir, output_dir, embeddings, workers=None, batch_size=None, monitor=None, log=print):
+    """
+    Brings an incremental library (index_manager.py) in line with pdf_dir:
+    only new and changed PDFs are extracted and embedded, PDFs that are gone
+    are deleted, and segments are compacted when needed.
+    Returns the library's manifest.
+    """
+    monitor = monitor or Monitor()
+    workers = workers or config.EXTRACT_WORKERS or os.cpu_count() or 1
+    batch_size = batch_size or config.EMBED_BATCH_SIZE * config.EMBED_MAX_CONCURRENCY
+    start = time.perf_counter()
+    manager = IndexManager(output_dir, embeddings, settings=index_settings(embeddings), monitor=monitor)
+    indexed = manager.documents
+    paths = find_pdfs(pdf_dir)
+    present = {str(path.relative_to(pdf_dir)): path for path in paths}
+    changed = [
+        path for relative, path in present.items()
+        if indexed.get(relative, {}).get("sha256") != hashlib.sha256(path.read_bytes()).hexdigest()
+    ]
+    removed = [doc_id for doc_id in indexed if doc_id not in present]
+    log(f"{len(changed)} new or changed, {len(removed)} removed, {len(present) - len(changed)} unchanged")
+
+    if removed:
+        manager.update(deleted=removed)
+    batch, batch_chunks = [], 0
+    for number, (path, stats, chunks) in enumerate(iter_processed(changed, pdf_dir, workers), start=1):
+        if chunks is None:
+            relative = str(path.relative_to(pdf_dir))
+            monitor.log_error(f"Bulk ingestion of {relative} failed: {stats}")
+            log(f"[{number}/{len(changed)}] {relative}: FAILED ({stats})")
+            continue
+        # Also when there are no chunks: the empty version replaces the old
+        # one and is recorded, so it is not extracted again on the next sync
+        batch.append((stats["path"], chunks, stats))
+        batch_chunks += len(chunks)
+        log(f"[{number}/{len(changed)}] {stats['path']}: {stats['pages']} pages, {stats['chunks']} chunks")
+        if batch_chunks >= batch_size:
+            manager.update(added=batch)
+            batch, batch_chunks = [], 0
+    if batch:
+        manager.update(added=batch)
+    compacted = manager.maybe_compact()
+    if compacted:
+        log(f"Compacted {compacted} segments")
+    manifest = manager.manifest()
+    monitor.event(
+        "library_sync", version=manifest["version"], added=len(changed), removed=len(removed),
+        segments=len(manifest["segments"]), seconds=round(time.perf_counter() - start, 3),
+    )
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index a directory of PDFs for the PDF Q&A apps.")
+    parser.add_argument("pdf_dir", help="directory searched recursively for *.pdf files")
+    parser.add_argument("--output", default=config.LIBRARY_DIR or "library", help="library directory (default: LIBRARY_DIR or ./library)")
+    parser.add_argument("--workers", type=int, default=0, help="extraction processes (0 = EXTRACT_WORKERS or one per CPU core)")
+    parser.add_argument("--batch-size", type=int, default=0, help="chunks embedded per batch (0 = EMBED_BATCH_SIZE x EMBED_MAX_CONCURRENCY)")
+    parser.add_argument("--keep-versions", type=int, default=0, help="library versions kept on disk (0 = LIBRARY_KEEP_VERSIONS)")
+    parser.add_argument("--incremental", action="store_true", help="update a segmented library in place, embedding only new or changed PDFs")
+    args = parser.parse_args(argv)
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key and needs_api_key():
+        print("GOOGLE_API_KEY not found in environment variables", file=sys.stderr)
+        return 1
+
+    monitor = Monitor()
+    if args.incremental:
+        try:
+            manifest = sync_library(
+                args.pdf_dir, args.output, create_embeddings(api_key, monitor=monitor),
+                workers=args.workers, batch_size=args.batch_size, monitor=monitor,
+            )
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        print(
+            f"Updated {args.output} to version {manifest['version']}: {manifest['num_documents']} documents "
+            f"in {len(manifest['segments'])} segments"
+        )
+        return 0
+    try:
+        manifest = build_library(
+            args.pdf_dir, args.output, create_embeddings(api_key, monitor=monitor),
+            workers=args.workers, batch_size=args.batch_size,
+            keep_versions=args.keep_versions, monitor=monitor,
+        )
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(
+        f"Published {args.output}/{manifest['artifacts']}: {manifest['num_documents']} documents, "
+        f"{manifest['num_pages']} pages, {manifest['num_chunks']} chunks in {manifest['seconds']:.1f}s"
+        + (f" ({len(manifest['failed'])} failed)" if manifest["failed"] else "")
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""
+Page-aware, token-aware streaming chunker.
+
+Pages arrive one at a time (see extraction.iter_pages). Lines repeated at the
+top or bottom of several pages - running headers, footers, page numbers - are
+dropped before chunking. The remaining lines are packed into chunks of up to
+CHUNK_TOKENS tokens with CHUNK_OVERLAP_TOKENS of overlap, counted with a fast,
+cached tokenizer rather than characters. Every chunk records the pages it
+spans and its UTF-8 byte range in the extracted text (the concatenation of
+all page texts), so sources can be cited by page and adjacent chunks can be
+merged exactly.
+"""
+
+import re
+from collections import Counter, deque
+from functools import lru_cache
+
+import config
+
+# Words, numbers and single punctuation marks, roughly how subword tokenizers split text
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_DIGITS = re.compile(r"\d+")
+# "Page 3", "p. 3", "Page 3 of 12", "3 of 12", "3/12"
+_PAGE_MARKER = re.compile(r"\b(?:page|pg|p\.)\s*\d+(?:\s*(?:of|/)\s*\d+)?|\b\d+\s*(?:of|/)\s*\d+\b")
+
+
+@lru_cache(maxsize=1 << 16)
+def _piece_tokens(piece):
+    # Common short words are one token; longer ones split into ~4-character pieces
+    return 1 if len(piece) <= 6 else (len(piece) + 3) // 4
+
+
+def count_tokens(text):
+    """
+    Approximate model token count. Pieces are cached, so repeated vocabulary
+    is counted with dictionary lookups.
+    """
+    return sum(_piece_tokens(piece) for piece in _PIECES.findall(text))
+
+
+class Chunk:
+    """
+    One chunk of text plus where it came from.
+    """
+
+    __slots__ = ("text", "page_start", "page_end", "byte_start", "byte_end", "tokens")
+
+    def __init__(self, text, page_start, page_end, byte_start, byte_end, tokens):
+        self.text = text
+        self.page_start = page_start
+        self.page_end = page_end
+        self.byte_start = byte_start
+        self.byte_end = byte_end
+        self.tokens = tokens
+
+    def metadata(self):
+        return {
+            "page_start": self.page_start,
+            "page_end": self.page_end,
+            "byte_start": self.byte_start,
+            "byte_end": self.byte_end,
+        }
+
+    def __repr__(self):
+        return f"Chunk(pages={self.page_start}-{self.page_end}, bytes={self.byte_start}-{self.byte_end}, tokens={self.tokens})"
+
+
+class _Unit:
+    # A line (or part of an overlong line) - the smallest piece chunks are built from
+    __slots__ = ("text", "page", "byte_start", "byte_end", "tokens")
+
+    def __init__(self, text, page, byte_start, byte_end, tokens):
+        self.text = text
+        self.page = page
+        self.byte_start = byte_start
+        self.byte_end = byte_end
+        self.tokens = tokens
+
+
+def _signature(line):
+    # Page numbers change from page to page; the rest of a header does not.
+    # Numbers elsewhere must repeat exactly, so "Article 1" / "Article 2" at
+    # the top of pages are content, not a running header.
+    line = line.strip().lower()
+    if not any(ch.isalpha() for ch in line):
+        # A bare page number or date such as "12", "- 12 -" or "03/01/2024"
+        return _DIGITS.sub("#", line)
+    return _PAGE_MARKER.sub(lambda match: _DIGITS.sub("#", match.group()), line)
+
+
+def _edge_signatures(lines, edge_lines):
+    content = [line for line in lines if line.strip()]
+    edges = content[:edge_lines] + content[-edge_lines:]
+    return {_signature(line) for line in edges if len(line.strip()) <= config.CHUNK_BOILERPLATE_MAX_CHARS}
+
+
+def iter_lines(pages, lookahead=None, edge_lines=2, min_pages=2):
+    """
+    Splits (page number, text) pairs into lines with their byte ranges,
+    dropping headers and footers. A line counts as boilerplate when it sits
+    within edge_lines of the top or bottom of its page and a line with the
+    same signature does so on at least min_pages pages among those read so
+    far, which include `lookahead` pages after the current one.
+    Yields (line, page number, byte start, byte end).
+    """
+    lookahead = config.CHUNK_BOILERPLATE_LOOKAHEAD if lookahead is None else lookahead
+    separator = config.CHUNK_SEPARATOR
+    separator_bytes = len(separator.encode("utf-8"))
+    counts = Counter()
+    buffer = deque()
+    offset = 0
+
+    def emit(page_number, lines, base, edges):
+        position = base
+        for line in lines:
+            size = len(line.encode("utf-8"))
+            boilerplate = counts[_signature(line)] >= min_pages and _signature(line) in edges
+            if line.strip() and not boilerplate:
+                yield line, page_number, position, position + size
+            position += size + separator_bytes
+
+    for page_number, text in pages:
+        lines = text.split(separator)
+        edges = _edge_signatures(lines, edge_lines)
+        counts.update(edges)
+        buffer.append((page_number, lines, offset, edges))
+        offset += len(text.encode("utf-8"))
+        if len(buffer) > lookahead:
+            yield from emit(*buffer.popleft())
+    while buffer:
+        yield from emit(*buffer.popleft())
+
+
+def _units(lines, max_tokens):
+    """
+    One unit per line; lines longer than max_tokens are split between words.
+    """
+    for line, page_number, byte_start, byte_end in lines:
+        tokens = count_tokens(line)
+        if tokens <= max_tokens:
+            yield _Unit(line, page_number, byte_start, byte_end, tokens)
+            continue
+        piece_start, piece_tokens = 0, 0
+        for match in re.finditer(r"\S+\s*", line):
+            word_tokens = count_tokens(match.group())
+            if piece_tokens and piece_tokens + word_tokens > max_tokens:
+                piece = line[piece_start:match.start()]
+                start = byte_start + len(line[:piece_start].encode("utf-8"))
+                yield _Unit(piece, page_number, start, start + len(piece.encode("utf-8")), piece_tokens)
+                piece_start, piece_tokens = match.start(), 0
+            piece_tokens += word_tokens
+        piece = line[piece_start:]
+        start = byte_start + len(line[:piece_start].encode("utf-8"))
+        yield _Unit(piece, page_number, start, start + len(piece.encode("utf-8")), piece_tokens)
+
+
+def _make_chunk(units):
+    return Chunk(
+        config.CHUNK_SEPARATOR.join(unit.text for unit in units),
+        units[0].page,
+        units[-1].page,
+        units[0].byte_start,
+        units[-1].byte_end,
+        sum(unit.tokens for unit in units),
+    )
+
+
+def iter_chunks(pages, max_tokens=None, overlap_tokens=None):
+    """
+    Chunks a stream of (page number, text) pairs without joining the whole
+    document. Yields Chunk objects in document order.
+    """
+    max_tokens = max_tokens or config.CHUNK_TOKENS
+    overlap_tokens = config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    current, tokens, fresh = [], 0, False
+    for unit in _units(iter_lines(pages), max_tokens):
+        if current and tokens + unit.tokens > max_tokens:
+            if fresh:
+                yield _make_chunk(current)
+            # The next chunk starts with the trailing units of this one
+            carry, carried = [], 0
+            for previous in reversed(current):
+                if carried + previous.tokens > overlap_tokens:
+                    break
+                carry.insert(0, previous)
+                carried += previous.tokens
+            while carry and carried + unit.tokens > max_tokens:
+                carried -= carry.pop(0).tokens
+            current, tokens, fresh = carry, carried, False
+        current.append(unit)
+        tokens += unit.tokens
+        fresh = True
+    if current and fresh:
+        yield _make_chunk(current)
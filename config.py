@@ -0,0 +1,167 @@
+"""
+Runtime settings for the PDF Q&A pipeline.
+Every value can be overridden with an environment variable (or a line in .env).
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Models
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
+# Embedding backend: "google" (EMBEDDING_MODEL via the API), "local" (in-process
+# CPU model from EMBEDDING_LOCAL_PATH, see embedding_backends.py) or "fake"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
+EMBEDDING_LOCAL_PATH = os.getenv("EMBEDDING_LOCAL_PATH", "models/local-embeddings.npz")
+EMBED_LOCAL_BATCH_SIZE = int(os.getenv("EMBED_LOCAL_BATCH_SIZE", "512"))
+EMBED_LOCAL_THREADS = int(os.getenv("EMBED_LOCAL_THREADS", str(min(8, os.cpu_count() or 1))))
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
+
+# Embedding API client: texts per request, parallel requests, quotas and 429 retries
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv("EMBED_REQUESTS_PER_MINUTE", "1500"))
+EMBED_TOKENS_PER_MINUTE = float(os.getenv("EMBED_TOKENS_PER_MINUTE", "1000000"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_BACKOFF_BASE_S = float(os.getenv("EMBED_BACKOFF_BASE_S", "1.0"))
+EMBED_BACKOFF_MAX_S = float(os.getenv("EMBED_BACKOFF_MAX_S", "60.0"))
+
+# PDF text extraction (0 workers = one per CPU core)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0"))
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "16"))
+EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv("EXTRACT_PARALLEL_MIN_PAGES", "64"))
+
+# Text chunking: chunks of up to CHUNK_TOKENS model tokens built from lines
+# (CHUNK_SEPARATOR), overlapping by up to CHUNK_OVERLAP_TOKENS. Lines of at most
+# CHUNK_BOILERPLATE_MAX_CHARS repeated at the top or bottom of pages (headers,
+# footers) are dropped, judged over CHUNK_BOILERPLATE_LOOKAHEAD pages ahead.
+CHUNK_SEPARATOR = "\n"
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "350"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+CHUNK_BOILERPLATE_LOOKAHEAD = int(os.getenv("CHUNK_BOILERPLATE_LOOKAHEAD", "3"))
+CHUNK_BOILERPLATE_MAX_CHARS = int(os.getenv("CHUNK_BOILERPLATE_MAX_CHARS", "120"))
+
+# Streaming ingestion: chunks per embedding batch, and items buffered between stages
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+
+# Vector index: "auto" keeps an exact flat index below INDEX_FLAT_MAX_VECTORS and
+# switches to IVF above it ("flat" / "ivf" / "hnsw" force a type). Quantization:
+# "none", "fp16", "int8" or "pq". nprobe / efSearch are tuned to the target recall@k.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "int8")
+INDEX_FLAT_MAX_VECTORS = int(os.getenv("INDEX_FLAT_MAX_VECTORS", "20000"))
+INDEX_TARGET_RECALL = float(os.getenv("INDEX_TARGET_RECALL", "0.95"))
+
+# Retrieval: "hybrid" fuses BM25 and vector rankings (reciprocal rank fusion over
+# HYBRID_CANDIDATES from each), "vector" / "lexical" use one of them. The lexical
+# fast path skips the query embedding when an identifier in the question occurs
+# in the index and the best BM25 match scores LEXICAL_FAST_PATH_MARGIN times the
+# runner-up (or, as the only match, at least LEXICAL_FAST_PATH_MIN_SCORE).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "1") == "1"
+LEXICAL_FAST_PATH_MARGIN = float(os.getenv("LEXICAL_FAST_PATH_MARGIN", "1.5"))
+LEXICAL_FAST_PATH_MIN_SCORE = float(os.getenv("LEXICAL_FAST_PATH_MIN_SCORE", "1.0"))
+
+# On-disk cache of built FAISS indexes
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", ".cache/indexes")
+INDEX_CACHE_MAX_MB = float(os.getenv("INDEX_CACHE_MAX_MB", "1024"))
+# Cache entry format: "mmap" (memory-mapped float16 vectors and text blob shared
+# by all processes, see mmap_store.py) or "faiss" (FAISS files loaded per process)
+INDEX_STORE = os.getenv("INDEX_STORE", "mmap")
+
+# Pre-built library written by bulk_ingest.py; the apps load it when set
+LIBRARY_DIR = os.getenv("LIBRARY_DIR", "")
+LIBRARY_KEEP_VERSIONS = int(os.getenv("LIBRARY_KEEP_VERSIONS", "2"))
+# Incremental libraries (index_manager.py): compact a segment once this share of
+# its vectors belongs to deleted documents, and keep at most this many segments
+INDEX_COMPACT_DEAD_RATIO = float(os.getenv("INDEX_COMPACT_DEAD_RATIO", "0.3"))
+INDEX_MAX_SEGMENTS = int(os.getenv("INDEX_MAX_SEGMENTS", "8"))
+
+# Context packing: CONTEXT_CANDIDATES retrieved chunks are merged where adjacent
+# and packed best first into CONTEXT_TOKEN_BUDGET tokens. A CONTEXT_MMR_LAMBDA
+# below 1 re-ranks candidates for diversity (maximal marginal relevance).
+# Chunks up to CONTEXT_MERGE_GAP_BYTES apart are merged with a "[...]" line
+# where the text between them is left out.
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "1") == "1"
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "1.0"))
+CONTEXT_MERGE_GAP_BYTES = int(os.getenv("CONTEXT_MERGE_GAP_BYTES", "200"))
+
+# Chat history sent to the chain: the last HISTORY_MAX_TURNS turns within
+# HISTORY_MAX_TOKENS; older turns are folded into a rolling summary of at most
+# HISTORY_SUMMARY_TOKENS ("extractive", or "llm" for a summary written by the
+# LLM of deploy/streamlit_app.py).
+# Questions with at least HISTORY_MIN_STANDALONE_WORDS words that do not refer
+# back to the conversation skip the condense-question LLM call.
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "6"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1500"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+HISTORY_SUMMARIZER = os.getenv("HISTORY_SUMMARIZER", "extractive")
+HISTORY_MIN_STANDALONE_WORDS = int(os.getenv("HISTORY_MIN_STANDALONE_WORDS", "5"))
+
+# Semantic answer cache: standalone questions whose embedding is at least this
+# cosine-similar to an earlier one about the same document reuse its answer
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+
+# Clients, chains and indexes shared by all sessions of one process; indexes
+# no session uses are evicted (least recently used first) above this budget
+REGISTRY_MAX_MB = float(os.getenv("REGISTRY_MAX_MB", "2048"))
+
+# Per-chunk embedding cache shared across documents and sessions
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+# Also cache question embeddings (off: each would add a write to the query path)
+EMBEDDING_CACHE_QUERIES = os.getenv("EMBEDDING_CACHE_QUERIES", "0") == "1"
+
+# Monitoring: JSON-lines events, optional prose log for learners, latency histograms
+MONITOR_EVENTS_FILE = os.getenv("MONITOR_EVENTS_FILE", "monitor.jsonl")
+MONITOR_LOG_FILE = os.getenv("MONITOR_LOG_FILE", "monitor.log")
+MONITOR_VERBOSE = os.getenv("MONITOR_VERBOSE", "0") == "1"
+MONITOR_HISTOGRAMS = os.getenv("MONITOR_HISTOGRAMS", "1") == "1"
+# Opt-in: questions slower than this end to end (0 disables) are appended, with
+# what is needed to replay them offline (slow_queries.py), to the slow-query
+# log. Entries hold the question, chat history, answer and retrieved chunk
+# texts in plain text. The log rotates at SLOW_QUERY_LOG_MAX_MB, keeping
+# SLOW_QUERY_LOG_BACKUPS older files
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "slow_queries.jsonl")
+SLOW_QUERY_LOG_MAX_MB = float(os.getenv("SLOW_QUERY_LOG_MAX_MB", "50"))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "1"))
+
+# HTTP service (service.py) and the Streamlit apps' use of it
+QA_SERVICE_URL = os.getenv("QA_SERVICE_URL", "")
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "16"))
+# Documents indexing at once, and questions answered at once (with at most
+# SERVICE_MAX_WAITING more queued); requests beyond that get 503
+SERVICE_MAX_INGESTS = int(os.getenv("SERVICE_MAX_INGESTS", "4"))
+SERVICE_MAX_QUESTIONS = int(os.getenv("SERVICE_MAX_QUESTIONS", "8"))
+SERVICE_MAX_WAITING = int(os.getenv("SERVICE_MAX_WAITING", "32"))
+SERVICE_TIMEOUT_S = float(os.getenv("SERVICE_TIMEOUT_S", "60"))
+SERVICE_MAX_UPLOAD_MB = int(os.getenv("SERVICE_MAX_UPLOAD_MB", "200"))
+# Uploaded documents the service keeps loaded; beyond that the least recently
+# used indexed ones are released (their clients get 404 and upload again)
+SERVICE_MAX_DOCUMENTS = int(os.getenv("SERVICE_MAX_DOCUMENTS", "32"))
+
+# Batch question answering (batch_qa.py): LLM calls in flight at once, and the
+# LLM quota they are paced to; 429s are retried with the EMBED_BACKOFF_* backoff
+BATCH_QA_CONCURRENCY = int(os.getenv("BATCH_QA_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "1000"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "6"))
+# Largest batch service.py accepts in one request
+BATCH_QA_MAX_QUESTIONS = int(os.getenv("BATCH_QA_MAX_QUESTIONS", "500"))
+
+# Cold start: seconds the app module may take to import before the upload page
+# renders (checked by startup_profile.py and deploy/deploy.py)
+STARTUP_BUDGET_S = float(os.getenv("STARTUP_BUDGET_S", "1.5"))
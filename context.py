@@ -0,0 +1,140 @@
+"""
+Context packing between retrieval and the LLM prompt.
+
+Retrieval returns a ranked list of overlapping chunks. Sending a fixed top-k
+of them repeats the overlap text and splits one passage into several
+fragments. pack_context() instead:
+
+- optionally re-ranks the candidates with maximal marginal relevance (MMR),
+  computed with numpy over the vectors already stored in the FAISS index;
+- takes candidates in rank order while they fit CONTEXT_TOKEN_BUDGET;
+- merges chunks that are adjacent or overlapping in the document (by their
+  byte ranges) into one passage, dropping the repeated overlap lines; chunks
+  up to CONTEXT_MERGE_GAP_BYTES apart are merged too, with an elision line
+  ("[...]") where the text between them is left out.
+
+The packed passages are what the LLM sees and what the apps show as sources.
+"""
+
+import numpy as np
+from langchain_core.documents import Document
+
+import config
+from chunking import count_tokens
+
+# Stands in for document text skipped between two merged chunks
+ELISION = "[...]"
+
+
+def mmr_order(query_vector, vectors, lambda_mult):
+    """
+    Order of the rows of `vectors` by maximal marginal relevance to the query:
+    lambda_mult * similarity to the query - (1 - lambda_mult) * the highest
+    similarity to anything already picked.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    order = [int(np.argmax(relevance))]
+    redundancy = similarity[order[0]].copy()
+    picked = np.zeros(len(vectors), dtype=bool)
+    picked[order[0]] = True
+    for _ in range(len(vectors) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[picked] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        picked[best] = True
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return order
+
+
+def _mergeable(previous, current):
+    a, b = previous.metadata, current.metadata
+    return (
+        a.get("source") == b.get("source")
+        and b["byte_start"] <= a["byte_end"] + config.CONTEXT_MERGE_GAP_BYTES
+    )
+
+
+def _merge(previous, current):
+    """
+    previous followed by the part of current it does not already contain.
+    Chunks overlap by whole lines, so the overlap is the longest suffix of
+    previous' lines that is also a prefix of current's lines. A gap between
+    them is marked with an ELISION line.
+    """
+    separator = config.CHUNK_SEPARATOR
+    head = previous.page_content.split(separator)
+    tail = current.page_content.split(separator)
+    overlap = next(
+        (n for n in range(min(len(head), len(tail)), 0, -1) if head[-n:] == tail[:n]), 0
+    )
+    # Consecutive lines are one separator apart; anything more was skipped
+    # and must not read as contiguous text
+    gap = current.metadata["byte_start"] - previous.metadata["byte_end"]
+    if not overlap and gap > len(separator.encode("utf-8")):
+        tail = [ELISION] + tail
+    metadata = dict(previous.metadata)
+    metadata.update(
+        page_end=max(previous.metadata["page_end"], current.metadata["page_end"]),
+        byte_end=max(previous.metadata["byte_end"], current.metadata["byte_end"]),
+        chunks=previous.metadata.get("chunks", 1) + current.metadata.get("chunks", 1),
+    )
+    return Document(page_content=separator.join(head + tail[overlap:]), metadata=metadata)
+
+
+def merge_adjacent(docs):
+    """
+    Merges chunks that touch or overlap in the document. Passages keep the
+    rank of their best chunk: the result is ordered like `docs`.
+    """
+    ranked = sorted(
+        enumerate(docs),
+        key=lambda item: (str(item[1].metadata.get("source", "")), item[1].metadata["byte_start"]),
+    )
+    passages = []  # [rank, document]
+    for rank, doc in ranked:
+        if passages and _mergeable(passages[-1][1], doc):
+            passages[-1] = [min(passages[-1][0], rank), _merge(passages[-1][1], doc)]
+        else:
+            passages.append([rank, doc])
+    return [doc for _, doc in sorted(passages, key=lambda passage: passage[0])]
+
+
+def pack_context(knowledge_base, docs, query_vector=None, budget=None, mmr_lambda=None):
+    """
+    Selects and merges retrieved chunks (best first) into passages that fit
+    the token budget. Chunks without byte ranges (e.g. built before chunk
+    metadata existed) are only budgeted, not merged.
+    """
+    budget = budget or config.CONTEXT_TOKEN_BUDGET
+    mmr_lambda = config.CONTEXT_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    if not docs:
+        return []
+
+    store = knowledge_base if hasattr(knowledge_base, "vector_ids") else None
+    if mmr_lambda < 1 and query_vector is not None and store is not None and len(docs) > 2:
+        ids = store.vector_ids(docs)
+        try:
+            vectors = np.vstack([store.index.reconstruct(i) for i in ids]) if None not in ids else None
+        except RuntimeError:
+            # IVF indexes without a direct map cannot return stored vectors
+            vectors = None
+        if vectors is not None:
+            docs = [docs[i] for i in mmr_order(query_vector, vectors, mmr_lambda)]
+
+    can_merge = all("byte_start" in doc.metadata for doc in docs)
+    selected, packed = [], []
+    for doc in docs:
+        candidate = merge_adjacent(selected + [doc]) if can_merge else selected + [doc]
+        candidate_tokens = sum(count_tokens(passage.page_content) for passage in candidate)
+        if candidate_tokens > budget:
+            # Always send at least the best chunk
+            if not selected:
+                selected, packed = [doc], [doc]
+            continue
+        selected, packed = selected + [doc], candidate
+    return packed
@@ -8,6 +8,9 @@ import sys
 import subprocess
 from pathlib import Path
 
+# startup_profile.py and the app's modules live in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
 def check_requirements():
     """Check if all required files exist"""
     required_files = [
@@ -64,7 +67,7 @@ def check_api_key():
     return False
 
 def test_local_run():
-    """Test if the app can run locally"""
+    """Test that the app imports cleanly and within its cold-start budget"""
     try:
         print("🧪 Testing local run...")
         # Test basic imports first
@@ -73,29 +76,27 @@ def test_local_run():
             "import streamlit; import os; print('Basic imports successful')"
         ], capture_output=True, text=True, timeout=15)
         
-        if result.returncode == 0:
-            print("✅ Basic imports test passed")
-            
-            # Test app import with longer timeout
-            result = subprocess.run([
-                sys.executable, "-c", 
-                "import streamlit_app; print('App import successful')"
-            ], capture_output=True, text=True, timeout=30)
-            
-            if result.returncode == 0:
-                print("✅ App import test passed")
-                return True
-            else:
-                print(f"⚠️  App import test failed: {result.stderr}")
-                print("   This might be due to missing dependencies. Try installing requirements first.")
-                return False
-        else:
+        if result.returncode != 0:
             print(f"❌ Basic imports failed: {result.stderr}")
             return False
+        print("✅ Basic imports test passed")
+        
+        # Import the app in a fresh interpreter, timing each startup stage;
+        # heavy modules must not load before the upload page renders
+        import startup_profile
+        ok, problems, report = startup_profile.check("streamlit_app", path=Path.cwd())
+        for stage in report["stages"]:
+            print(f"   {stage['stage']:<14} {stage['seconds']:.2f}s")
+        if not ok:
+            for problem in problems:
+                print(f"❌ Cold start check failed: {problem}")
+            print("   Run: python startup_profile.py --module streamlit_app --path deploy")
+            return False
+        print("✅ App import test passed")
+        return True
     except subprocess.TimeoutExpired:
-        print("⚠️  Import test timed out - this is normal for first run")
-        print("   Dependencies are being downloaded. Try running again.")
-        return True  # Don't fail on timeout
+        print("❌ Import test timed out")
+        return False
     except Exception as e:
         print(f"❌ Local test error: {e}")
         return False
@@ -1,13 +1,16 @@
 import streamlit as st
 import os
+import sys
+from pathlib import Path
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAI
-from langchain.chains import ConversationalRetrievalChain
-from pydantic import SecretStr
+
+# The ingestion pipeline lives in the repository root, shared with app.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import config
+from history import ChatHistory
+from library import read_manifest
+from rate_limits import is_rate_limit_error
+from ui import show_batch_qa, show_ingest_progress, show_trace
 
 # Load environment variables
 load_dotenv()
@@ -22,9 +25,15 @@ def main():
     st.title("📚 PDF Question & Answer Assistant")
     st.markdown("Upload a PDF and ask questions about its content!")
     
+    # With QA_SERVICE_URL set, service.py indexes and answers; this app is only the UI
+    remote = None
+    if config.QA_SERVICE_URL:
+        from service_client import default_client
+        remote = default_client()
+    
     # Check for API key
     api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
+    if not api_key and remote is None:
         st.error("⚠️ GOOGLE_API_KEY not found. Please add it to your Streamlit secrets.")
         st.info("To add your API key, go to your Streamlit app settings and add it as a secret.")
         return
@@ -35,53 +44,70 @@ def main():
         type=['pdf'],
         help="Upload a PDF file to analyze"
     )
+    # Without an upload, questions go to the library pre-built by bulk_ingest.py
+    library = read_manifest(config.LIBRARY_DIR) if config.LIBRARY_DIR and uploaded_file is None else None
     
-    if uploaded_file is not None:
+    if uploaded_file is not None or library is not None:
+        # LangChain, FAISS, PyPDF2 and the Gemini client load here, on first use,
+        # so the upload page renders without waiting for them
+        from pipeline import acquire_ingest, acquire_library, shared_chain, shared_embeddings, shared_llm
+        from qa import ask_stream
+
         try:
-            # Extract text from PDF
-            with st.spinner("📖 Reading PDF..."):
-                pdf_reader = PdfReader(uploaded_file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-            
-            st.success(f"✅ Successfully read {len(pdf_reader.pages)} pages")
+            # Clients, chains and indexes are shared by all sessions of this process
+            embeddings = shared_embeddings(api_key) if remote is None else None
             
-            # Split text into chunks
-            with st.spinner("✂️ Processing text..."):
-                text_splitter = CharacterTextSplitter(
-                    separator="\n",
-                    chunk_size=1000,
-                    chunk_overlap=200,
-                    length_function=len
-                )
-                chunks = text_splitter.split_text(text)
+            # Read, split and embed the PDF in the background (served from the
+            # index cache on repeat uploads); started once per uploaded file
+            source_id = uploaded_file.file_id if uploaded_file is not None else f"library:{library['version']}"
+            if st.session_state.get("ingest_file_id") != source_id:
+                if remote is not None:
+                    st.session_state.ingest_lease = (
+                        remote.ingest(uploaded_file.getvalue()) if uploaded_file is not None else remote.library()
+                    )
+                elif uploaded_file is not None:
+                    st.session_state.ingest_lease = acquire_ingest(uploaded_file.getvalue(), embeddings)
+                else:
+                    st.session_state.ingest_lease = acquire_library(config.LIBRARY_DIR, embeddings)
+                st.session_state.ingest_file_id = source_id
+            job = st.session_state.ingest_lease.value
+            if library is not None:
+                st.info(f"📚 Using the document library: {library['num_documents']} documents, {library['num_pages']} pages")
             
-            # Create embeddings
-            with st.spinner("🧠 Creating embeddings..."):
-                embeddings = GoogleGenerativeAIEmbeddings(
-                    model="models/embedding-001",
-                    google_api_key=SecretStr(api_key)
-                )
-                knowledge_base = FAISS.from_texts(chunks, embeddings)
+            if job.error is not None:
+                raise job.error
+            if not job.done:
+                show_ingest_progress(job)
+            if job.knowledge_base is None:
+                return
+            # Until indexing finishes, questions are answered from the partial index
+            knowledge_base = job.knowledge_base if job.done else job
+            if job.done:
+                st.success(f"✅ Successfully read {job.total_pages} pages")
             
             # Create conversation chain
-            with st.spinner("🔗 Setting up AI assistant..."):
-                llm = GoogleGenerativeAI(
-                    model="gemini-1.5-flash",
-                    google_api_key=SecretStr(api_key)
-                )
-                chain = ConversationalRetrievalChain.from_llm(
-                    llm=llm,
-                    retriever=knowledge_base.as_retriever(),
-                    return_source_documents=True
-                )
+            if remote is None:
+                with st.spinner("🔗 Setting up AI assistant..."):
+                    chain = shared_chain(job, shared_llm(api_key), return_source_documents=True)
             
-            st.success("🎉 Ready to answer questions!")
+            if job.done:
+                st.success("🎉 Ready to answer questions!")
+                # A whole list of questions at once: one batched retrieval, concurrent LLM calls
+                if remote is None:
+                    from batch_qa import answer_batch
+                    answer_all = lambda questions, on_result: answer_batch(
+                        chain, job.knowledge_base, questions, document_key=job.key, on_result=on_result
+                    )
+                else:
+                    answer_all = lambda questions, on_result: job.ask_batch(questions)
+                show_batch_qa(answer_all, job.key)
             
-            # Initialize chat history
+            # Initialize chat history: messages are displayed, chat_history is
+            # the token-budgeted (question, answer) history sent to the chain
             if "messages" not in st.session_state:
                 st.session_state.messages = []
+            if "chat_history" not in st.session_state:
+                st.session_state.chat_history = ChatHistory(llm=shared_llm(api_key) if api_key else None)
             
             # Display chat messages
             for message in st.session_state.messages:
@@ -97,39 +123,55 @@ def main():
                 
                 # Get AI response
                 with st.chat_message("assistant"):
-                    with st.spinner("🤔 Thinking..."):
-                        try:
-                            response = chain.invoke({
-                                "question": prompt,
-                                "chat_history": [(msg["content"], "") for msg in st.session_state.messages[:-1]]
-                            })
-                            
-                            answer = response["answer"]
-                            
-                            # Add assistant response to chat history
-                            st.session_state.messages.append({"role": "assistant", "content": answer})
-                            st.markdown(answer)
-                            
-                            # Show sources if available
-                            if response.get("source_documents"):
-                                with st.expander("📄 View Sources"):
-                                    for i, doc in enumerate(response["source_documents"][:3]):
-                                        st.markdown(f"**Source {i+1}:**")
-                                        st.markdown(doc.page_content[:300] + "...")
-                                        
-                        except Exception as e:
-                            error_msg = f"Sorry, I encountered an error: {str(e)}"
-                            st.error(error_msg)
-                            st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                    try:
+                        with st.spinner("🤔 Thinking..."):
+                            if remote is None:
+                                response, answer_tokens = ask_stream(
+                                    chain,
+                                    knowledge_base,
+                                    prompt,
+                                    st.session_state.chat_history.pairs(),
+                                    document_key=job.key
+                                )
+                            else:
+                                response, answer_tokens = job.ask_stream(
+                                    prompt, st.session_state.chat_history.pairs()
+                                )
+                        
+                        # Stream the answer as it is generated
+                        st.write_stream(answer_tokens)
+                        answer = response["answer"]
+                        
+                        # Add assistant response to chat history
+                        st.session_state.messages.append({"role": "assistant", "content": answer})
+                        st.session_state.chat_history.append(prompt, answer)
+                        
+                        # Show sources if available
+                        if response.get("source_documents"):
+                            with st.expander("📄 View Sources"):
+                                for i, doc in enumerate(response["source_documents"][:3]):
+                                    start, end = doc.metadata.get("page_start"), doc.metadata.get("page_end")
+                                    pages = "" if start is None else f" (page {start})" if start == end else f" (pages {start}-{end})"
+                                    st.markdown(f"**Source {i+1}{pages}:**")
+                                    st.markdown(doc.page_content[:300] + "...")
+                        
+                        # Latency breakdown of this answer
+                        show_trace(response["trace"])
+                                    
+                    except Exception as e:
+                        error_msg = f"Sorry, I encountered an error: {str(e)}"
+                        st.error(error_msg)
+                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
             
             # Clear chat button
             if st.button("🗑️ Clear Chat History"):
                 st.session_state.messages = []
+                st.session_state.chat_history.clear()
                 st.rerun()
                 
         except Exception as e:
             st.error(f"❌ Error processing PDF: {str(e)}")
-            if "quota" in str(e).lower() or "429" in str(e):
+            if is_rate_limit_error(e):
                 st.warning("Rate limit exceeded. Please try again later.")
     
     else:
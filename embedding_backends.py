@@ -0,0 +1,243 @@
+"""
+Pluggable embedding backends, selected by EMBEDDING_BACKEND.
+
+- "google": Gemini embeddings (EMBEDDING_MODEL) over the network; wrapped by
+  pipeline.create_embeddings() for rate limiting and caching.
+- "local":  an in-process CPU model loaded from EMBEDDING_LOCAL_PATH; no API
+  key, no network, no quota.
+- "fake":   the deterministic stand-in from benchmarks/fakes.py, for tests
+  and offline runs.
+
+Every backend exposes a `model` identity. It goes into the index settings,
+the embedding cache keys and the saved indexes (see lexical.HybridFAISS), so
+vectors from different models are never mixed in one index.
+
+The local model is a static embedding model: one vector per vocabulary word
+(optionally weighted, e.g. by IDF) plus hashed buckets for unknown words; a
+text's embedding is the normalized weighted mean of its word vectors. It is
+stored as one .npz file (see save_local_model()) and evaluated with numpy
+gathers and segment sums over large batches, split across threads. No model
+ships with the repository; build one from pretrained word vectors in text
+form (GloVe .txt, fastText .vec):
+
+    python embedding_backends.py glove.6B.300d.txt --max-words 200000
+    python embedding_backends.py cc.en.300.vec --buckets 50000 --output models/en.npz
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import config
+
+BACKENDS = ("google", "local", "fake")
+# Backends that call an API and benefit from rate limiting and the embedding cache
+REMOTE_BACKENDS = ("google", "fake")
+
+_WORD = re.compile(r"\w+")
+_BUILD_COMMAND = "python embedding_backends.py <word vectors .txt/.vec>"
+
+
+def model_id(embeddings):
+    """
+    The identity of an embeddings model, as recorded with its vectors.
+    """
+    return getattr(embeddings, "model", type(embeddings).__name__)
+
+
+def save_local_model(path, vocabulary, vectors, weights=None, buckets=0, name=None):
+    """
+    Writes a local model file. `vectors` has one row per vocabulary word
+    followed by `buckets` rows for hashed unknown words; `weights` (optional)
+    has one weight per row.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) != len(vocabulary) + buckets:
+        raise ValueError(f"Expected {len(vocabulary) + buckets} vectors, got {len(vectors)}")
+    np.savez(
+        path,
+        vocabulary=np.asarray(json.dumps(list(vocabulary))),
+        vectors=vectors,
+        weights=np.ones(len(vectors), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32),
+        buckets=np.asarray(buckets),
+        name=np.asarray(name or Path(path).stem),
+    )
+
+
+def read_word_vectors(path, max_words=0):
+    """
+    (vocabulary, vectors) from a word-vector text file: one "word v1 v2 ..."
+    line per word, optionally after a "count dim" header (fastText). Words
+    are lowercased like the tokenizer; the first (most frequent) vector of a
+    word is kept.
+    """
+    vocabulary, vectors, seen = [], [], set()
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            parts = line.rstrip().split(" ")
+            if len(parts) <= 2:
+                continue
+            word = parts[0].lower()
+            if word in seen or not _WORD.fullmatch(word):
+                continue
+            if vectors and len(parts) - 1 != len(vectors[0]):
+                raise ValueError(f"{path}: {word!r} has {len(parts) - 1} values, expected {len(vectors[0])}")
+            seen.add(word)
+            vocabulary.append(word)
+            vectors.append(np.asarray(parts[1:], dtype=np.float32))
+            if max_words and len(vocabulary) >= max_words:
+                break
+    if not vocabulary:
+        raise ValueError(f"No word vectors found in {path}")
+    return vocabulary, np.vstack(vectors)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Static word-vector embeddings computed in-process on the CPU.
+    """
+
+    def __init__(self, path=None, batch_size=None, threads=None):
+        path = Path(path or config.EMBEDDING_LOCAL_PATH)
+        if not path.is_file():
+            raise ValueError(
+                f"Local embedding model not found: {path}. Build it with `{_BUILD_COMMAND} --output {path}` "
+                "(see README, Embedding Backends) or set EMBEDDING_LOCAL_PATH to an existing model"
+            )
+        with np.load(path) as data:
+            vocabulary = json.loads(str(data["vocabulary"]))
+            self.vectors = data["vectors"]
+            self.weights = data["weights"]
+            self.buckets = int(data["buckets"])
+            name = str(data["name"])
+        self.vocabulary = {word: i for i, word in enumerate(vocabulary)}
+        self.dim = self.vectors.shape[1]
+        # Identity of these exact weights, not just the file name
+        digest = hashlib.sha256(self.vectors.tobytes()).hexdigest()[:12]
+        self.model = f"local/{name}@{digest}"
+        self.batch_size = batch_size or config.EMBED_LOCAL_BATCH_SIZE
+        self.threads = threads or config.EMBED_LOCAL_THREADS
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _token_ids(self, text):
+        words = _WORD.findall(text.lower())
+        ids = list(map(self.vocabulary.get, words))
+        if None not in ids:
+            return ids
+        size, buckets = len(self.vocabulary), self.buckets
+        if not buckets:
+            return [i for i in ids if i is not None]
+        return [size + zlib.crc32(word.encode("utf-8")) % buckets if i is None else i for i, word in zip(ids, words)]
+
+    def _embed_batch(self, texts):
+        token_ids = [self._token_ids(text) for text in texts]
+        lengths = np.fromiter((len(ids) for ids in token_ids), dtype=np.int64, count=len(texts))
+        flat = np.fromiter((i for ids in token_ids for i in ids), dtype=np.int64, count=int(lengths.sum()))
+        if not len(flat):
+            return np.zeros((len(texts), self.dim), dtype=np.float32)
+        # Weighted bag of words over the words in this batch, then a single
+        # matrix product with their vectors (BLAS, which releases the GIL)
+        words, columns = np.unique(flat, return_inverse=True)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        counts = np.bincount(
+            rows * len(words) + columns, weights=self.weights[flat], minlength=len(texts) * len(words)
+        ).astype(np.float32).reshape(len(texts), len(words))
+        sums = counts @ self.vectors[words]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        return sums / np.maximum(norms, 1e-12)
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="local-embed")
+            return self._pool
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0]).tolist()
+        return np.vstack(list(self._executor().map(self._embed_batch, batches))).tolist()
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0].tolist()
+
+    def embed_queries(self, texts):
+        # Queries and documents share one vector space
+        return self.embed_documents(texts)
+
+
+def create_backend(backend=None, api_key=None):
+    """
+    The raw (unwrapped) embeddings model of the given or configured backend.
+    """
+    backend = backend or config.EMBEDDING_BACKEND
+    if backend == "google":
+        if not api_key:
+            raise ValueError("The google embedding backend needs GOOGLE_API_KEY")
+        # The Gemini SDK is slow to import and unused with other backends; load it on first use
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        from pydantic import SecretStr
+
+        return GoogleGenerativeAIEmbeddings(model=config.EMBEDDING_MODEL, google_api_key=SecretStr(api_key))
+    if backend == "local":
+        return LocalEmbeddings()
+    if backend == "fake":
+        from benchmarks.fakes import FakeEmbeddings
+
+        return FakeEmbeddings()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def backend_id(backend=None):
+    """
+    What identifies the configured model without loading it (for registry keys).
+    """
+    backend = backend or config.EMBEDDING_BACKEND
+    if backend == "google":
+        return config.EMBEDDING_MODEL
+    if backend == "local":
+        return str(Path(config.EMBEDDING_LOCAL_PATH).resolve())
+    return backend
+
+
+def needs_api_key(backend=None):
+    return (backend or config.EMBEDDING_BACKEND) == "google"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the model file of the local embedding backend.")
+    parser.add_argument("vectors", help="word vectors in text form (GloVe .txt, fastText .vec)")
+    parser.add_argument("--output", default=None, help="model file (default: EMBEDDING_LOCAL_PATH)")
+    parser.add_argument("--max-words", type=int, default=0, help="keep only the first N words (0 = all)")
+    parser.add_argument("--buckets", type=int, default=0, help="hashed random vectors for unknown words")
+    parser.add_argument("--name", default=None, help="model name (default: the output file name)")
+    args = parser.parse_args(argv)
+
+    output = Path(args.output or config.EMBEDDING_LOCAL_PATH)
+    vocabulary, vectors = read_word_vectors(args.vectors, args.max_words)
+    if args.buckets:
+        # Unknown words (identifiers, names) still match themselves exactly
+        rng = np.random.default_rng(0)
+        unknown = rng.standard_normal((args.buckets, vectors.shape[1])).astype(np.float32)
+        unknown *= np.linalg.norm(vectors, axis=1).mean() / np.linalg.norm(unknown, axis=1, keepdims=True)
+        vectors = np.vstack([vectors, unknown])
+    output.parent.mkdir(parents=True, exist_ok=True)
+    save_local_model(output, vocabulary, vectors, buckets=args.buckets, name=args.name)
+    print(f"Wrote {output}: {len(vocabulary)} words, {args.buckets} buckets, {vectors.shape[1]} dimensions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
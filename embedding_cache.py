@@ -0,0 +1,271 @@
+"""
+Persistent per-chunk embedding cache shared across documents and sessions.
+
+Vectors are keyed by a hash of (embedding model, task, text), so a chunk that
+was already embedded for another PDF - or for an earlier revision of the same
+PDF - is never sent to the embedding API again. The store is a SQLite table of
+offsets plus one packed float16 (or float32) array file, and is kept under a
+byte budget by evicting least recently used vectors.
+
+The cache directory is shared by every process on the host (the apps, the
+service, bulk ingestion). Appends and evictions run inside a SQLite write
+transaction, which serializes them across processes. Eviction writes the
+compacted vectors to a new generation file, and that file's name is committed
+in the same transaction as the rewritten offsets. A reader therefore always
+pairs offsets with the file they point into. A crash mid-eviction leaves the
+previous generation in place; only an orphaned file remains, and the next
+eviction removes it.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import config
+from embedding_client import embed_queries
+
+
+def embedding_key(model, task, text):
+    """
+    Cache key for one text embedded by one model for one task (document/query).
+    """
+    return hashlib.sha256(f"{model}\0{task}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    SQLite metadata plus a packed vector file. Safe to share between threads
+    and processes.
+    """
+
+    def __init__(self, root=None, max_bytes=None, dtype=None):
+        self.dtype = np.dtype(dtype or config.EMBEDDING_CACHE_DTYPE)
+        self.root = Path(root or config.EMBEDDING_CACHE_DIR) / self.dtype.name
+        self.root.mkdir(parents=True, exist_ok=True)
+        if max_bytes is None:
+            max_bytes = int(config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are begun explicitly below
+        self._db = sqlite3.connect(
+            str(self.root / "index.sqlite"), check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "key TEXT PRIMARY KEY, offset INTEGER, dim INTEGER, last_used REAL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        # Stores from before generations used vectors.bin; it is generation 0
+        self._db.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('vectors_file', 'vectors.bin')")
+        (self.root / self._vectors_file()).touch()
+
+    def _vectors_file(self):
+        return self._db.execute("SELECT value FROM meta WHERE name = 'vectors_file'").fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Returns {key: float32 vector} for the keys that are cached.
+        """
+        found = {}
+        with self._lock:
+            rows = []
+            # One read transaction: the file name and the offsets come from the same snapshot
+            self._db.execute("BEGIN")
+            try:
+                vectors_file = self._vectors_file()
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    rows += self._db.execute(
+                        f"SELECT key, offset, dim FROM vectors WHERE key IN ({','.join('?' * len(batch))})",
+                        batch,
+                    ).fetchall()
+                if rows:
+                    try:
+                        f = open(self.root / vectors_file, "rb")
+                    except FileNotFoundError:
+                        # Replaced by another process's eviction since the snapshot; all misses
+                        rows = []
+                if rows:
+                    with f:
+                        for key, offset, dim in rows:
+                            f.seek(offset)
+                            raw = f.read(dim * self.dtype.itemsize)
+                            if len(raw) == dim * self.dtype.itemsize:
+                                found[key] = np.frombuffer(raw, dtype=self.dtype).astype(np.float32)
+            finally:
+                self._db.execute("COMMIT")
+            if found:
+                now = time.time()
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._db.executemany(
+                        "UPDATE vectors SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                    )
+                finally:
+                    self._db.execute("COMMIT")
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """
+        Appends (key, vector) pairs to the store, then enforces the byte budget.
+        """
+        if not items:
+            return
+        block = np.ascontiguousarray(
+            np.stack([np.asarray(vector, dtype=self.dtype) for _, vector in items])
+        )
+        dim = block.shape[1]
+        with self._lock:
+            # The write lock is held from here to COMMIT, so no other process
+            # appends or evicts in between
+            self._db.execute("BEGIN IMMEDIATE")
+            replaced = new_file = None
+            try:
+                vectors_file = self._vectors_file()
+                path = self.root / vectors_file
+                with open(path, "ab") as f:
+                    base = f.seek(0, os.SEEK_END)
+                    f.write(block.tobytes())
+                now = time.time()
+                row_bytes = dim * self.dtype.itemsize
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO vectors (key, offset, dim, last_used) VALUES (?, ?, ?, ?)",
+                    [(key, base + i * row_bytes, dim, now) for i, (key, _) in enumerate(items)],
+                )
+                if path.stat().st_size > self.max_bytes:
+                    new_file = self._evict(vectors_file)
+                    replaced = vectors_file
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                if new_file is not None:
+                    (self.root / new_file).unlink(missing_ok=True)
+                raise
+        if replaced is not None:
+            # Readers that opened it before the commit keep their handle
+            (self.root / replaced).unlink(missing_ok=True)
+
+    def _evict(self, vectors_file):
+        """
+        Drops least recently used vectors until the live data fits in 80% of
+        the budget and copies the rest into a new generation file. Runs inside
+        put_many()'s write transaction, which commits the new file name with
+        the new offsets. Returns the new file name.
+        """
+        itemsize = self.dtype.itemsize
+        rows = self._db.execute(
+            "SELECT key, offset, dim FROM vectors ORDER BY last_used DESC"
+        ).fetchall()
+        keep, live = [], 0
+        for key, offset, dim in rows:
+            if live + dim * itemsize > self.max_bytes * 0.8:
+                break
+            keep.append((key, offset, dim))
+            live += dim * itemsize
+
+        generation = int(self._db.execute(
+            "SELECT COALESCE(MAX(CAST(value AS INTEGER)), 0) FROM meta WHERE name = 'generation'"
+        ).fetchone()[0]) + 1
+        new_file = f"vectors-{generation}.bin"
+        # Files of evictions that crashed before committing
+        for path in self.root.glob("vectors*.bin"):
+            if path.name not in (vectors_file, new_file):
+                path.unlink(missing_ok=True)
+
+        updates, position = [], 0
+        with open(self.root / vectors_file, "rb") as src, open(self.root / new_file, "wb") as dst:
+            for key, offset, dim in keep:
+                src.seek(offset)
+                dst.write(src.read(dim * itemsize))
+                updates.append((position, key))
+                position += dim * itemsize
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        kept_keys = {key for key, _, _ in keep}
+        self._db.executemany(
+            "DELETE FROM vectors WHERE key = ?",
+            [(key,) for key, _, _ in rows if key not in kept_keys],
+        )
+        self._db.executemany("UPDATE vectors SET offset = ? WHERE key = ?", updates)
+        self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('generation', ?)", (str(generation),))
+        self._db.execute("UPDATE meta SET value = ? WHERE name = 'vectors_file'", (new_file,))
+        return new_file
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_store():
+    """
+    The process-wide EmbeddingStore, opened on first use.
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = EmbeddingStore()
+        return _default_store
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so previously embedded texts are served from an
+    EmbeddingStore instead of the API. Only document chunks are cached unless
+    cache_queries (EMBEDDING_CACHE_QUERIES): caching a question costs a write
+    transaction on the query path and keeps one-off questions on disk.
+    """
+
+    def __init__(self, embeddings, store=None, monitor=None, cache_queries=None):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.store = store or default_store()
+        self.monitor = monitor
+        self.cache_queries = config.EMBEDDING_CACHE_QUERIES if cache_queries is None else cache_queries
+
+    def _embed(self, texts, task, embed_fn):
+        keys = [embedding_key(self.model, task, text) for text in texts]
+        cached = self.store.get_many(list(dict.fromkeys(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.store.put_many(new_items)
+            cached.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in new_items)
+
+        if self.monitor is not None:
+            self.monitor.log_embedding_cache(
+                len(texts) - len(missing), len(missing), self.store.hits, self.store.misses
+            )
+        return [cached[key].tolist() for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        if not self.cache_queries:
+            return self.embeddings.embed_query(text)
+        return self._embed(
+            [text], "query", lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+    def embed_queries(self, texts):
+        if not self.cache_queries:
+            return embed_queries(self.embeddings, texts)
+        return self._embed(texts, "query", lambda texts: embed_queries(self.embeddings, texts))
@@ -0,0 +1,108 @@
+"""
+Rate-limit-aware, concurrent batched embedding client.
+
+RateLimitedEmbeddings wraps any LangChain embeddings model (normally
+GoogleGenerativeAIEmbeddings). Texts are split into batches that are sent
+through a small thread pool; every request first takes from token buckets
+configured in requests/min and tokens/min (rate_limits.py), and a 429 / quota
+error is retried with jittered exponential backoff instead of failing the
+whole ingestion.
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+import config
+from rate_limits import is_rate_limit_error, shared_bucket
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about four characters per token) for quota accounting.
+    """
+    return max(1, len(text) // 4)
+
+
+def embed_queries(embeddings, texts):
+    """
+    Query embeddings for many texts in as few requests as the model allows;
+    embed_query() sends one request per text.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if type(embeddings).__name__ == "GoogleGenerativeAIEmbeddings":
+        # Same task type embed_query() uses, so the vectors are identical
+        return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Batches, rate-limits and retries calls to an embeddings model.
+    """
+
+    def __init__(self, embeddings, batch_size=None, max_concurrency=None,
+                 requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=None, monitor=None):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.batch_size = batch_size or config.EMBED_BATCH_SIZE
+        self.max_concurrency = max_concurrency or config.EMBED_MAX_CONCURRENCY
+        self.max_retries = config.EMBED_MAX_RETRIES if max_retries is None else max_retries
+        self.monitor = monitor
+        self.requests = shared_bucket(
+            f"{self.model}:requests", requests_per_minute or config.EMBED_REQUESTS_PER_MINUTE
+        )
+        self.tokens = shared_bucket(
+            f"{self.model}:tokens", tokens_per_minute or config.EMBED_TOKENS_PER_MINUTE
+        )
+        self._pool = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="embed")
+
+    def _call(self, fn, texts):
+        """
+        Runs one API request under the rate limits, retrying on 429s.
+        """
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            self.requests.acquire(1)
+            self.tokens.acquire(sum(estimate_tokens(text) for text in texts))
+            try:
+                result = fn(texts)
+                break
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                # Full jitter: sleep a random time up to the exponential cap
+                delay = min(config.EMBED_BACKOFF_MAX_S, config.EMBED_BACKOFF_BASE_S * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+        if self.monitor is not None:
+            self.monitor.log_embedding_batch(len(texts), time.perf_counter() - start, attempt)
+        return result
+
+    def embed_documents(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._call(self.embeddings.embed_documents, batches[0])
+        vectors = []
+        for batch_vectors in self._pool.map(
+            lambda batch: self._call(self.embeddings.embed_documents, batch), batches
+        ):
+            vectors.extend(batch_vectors)
+        return vectors
+
+    def embed_query(self, text):
+        return self._call(lambda texts: self.embeddings.embed_query(texts[0]), [text])
+
+    def embed_queries(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors = []
+        for batch_vectors in self._pool.map(
+            lambda batch: self._call(lambda batch: embed_queries(self.embeddings, batch), batch), batches
+        ):
+            vectors.extend(batch_vectors)
+        return vectors
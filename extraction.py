@@ -0,0 +1,69 @@
+"""
+Parallel, page-streaming PDF text extraction.
+
+Pages are extracted in fixed-size ranges by a pool of worker processes and
+yielded in page order as (page number, text) pairs. Only a bounded number of
+ranges is in flight at once, so memory stays flat for 1,000+ page PDFs no
+matter how fast the consumer is.
+"""
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+
+import config
+
+# Each worker process parses the PDF once and keeps the reader for all its ranges
+_reader = None
+
+
+def _init_worker(pdf_bytes):
+    global _reader
+    _reader = PdfReader(BytesIO(pdf_bytes))
+
+
+def _extract_range(start, stop):
+    return [(number + 1, _reader.pages[number].extract_text() or "") for number in range(start, stop)]
+
+
+def iter_pages(pdf_bytes, workers=None, pages_per_task=None):
+    """
+    Yields (page number, text) for every page, in order. Page numbers start at 1.
+    Small PDFs are extracted in-process; larger ones are spread over a process pool.
+    """
+    reader = PdfReader(BytesIO(pdf_bytes))
+    num_pages = len(reader.pages)
+    workers = workers or config.EXTRACT_WORKERS or os.cpu_count() or 1
+    pages_per_task = pages_per_task or config.EXTRACT_PAGES_PER_TASK
+
+    if workers <= 1 or num_pages < config.EXTRACT_PARALLEL_MIN_PAGES:
+        for number, page in enumerate(reader.pages):
+            yield number + 1, page.extract_text() or ""
+        return
+
+    ranges = iter([
+        (start, min(start + pages_per_task, num_pages))
+        for start in range(0, num_pages, pages_per_task)
+    ])
+    # "spawn" avoids forking the threads of the Streamlit server
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(pdf_bytes,),
+    ) as pool:
+        # Keep two ranges per worker in flight; results are consumed in order
+        pending = deque(
+            pool.submit(_extract_range, *page_range)
+            for _, page_range in zip(range(workers * 2), ranges)
+        )
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(_extract_range, *next_range))
+            yield from pages
@@ -0,0 +1,127 @@
+"""
+Chat history kept within a token budget.
+
+The chain used to receive the whole conversation on every turn, so the
+condense-question prompt grew without limit. ChatHistory keeps the most
+recent turns verbatim (a sliding window bounded by HISTORY_MAX_TURNS and
+HISTORY_MAX_TOKENS) and folds turns that fall out of the window into a
+rolling summary bounded by HISTORY_SUMMARY_TOKENS.
+
+needs_condense() decides whether a question has to be rewritten against the
+history at all: the first question of a conversation, and questions that do
+not refer back to it, are already standalone and skip that LLM call.
+"""
+
+import re
+
+import config
+from chunking import count_tokens
+
+SUMMARY_QUESTION = "What did we discuss earlier?"
+
+# Words that usually point back at earlier turns ("what is its price?"), and
+# openings that continue the previous question ("and the second one?")
+_REFERENCES = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|him|his|she|her|"
+    r"former|latter|above|previous|previously|earlier|same|else|again)\b",
+    re.IGNORECASE,
+)
+_CONTINUATIONS = re.compile(r"^\W*(and|but|also|so|or|what about|how about|why)\b", re.IGNORECASE)
+_WORDS = re.compile(r"\w+")
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation about a document with the new turns below. "
+    "Keep names, numbers and the topics asked about; at most {max_words} words.\n\n"
+    "Current summary:\n{summary}\n\nNew turns:\n{turns}\n\nUpdated summary:"
+)
+
+
+def needs_condense(question, chat_history):
+    """
+    True when the question has to be rewritten into a standalone one: there
+    is history, and the question is very short or refers back to it.
+    """
+    if not chat_history:
+        return False
+    if len(_WORDS.findall(question)) < config.HISTORY_MIN_STANDALONE_WORDS:
+        return True
+    return bool(_REFERENCES.search(question) or _CONTINUATIONS.search(question))
+
+
+def _format_turns(turns):
+    return "\n".join(f"Human: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+def _truncate_tokens(text, max_tokens):
+    # About four characters per token
+    return text if count_tokens(text) <= max_tokens else text[-max_tokens * 4:]
+
+
+def extractive_summary(summary, turns, max_tokens):
+    """
+    Rolling summary without an LLM call: each folded turn keeps its question
+    and the first sentence of its answer; the oldest text goes first.
+    """
+    lines = [summary] if summary else []
+    for question, answer in turns:
+        first_sentence = re.split(r"(?<=[.!?])\s", answer.strip(), maxsplit=1)[0]
+        lines.append(f"Q: {question} A: {first_sentence}")
+    return _truncate_tokens("\n".join(lines), max_tokens)
+
+
+class ChatHistory:
+    """
+    Recent turns plus a rolling summary of older ones. pairs() is what the
+    chain receives; the summary is passed as a first synthetic turn.
+    """
+
+    def __init__(self, max_tokens=None, max_turns=None, summary_tokens=None, llm=None):
+        self.max_tokens = max_tokens or config.HISTORY_MAX_TOKENS
+        self.max_turns = max_turns or config.HISTORY_MAX_TURNS
+        self.summary_tokens = summary_tokens or config.HISTORY_SUMMARY_TOKENS
+        # Used for the rolling summary when HISTORY_SUMMARIZER is "llm"
+        self.llm = llm
+        self.turns = []
+        self.summary = ""
+
+    def __len__(self):
+        return len(self.turns)
+
+    def __bool__(self):
+        return bool(self.turns or self.summary)
+
+    def append(self, question, answer):
+        self.turns.append((question, answer))
+        folded = []
+        while len(self.turns) > self.max_turns or (
+            len(self.turns) > 1 and self.tokens() > self.max_tokens
+        ):
+            folded.append(self.turns.pop(0))
+        if folded:
+            self.summary = self._summarize(folded)
+
+    def pairs(self):
+        """
+        The history as (question, answer) pairs for ConversationalRetrievalChain.
+        """
+        if not self.summary:
+            return list(self.turns)
+        return [(SUMMARY_QUESTION, self.summary)] + self.turns
+
+    def tokens(self):
+        return count_tokens(self.summary + _format_turns(self.turns))
+
+    def clear(self):
+        self.turns = []
+        self.summary = ""
+
+    def _summarize(self, folded):
+        if self.llm is None or config.HISTORY_SUMMARIZER != "llm":
+            return extractive_summary(self.summary, folded, self.summary_tokens)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.summary_tokens * 3 // 4,
+            summary=self.summary or "(none)",
+            turns=_format_turns(folded),
+        )
+        summary = self.llm.invoke(prompt)
+        return _truncate_tokens(getattr(summary, "content", summary).strip(), self.summary_tokens)
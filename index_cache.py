@@ -0,0 +1,127 @@
+"""
+Content-addressed on-disk cache of built FAISS indexes.
+
+Each entry lives in its own directory named after a hash of the uploaded PDF
+bytes plus everything that changes the resulting index (splitter parameters
+and embedding model). A repeat upload of the same file - or a Streamlit rerun -
+loads the saved index instead of extracting and embedding the PDF again.
+The cache is bounded in size and evicts least recently used entries.
+
+With INDEX_STORE="mmap" entries are written in the memory-mapped format of
+mmap_store.py, so every process and session serving a document shares one
+copy of its vectors and text through the page cache; with "faiss" they are
+the FAISS files plus the BM25 index (index.bm25.npz). Either kind is loaded.
+Entries are never modified in place, so a mapped entry stays valid for its
+readers even after it is evicted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import config
+from lexical import HybridFAISS
+from mmap_store import MappedStore, is_store, write_store
+
+META_FILE = "meta.json"
+
+
+def make_cache_key(pdf_bytes, **params):
+    """
+    Hashes the PDF bytes together with the parameters that shape the index.
+    """
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class IndexCache:
+    """
+    Saves and loads FAISS indexes (plus chunk metadata) under a cache directory.
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = Path(root or config.INDEX_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(config.INDEX_CACHE_MAX_MB * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _entry(self, key):
+        return self.root / key
+
+    def load(self, key, embeddings):
+        """
+        Returns (knowledge_base, meta) for a cached entry, or None on a miss.
+        Entries are only ever written by save(), so unpickling the docstore
+        is safe here.
+        """
+        entry = self._entry(key)
+        meta_path = entry / META_FILE
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if is_store(entry):
+                knowledge_base = MappedStore(entry, embeddings)
+            else:
+                knowledge_base = HybridFAISS.load_local(
+                    str(entry), embeddings, allow_dangerous_deserialization=True
+                )
+        except Exception:
+            # A half-written or corrupt entry is treated as a miss
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # Touch the entry so LRU eviction sees it as recently used
+        os.utime(meta_path)
+        return knowledge_base, meta
+
+    def save(self, key, knowledge_base, meta):
+        """
+        Writes the index and its metadata atomically, then enforces the size budget.
+        """
+        tmp = self.root / f".{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            if config.INDEX_STORE == "mmap":
+                write_store(tmp, knowledge_base)
+            else:
+                knowledge_base.save_local(str(tmp))
+            with open(tmp / META_FILE, "w", encoding="utf-8") as f:
+                json.dump({**meta, "created": time.time()}, f)
+            try:
+                os.replace(tmp, self._entry(key))
+            except OSError:
+                # Another session saved the same key first; keep theirs
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry in self.root.iterdir():
+            meta_path = entry / META_FILE
+            if entry.name.startswith(".") or not meta_path.exists():
+                continue
+            entries.append((meta_path.stat().st_mtime, _dir_size(entry), entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
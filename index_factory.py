@@ -0,0 +1,146 @@
+"""
+Size-adaptive FAISS index construction.
+
+FAISS.from_texts always builds an exact flat index, which is the right choice
+for one small PDF but scales linearly in search time and keeps every vector
+as float32. For larger corpora this module picks an approximate index by
+vector count - IVF or HNSW, optionally with scalar (fp16 / int8) or product
+quantization - trains it, tunes nprobe / efSearch until recall@k against the
+exact flat baseline reaches a target, and swaps it into the vector store.
+"""
+
+import math
+from contextlib import nullcontext
+
+import faiss
+import numpy as np
+
+import config
+
+# Search-time settings tried in order until the recall target is met
+NPROBE_STEPS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+EF_SEARCH_STEPS = [16, 32, 64, 128, 256, 512, 1024]
+
+
+def _ivf(index):
+    """
+    The IVF part of an index, or None for flat / HNSW indexes.
+    """
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def choose_index_type(num_vectors, dim, kind=None, quantization=None):
+    """
+    Returns the faiss.index_factory description for an index of this size.
+    kind is "auto" | "flat" | "ivf" | "hnsw"; quantization is
+    "none" | "fp16" | "int8" | "pq".
+    """
+    kind = kind or config.INDEX_TYPE
+    quantization = quantization or config.INDEX_QUANTIZATION
+    if kind == "flat" or (kind == "auto" and num_vectors < config.INDEX_FLAT_MAX_VECTORS):
+        return "Flat"
+    if kind == "auto":
+        kind = "ivf"
+
+    if kind == "hnsw":
+        storage = {"none": "", "fp16": "_SQfp16", "int8": "_SQ8"}.get(quantization)
+        if storage is None:
+            raise ValueError(f"HNSW indexes support fp16/int8 quantization, not {quantization!r}")
+        return f"HNSW32{storage}"
+
+    # About 4 * sqrt(n) inverted lists, with enough points per list to train on
+    nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+    if quantization == "pq":
+        # Largest sub-quantizer count up to dim / 4 that divides the dimension
+        m = next(m for m in range(max(1, dim // 4), 0, -1) if dim % m == 0)
+        storage = f"PQ{m}"
+    else:
+        storage = {"none": "Flat", "fp16": "SQfp16", "int8": "SQ8"}[quantization]
+    return f"IVF{nlist},{storage}"
+
+
+def recall_at_k(index, vectors, queries, k):
+    """
+    Fraction of the exact (flat) top-k neighbours that the index also returns.
+    """
+    _, truth = faiss.knn(queries, vectors, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / truth.size
+
+
+def tune(index, vectors, k=4, target_recall=None, num_queries=200, seed=0):
+    """
+    Raises nprobe (IVF) or efSearch (HNSW) until recall@k on held-in sample
+    queries reaches target_recall. Returns {"param", "value", "recall"}.
+    """
+    target_recall = target_recall or config.INDEX_TARGET_RECALL
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    # Perturbed copies of stored vectors behave like real nearby queries
+    queries = vectors[sample] + rng.normal(0, 0.01, size=(len(sample), vectors.shape[1])).astype(np.float32)
+    k = min(k, len(vectors))
+
+    ivf = _ivf(index)
+    if ivf is not None:
+        param, steps = "nprobe", [n for n in NPROBE_STEPS if n <= ivf.nlist] + [ivf.nlist]
+        setter = lambda value: setattr(ivf, "nprobe", value)
+    elif isinstance(index, faiss.IndexHNSW):
+        param, steps = "efSearch", EF_SEARCH_STEPS
+        setter = lambda value: setattr(index.hnsw, "efSearch", value)
+    else:
+        return {"param": None, "value": None, "recall": recall_at_k(index, vectors, queries, k)}
+
+    for value in steps:
+        setter(value)
+        recall = recall_at_k(index, vectors, queries, k)
+        if recall >= target_recall:
+            break
+    return {"param": param, "value": value, "recall": recall}
+
+
+def build_index(vectors, description):
+    """
+    Creates, trains and fills an L2 index from a float32 matrix.
+    """
+    index = faiss.index_factory(vectors.shape[1], description, faiss.METRIC_L2)
+    ivf = _ivf(index)
+    if not index.is_trained:
+        # A few hundred points per centroid is plenty for training
+        train_size = min(len(vectors), 256 * ivf.nlist) if ivf is not None else len(vectors)
+        sample = np.random.default_rng(0).choice(len(vectors), size=train_size, replace=False)
+        index.train(vectors[np.sort(sample)])
+    index.add(vectors)
+    if ivf is not None:
+        # Keeps reconstruct() available for MMR, compaction and re-indexing
+        ivf.make_direct_map()
+    return index
+
+
+def optimize_index(knowledge_base, k=4, monitor=None, lock=None):
+    """
+    Replaces the flat index of a LangChain FAISS store with the index type
+    chosen for its size. Vector ids are unchanged, so the docstore mapping
+    still applies. Returns the tuning report, or None if flat was kept.
+
+    The new index is trained without `lock`; it is only held for the swap, so
+    searches on the flat index can go on meanwhile (nothing may add to it).
+    """
+    index = knowledge_base.index
+    description = choose_index_type(index.ntotal, index.d)
+    if description == "Flat" or not isinstance(index, faiss.IndexFlat):
+        return None
+
+    vectors = index.reconstruct_n(0, index.ntotal)
+    new_index = build_index(vectors, description)
+    report = {"index_type": description, "vectors": index.ntotal, **tune(new_index, vectors, k=k)}
+    report["bytes_before"] = faiss.serialize_index(index).nbytes
+    report["bytes_after"] = faiss.serialize_index(new_index).nbytes
+    with lock or nullcontext():
+        knowledge_base.index = new_index
+    if monitor is not None:
+        monitor.event("index_optimized", **report)
+    return report
@@ -0,0 +1,432 @@
+"""
+Incrementally updated document index.
+
+A library built by bulk_ingest.py is one FAISS + BM25 index, so adding a PDF
+or replacing a revised one meant re-embedding the whole corpus. IndexManager
+keeps the index as a list of immutable segments instead, each saved in the
+usual HybridFAISS format:
+
+    library/
+        manifest.json       generation, settings, segments, documents, tombstones
+        segments/s0001/     index.faiss, index.pkl, index.bm25.npz
+        segments/s0002/
+
+- adding a document embeds only its chunks and writes them as a new segment;
+- deleting one records its vector range as a tombstone; searches skip it;
+- compaction rewrites segments that are mostly tombstones (or too many small
+  ones) from their stored vectors and texts, without embedding anything;
+- every change writes the new segment first and then atomically replaces
+  manifest.json, and swaps in a new IndexSnapshot. Readers keep searching the
+  snapshot they hold and are never blocked by a writer.
+
+library.load_library() opens such a library like a fully built one, and
+`bulk_ingest.py --incremental` keeps one in sync with a directory of PDFs.
+"""
+
+import copy
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+import config
+from embedding_backends import model_id
+from index_factory import optimize_index
+from lexical import BM25Index, HybridFAISS
+from monitor import Monitor
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+FORMAT = 2
+
+
+class _SegmentedIndex:
+    """
+    The part of the faiss.Index interface qa.retrieve() uses, over all
+    segments. Ids are global: segment offset + id within the segment.
+    """
+
+    def __init__(self, stores, offsets, dead):
+        self._stores = stores
+        self._offsets = offsets
+        self._dead = dead
+        self.ntotal = int(offsets[-1])
+        self.d = stores[0].index.d if stores else 0
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype=np.float32)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for number, store in enumerate(self._stores):
+            start, end = int(self._offsets[number]), int(self._offsets[number + 1])
+            dead = int(self._dead[start:end].sum())
+            if dead == end - start:
+                continue
+            # Ask for extra neighbours so tombstoned ones can be dropped
+            found_distances, found_ids = store.index.search(queries, min(k + dead, end - start))
+            found_ids = np.where(found_ids >= 0, found_ids + start, -1)
+            live = found_ids >= 0
+            live[live] = ~self._dead[found_ids[live]]
+            found_distances = np.where(live, found_distances, np.inf)
+            merged_distances = np.concatenate([distances, found_distances], axis=1)
+            merged_ids = np.concatenate([ids, np.where(live, found_ids, -1)], axis=1)
+            order = np.argsort(merged_distances, axis=1, kind="stable")[:, :k]
+            distances = np.take_along_axis(merged_distances, order, axis=1)
+            ids = np.take_along_axis(merged_ids, order, axis=1)
+        return distances, ids
+
+    def reconstruct(self, vector_id):
+        number, local = _locate(self._offsets, vector_id)
+        return self._stores[number].index.reconstruct(local)
+
+
+class _SegmentedLexical:
+    """
+    BM25 over all segments. Each segment scores with its own statistics, like
+    shards of a search engine; the merged ranking is close to one index's.
+    """
+
+    def __init__(self, stores, offsets, dead):
+        self._stores = stores
+        self._offsets = offsets
+        self._dead = dead
+
+    def __len__(self):
+        return int(self._offsets[-1] - self._dead.sum())
+
+    def doc_freq(self, term):
+        # Includes deleted chunks until compaction, like each segment's idf
+        return sum(store.lexical_index.doc_freq(term) for store in self._stores if store.lexical_index is not None)
+
+    def search(self, query, k):
+        hits = []
+        for number, store in enumerate(self._stores):
+            start, end = int(self._offsets[number]), int(self._offsets[number + 1])
+            dead = int(self._dead[start:end].sum())
+            if store.lexical_index is None or dead == end - start:
+                continue
+            for local, score in store.lexical_index.search(query, k + dead):
+                if not self._dead[start + local]:
+                    hits.append((int(start + local), score))
+        return sorted(hits, key=lambda hit: -hit[1])[:k]
+
+
+def _locate(offsets, vector_id):
+    number = int(np.searchsorted(offsets, vector_id, side="right")) - 1
+    return number, int(vector_id - offsets[number])
+
+
+class IndexSnapshot:
+    """
+    Immutable view of the segments and tombstones at one generation. It offers
+    the search interface of HybridFAISS that qa.retrieve() and
+    context.pack_context() use, so it can stand in for a knowledge base.
+    """
+
+    def __init__(self, embeddings, stores, tombstones, generation):
+        self.embeddings = embeddings
+        self.generation = generation
+        self._stores = stores
+        self._offsets = np.concatenate([[0], np.cumsum([s.index.ntotal for s in stores])]).astype(np.int64)
+        dead = np.zeros(int(self._offsets[-1]), dtype=bool)
+        for number, ranges in enumerate(tombstones):
+            for start, end in ranges:
+                dead[self._offsets[number] + start:self._offsets[number] + end] = True
+        self.index = _SegmentedIndex(stores, self._offsets, dead)
+        self.lexical_index = _SegmentedLexical(stores, self._offsets, dead)
+        self._vector_ids = None
+
+    def document(self, doc_id):
+        number, local = _locate(self._offsets, doc_id)
+        return self._stores[number].document(local)
+
+    def vector_ids(self, docs):
+        if self._vector_ids is None:
+            self._vector_ids = {
+                docstore_id: int(self._offsets[number] + local)
+                for number, store in enumerate(self._stores)
+                for local, docstore_id in store.index_to_docstore_id.items()
+            }
+        return [self._vector_ids.get(doc.id) for doc in docs]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        distances, ids = self.index.search(np.asarray([embedding], dtype=np.float32), k)
+        return [(self.document(int(i)), float(d)) for d, i in zip(distances[0], ids[0]) if i >= 0]
+
+
+def _stored_vectors(store, ids):
+    index = store.index
+    try:
+        return np.vstack([index.reconstruct(int(i)) for i in ids])
+    except RuntimeError:
+        # IVF indexes need a direct map before vectors can be read back
+        faiss.extract_index_ivf(index).make_direct_map()
+        return np.vstack([index.reconstruct(int(i)) for i in ids])
+
+
+class IndexManager:
+    """
+    Document-level add / replace / delete over a segmented library directory.
+    One writer at a time (per process); any number of concurrent readers via
+    `snapshot`.
+    """
+
+    def __init__(self, directory, embeddings, settings=None, monitor=None):
+        """
+        Opens the library in `directory`, or starts an empty one there with
+        these index settings (see pipeline.index_settings).
+        """
+        self.directory = Path(directory)
+        self.embeddings = embeddings
+        self.monitor = monitor or Monitor()
+        self._write_lock = threading.Lock()
+        manifest = _read_manifest(self.directory)
+        model = model_id(embeddings)
+        if manifest is None:
+            if settings is None:
+                raise ValueError(f"No library has been published in {directory}.")
+            manifest = {
+                "format": FORMAT, "version": 0, "settings": settings, "num_documents": 0,
+                "segments": [], "documents": {}, "tombstones": {},
+            }
+        elif manifest.get("format") != FORMAT:
+            raise ValueError(
+                f"{directory} holds a library in format {manifest.get('format')!r}; "
+                f"incremental updates need format {FORMAT} (rebuild it with --incremental)."
+            )
+        elif manifest["settings"]["embedding_model"] != model:
+            raise ValueError(
+                f"Library {directory} was embedded with {manifest['settings']['embedding_model']}, "
+                f"but the app uses {model}."
+            )
+        self._manifest = manifest
+        self._stores = {
+            segment["name"]: HybridFAISS.load_local(
+                str(self.directory / SEGMENTS_DIR / segment["name"]), embeddings,
+                allow_dangerous_deserialization=True,
+            )
+            for segment in manifest["segments"]
+        }
+        self._snapshot = self._make_snapshot(manifest)
+
+    @property
+    def snapshot(self):
+        """
+        The current IndexSnapshot. Reading an attribute is atomic, so readers
+        never wait for writers.
+        """
+        return self._snapshot
+
+    @property
+    def documents(self):
+        return dict(self._manifest["documents"])
+
+    def meta(self):
+        """
+        Stats of the live documents, in the shape of a library's meta.json.
+        """
+        documents = self._manifest["documents"].values()
+        chunk_sizes = [size for document in documents for size in document["chunk_sizes"]]
+        return {
+            "num_pages": sum(document.get("pages", 0) for document in documents),
+            "num_chunks": len(chunk_sizes),
+            "chunk_sizes": chunk_sizes,
+            "text_sample": next((d["text_sample"] for d in documents if d.get("text_sample")), ""),
+            "manifest": self.manifest(),
+        }
+
+    def manifest(self):
+        """
+        The manifest without per-chunk data, for display and logging.
+        """
+        manifest = dict(self._manifest)
+        manifest["documents"] = [
+            {"path": doc_id, **{k: v for k, v in document.items() if k not in ("chunk_sizes", "text_sample")}}
+            for doc_id, document in manifest["documents"].items()
+        ]
+        return manifest
+
+    def add_document(self, doc_id, chunks, stats=None):
+        """
+        Embeds one document's chunks and adds them as a new segment,
+        replacing any earlier version of the document.
+        """
+        self.update(added=[(doc_id, chunks, stats or {})])
+
+    def delete_document(self, doc_id):
+        self.update(deleted=[doc_id])
+
+    def update(self, added=(), deleted=()):
+        """
+        Applies a batch of changes as one new generation: `added` holds
+        (doc_id, chunks, stats) tuples, `deleted` document ids. All added
+        documents go into one segment. A document without chunks (no
+        extractable text) is recorded without vectors, still replacing its
+        earlier version. Returns the new snapshot.
+        """
+        added = list(added)
+        store, texts = None, [chunk.text for _, chunks, _ in added for chunk in chunks]
+        if texts:
+            # Embedding is the slow part and touches no shared state
+            with self.monitor.span("embed", chunks=len(texts)):
+                vectors = self.embeddings.embed_documents(texts)
+            metadatas = [
+                {"source": doc_id, **chunk.metadata()} for doc_id, chunks, _ in added for chunk in chunks
+            ]
+            store = self._build_segment(texts, vectors, metadatas)
+
+        with self._write_lock:
+            manifest = copy.deepcopy(self._manifest)
+            replaced = [doc_id for doc_id, _, _ in added if doc_id in manifest["documents"]]
+            for doc_id in list(deleted) + replaced:
+                self._tombstone(manifest, doc_id)
+            if store is not None:
+                name = self._write_segment(manifest, store)
+                position = 0
+                for doc_id, chunks, stats in added:
+                    if chunks:
+                        manifest["documents"][doc_id] = {
+                            **stats, "segment": name, "start": position, "end": position + len(chunks),
+                            "chunk_sizes": [len(chunk.text) for chunk in chunks],
+                            "text_sample": chunks[0].text[:200],
+                        }
+                        position += len(chunks)
+            for doc_id, chunks, stats in added:
+                if not chunks:
+                    manifest["documents"][doc_id] = {
+                        **stats, "segment": None, "start": 0, "end": 0, "chunk_sizes": [], "text_sample": "",
+                    }
+            snapshot = self._commit(manifest)
+        self.monitor.event(
+            "index_update", generation=snapshot.generation, added=len(added),
+            deleted=len(deleted), chunks=len(texts), segments=len(manifest["segments"]),
+        )
+        return snapshot
+
+    def compact(self, force=False):
+        """
+        Rewrites segments whose share of tombstoned vectors reaches
+        INDEX_COMPACT_DEAD_RATIO, plus the smallest segments while there are
+        more than INDEX_MAX_SEGMENTS, into one new segment built from the
+        stored vectors. force rewrites every segment. Returns the number of
+        segments rewritten.
+        """
+        with self._write_lock:
+            manifest = copy.deepcopy(self._manifest)
+            segments = manifest["segments"]
+
+            def dead(segment):
+                return sum(end - start for start, end in manifest["tombstones"].get(segment["name"], []))
+
+            chosen = [
+                s for s in segments
+                if force or (s["vectors"] and dead(s) / s["vectors"] >= config.INDEX_COMPACT_DEAD_RATIO)
+            ]
+            rest = sorted((s for s in segments if s not in chosen), key=lambda s: s["vectors"] - dead(s))
+            while rest and len(segments) - len(chosen) + 1 > config.INDEX_MAX_SEGMENTS:
+                chosen.append(rest.pop(0))
+            if len(chosen) < 2 and not any(dead(s) for s in chosen):
+                return 0
+
+            with self.monitor.span("index_compact", segments=len(chosen)) as span:
+                names = {s["name"] for s in chosen}
+                moved = [
+                    (doc_id, document) for doc_id, document in manifest["documents"].items()
+                    if document["segment"] in names
+                ]
+                texts, vectors, metadatas = [], [], []
+                for _, document in moved:
+                    store = self._stores[document["segment"]]
+                    ids = range(document["start"], document["end"])
+                    docs = [store.document(i) for i in ids]
+                    texts += [doc.page_content for doc in docs]
+                    metadatas += [doc.metadata for doc in docs]
+                    vectors.append(_stored_vectors(store, ids))
+                manifest["segments"] = [s for s in segments if s["name"] not in names]
+                for name in names:
+                    manifest["tombstones"].pop(name, None)
+                if texts:
+                    store = self._build_segment(texts, np.vstack(vectors).tolist(), metadatas)
+                    name = self._write_segment(manifest, store)
+                    position = 0
+                    for _, document in moved:
+                        count = document["end"] - document["start"]
+                        document.update(segment=name, start=position, end=position + count)
+                        position += count
+                span["vectors"] = len(texts)
+                self._commit(manifest)
+            for name in names:
+                self._stores.pop(name, None)
+                shutil.rmtree(self.directory / SEGMENTS_DIR / name, ignore_errors=True)
+            return len(chosen)
+
+    def maybe_compact(self):
+        """
+        Compacts if the tombstone or segment-count thresholds are exceeded.
+        """
+        return self.compact(force=False)
+
+    # Internals; callers of the methods below hold the write lock
+
+    def _build_segment(self, texts, vectors, metadatas):
+        store = HybridFAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings, metadatas=metadatas)
+        optimize_index(store, monitor=self.monitor)
+        store.lexical_index = BM25Index.build(texts)
+        return store
+
+    def _write_segment(self, manifest, store):
+        manifest["next_segment"] = manifest.get("next_segment", 0) + 1
+        name = f"s{manifest['next_segment']:04d}"
+        path = self.directory / SEGMENTS_DIR / name
+        tmp = path.with_name(f".{name}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        store.save_local(str(tmp))
+        os.replace(tmp, path)
+        manifest["segments"].append({"name": name, "vectors": store.index.ntotal})
+        self._stores[name] = store
+        return name
+
+    def _tombstone(self, manifest, doc_id):
+        document = manifest["documents"].pop(doc_id, None)
+        # Documents without text have no vectors to hide
+        if document is not None and document["segment"] is not None:
+            manifest["tombstones"].setdefault(document["segment"], []).append(
+                [document["start"], document["end"]]
+            )
+
+    def _commit(self, manifest):
+        manifest["version"] += 1
+        # Summary fields the apps show, as in a fully built library's manifest
+        documents = manifest["documents"].values()
+        manifest["num_documents"] = len(manifest["documents"])
+        manifest["num_pages"] = sum(document.get("pages", 0) for document in documents)
+        manifest["num_chunks"] = sum(document["end"] - document["start"] for document in documents)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{MANIFEST_FILE}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.directory / MANIFEST_FILE)
+        self._manifest = manifest
+        self._snapshot = self._make_snapshot(manifest)
+        return self._snapshot
+
+    def _make_snapshot(self, manifest):
+        names = [segment["name"] for segment in manifest["segments"]]
+        return IndexSnapshot(
+            self.embeddings,
+            [self._stores[name] for name in names],
+            [manifest["tombstones"].get(name, []) for name in names],
+            manifest["version"],
+        )
+
+
+def _read_manifest(directory):
+    path = Path(directory) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
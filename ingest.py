@@ -0,0 +1,299 @@
+"""
+Streaming ingestion: extract -> chunk -> embed batch -> index append.
+
+Each stage runs in its own thread and hands work to the next one through a
+bounded queue, so the slowest stage (usually embedding) applies backpressure
+upstream instead of letting extracted text pile up in memory. The FAISS index
+is searchable as soon as the first batch has been appended, which lets the UI
+answer questions while the rest of the document is still being indexed.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+
+import config
+from chunking import iter_chunks
+from extraction import iter_pages
+from index_factory import optimize_index
+from lexical import BM25Builder, HybridFAISS
+from monitor import Monitor
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class IngestCancelled(Exception):
+    """
+    The job was cancelled before it finished.
+    """
+
+
+class IngestJob:
+    """
+    Builds a FAISS knowledge base from PDF bytes in background threads.
+
+    While the job runs it can be passed to qa.ask() in place of the knowledge
+    base: searches see whatever has been indexed so far.
+    """
+
+    def __init__(self, pdf_bytes, embeddings, monitor=None, on_complete=None,
+                 batch_size=None, queue_size=None, key=None):
+        self.pdf_bytes = pdf_bytes
+        # Identifies the document + settings, e.g. for coalescing identical questions
+        self.key = key
+        self.embeddings = embeddings
+        self.monitor = monitor or Monitor()
+        self.on_complete = on_complete
+        self.batch_size = batch_size or config.INGEST_BATCH_SIZE
+        self.queue_size = queue_size or config.INGEST_QUEUE_SIZE
+
+        self.total_pages = len(PdfReader(BytesIO(pdf_bytes)).pages) if pdf_bytes else 0
+        self.pages_indexed = 0
+        self.chunk_sizes = []
+        self.text_sample = ""
+        self.knowledge_base = None
+        self.meta = None
+        self.error = None
+        self._lexical = BM25Builder()
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._done = threading.Event()
+
+    @classmethod
+    def completed(cls, knowledge_base, meta, key=None):
+        """
+        A finished job wrapping an already built knowledge base (e.g. from the cache).
+        """
+        job = cls(b"", knowledge_base.embeddings, key=key)
+        job.knowledge_base = knowledge_base
+        job.meta = meta
+        job.total_pages = job.pages_indexed = meta["num_pages"]
+        job.chunk_sizes = meta["chunk_sizes"]
+        job._done.set()
+        return job
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def chunks_indexed(self):
+        return len(self.chunk_sizes)
+
+    @property
+    def progress(self):
+        if self.done:
+            return 1.0
+        return self.pages_indexed / self.total_pages if self.total_pages else 0.0
+
+    def start(self):
+        """
+        Starts one daemon thread per stage and returns immediately.
+        """
+        pages = queue.Queue(self.queue_size)
+        batches = queue.Queue(self.queue_size)
+        vectors = queue.Queue(self.queue_size)
+        stages = [
+            (self._extract, (pages,)),
+            (self._chunk, (pages, batches)),
+            (self._embed, (batches, vectors)),
+            (self._index, (vectors,)),
+        ]
+        for target, args in stages:
+            threading.Thread(
+                target=self._run_stage, args=(target, *args), daemon=True,
+                name=f"ingest{target.__name__}"
+            ).start()
+        return self
+
+    def wait(self):
+        """
+        Blocks until the job finishes. Returns (knowledge_base, meta).
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.knowledge_base, self.meta
+
+    def cancel(self):
+        """
+        Stops an unfinished job: the stages wind down after their current
+        batch, and the job finishes with an IngestCancelled error. Returns
+        whether the job was cancelled (False if it had already finished).
+        """
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self.error = IngestCancelled("Ingestion was cancelled")
+            self._stop.set()
+            self._done.set()
+        self.monitor.event("ingest_cancelled", pages_indexed=self.pages_indexed, total_pages=self.total_pages)
+        return True
+
+    def replace_knowledge_base(self, knowledge_base):
+        """
+        Swaps in an equivalent finished knowledge base, e.g. the memory-mapped
+        copy the index cache has just written, so the in-heap one can be freed.
+        """
+        with self._lock:
+            self.knowledge_base = knowledge_base
+
+    # Search interface used by qa.ask() while the index is still growing
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        with self._lock:
+            if self.knowledge_base is None:
+                return []
+            return self.knowledge_base.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)
+
+    # Pipeline stages
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            if self.error is None and not self._stop.is_set():
+                self.error = e
+                self.monitor.log_error(f"Ingestion failed: {e}")
+            self._stop.set()
+            self._done.set()
+
+    def _put(self, q, item):
+        # Blocks while the next stage is behind, but gives up once the job stops
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _iter_queue(self, q, waited=None):
+        # `waited` accumulates the time spent blocked on the upstream stage
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            finally:
+                if waited is not None:
+                    waited[0] += time.perf_counter() - start
+            if item is _DONE:
+                return
+            yield item
+
+    def _extract(self, pages):
+        # Only time spent extracting counts, not time blocked on a full queue
+        busy = 0.0
+        page_iter = iter_pages(self.pdf_bytes)
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            page = next(page_iter, None)
+            busy += time.perf_counter() - start
+            if page is None:
+                break
+            if not self.text_sample:
+                self.text_sample = page[1][:200]
+            self._put(pages, page)
+        self.monitor.record("extract", busy, pages=self.total_pages)
+        self._put(pages, _DONE)
+
+    def _chunk(self, pages, batches):
+        batch, count, tokens = [], 0, 0
+        waited, busy = [0.0], 0.0
+        chunk_iter = iter_chunks(self._iter_queue(pages, waited))
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunk_iter, None)
+            busy += time.perf_counter() - start
+            if chunk is None:
+                break
+            batch.append(chunk)
+            count += 1
+            tokens += chunk.tokens
+            if len(batch) >= self.batch_size:
+                self._put(batches, batch)
+                batch = []
+        if batch:
+            self._put(batches, batch)
+        self.monitor.record("chunk", busy - waited[0], chunks=count, tokens=tokens)
+        self._put(batches, _DONE)
+
+    def _embed_batch(self, texts):
+        with self.monitor.span("embed", chunks=len(texts)):
+            return self.embeddings.embed_documents(texts)
+
+    def _embed(self, batches, vectors):
+        # Several batches are embedded at once; results are passed on in order
+        with ThreadPoolExecutor(config.EMBED_MAX_CONCURRENCY) as pool:
+            pending = deque()
+            for chunks in self._iter_queue(batches):
+                texts = [chunk.text for chunk in chunks]
+                pending.append((chunks, pool.submit(self._embed_batch, texts)))
+                if len(pending) >= config.EMBED_MAX_CONCURRENCY:
+                    chunks, future = pending.popleft()
+                    self._put(vectors, (chunks, future.result()))
+            for chunks, future in pending:
+                self._put(vectors, (chunks, future.result()))
+        self._put(vectors, _DONE)
+
+    def _index(self, vectors):
+        for chunks, batch_vectors in self._iter_queue(vectors):
+            texts = [chunk.text for chunk in chunks]
+            text_embeddings = list(zip(texts, batch_vectors))
+            metadatas = [chunk.metadata() for chunk in chunks]
+            with self.monitor.span("index_build", chunks=len(texts)), self._lock:
+                if self.knowledge_base is None:
+                    self.knowledge_base = HybridFAISS.from_embeddings(
+                        text_embeddings, self.embeddings, metadatas=metadatas
+                    )
+                else:
+                    self.knowledge_base.add_embeddings(text_embeddings, metadatas=metadatas)
+                self.chunk_sizes += [len(text) for text in texts]
+                self.pages_indexed = chunks[-1].page_end
+            with self.monitor.span("lexical_build", chunks=len(texts)):
+                # Same order as the FAISS ids, so row i of both indexes is chunk i
+                self._lexical.add(texts)
+        if self._stop.is_set():
+            return
+        if self.knowledge_base is None:
+            raise ValueError("No text could be extracted from the PDF.")
+
+        # Large documents get an approximate (and optionally quantized) index;
+        # searches keep using the flat one while it trains
+        with self.monitor.span("index_optimize", vectors=self.chunks_indexed):
+            optimize_index(self.knowledge_base, monitor=self.monitor, lock=self._lock)
+        with self.monitor.span("lexical_build", chunks=self.chunks_indexed):
+            self.knowledge_base.lexical_index = self._lexical.build()
+        self._lexical = None
+
+        self.pages_indexed = self.total_pages
+        self.meta = {
+            "num_pages": self.total_pages,
+            "num_chunks": self.chunks_indexed,
+            "chunk_sizes": self.chunk_sizes,
+            "text_sample": self.text_sample,
+        }
+        self.monitor.log_text_extraction(self.total_pages, self.text_sample)
+        self.monitor.log_text_chunking(self.chunks_indexed, self.chunk_sizes)
+        self.monitor.log_embedding_creation(self.chunks_indexed, self.knowledge_base.index.d)
+        self.monitor.log_vector_store_creation(self.chunks_indexed)
+        if self._stop.is_set():
+            return
+        if self.on_complete is not None:
+            try:
+                self.on_complete(self)
+            except Exception as e:
+                # E.g. the index cache save on a full disk: the index is built
+                # and usable, it just will not be reused next time
+                self.monitor.log_error(f"Post-ingestion step failed, keeping the built index: {e}")
+        with self._lock:
+            if not self._stop.is_set():
+                self._done.set()
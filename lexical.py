@@ -0,0 +1,228 @@
+"""
+BM25 lexical index over the same chunks as the FAISS store.
+
+Dense retrieval misses exact identifiers (clause numbers, part codes, names)
+and needs a remote embedding call for every query. The BM25 index built here
+during ingestion is a compact CSR inverted index (numpy arrays, no per-term
+Python objects) that is scored with vectorized numpy operations and persisted
+next to the FAISS files. Row i of the index is FAISS vector id i.
+"""
+
+import json
+import re
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+import config
+from embedding_backends import model_id
+
+# Keeps identifiers such as "12.7", "a-113" or "v2/3" together as one term
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-_/][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+def is_identifier(term):
+    """
+    True for terms that look like codes rather than words (contain a digit).
+    """
+    return any(ch.isdigit() for ch in term)
+
+
+class BM25Builder:
+    """
+    Accumulates term counts chunk by chunk while the document is ingested.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.postings = []  # term id -> list of (doc id, term frequency)
+        self.doc_lengths = []
+
+    def add(self, texts):
+        for text in texts:
+            doc_id = len(self.doc_lengths)
+            terms = tokenize(text)
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                if term_id == len(self.postings):
+                    self.postings.append([])
+                self.postings[term_id].append((doc_id, tf))
+
+    def build(self):
+        indptr = np.zeros(len(self.postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in self.postings])
+        flat = [pair for postings in self.postings for pair in postings]
+        doc_ids = np.fromiter((d for d, _ in flat), dtype=np.int32, count=len(flat))
+        tfs = np.fromiter((tf for _, tf in flat), dtype=np.float32, count=len(flat))
+        return BM25Index(
+            self.vocabulary, indptr, doc_ids, tfs, np.asarray(self.doc_lengths, dtype=np.float32)
+        )
+
+
+class BM25Index:
+    """
+    Okapi BM25 over CSR postings: postings of term t are doc_ids/tfs[indptr[t]:indptr[t + 1]].
+    """
+
+    def __init__(self, vocabulary, indptr, doc_ids, tfs, doc_lengths, k1=1.5, b=0.75):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        num_docs = len(doc_lengths)
+        doc_freq = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = doc_lengths.mean() if num_docs else 1.0
+        # Per-document length normalisation, computed once
+        self.norm = k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))
+
+    @classmethod
+    def build(cls, texts):
+        builder = BM25Builder()
+        builder.add(texts)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def doc_freq(self, term):
+        """
+        Number of documents containing `term` (0 if it is not in the vocabulary).
+        """
+        term_id = self.vocabulary.get(term)
+        return 0 if term_id is None else int(self.indptr[term_id + 1] - self.indptr[term_id])
+
+    def scores(self, query):
+        """
+        BM25 score of every document for the query (one float32 array).
+        """
+        term_ids = [self.vocabulary[t] for t in set(tokenize(query)) if t in self.vocabulary]
+        if not term_ids:
+            return np.zeros(len(self), dtype=np.float32)
+        slices = [np.arange(self.indptr[t], self.indptr[t + 1]) for t in term_ids]
+        positions = np.concatenate(slices)
+        idf = np.repeat(self.idf[term_ids], [len(s) for s in slices])
+        docs = self.doc_ids[positions]
+        tf = self.tfs[positions]
+        contributions = idf * tf * (self.k1 + 1) / (tf + self.norm[docs])
+        return np.bincount(docs, weights=contributions, minlength=len(self)).astype(np.float32)
+
+    def search(self, query, k):
+        """
+        Top-k (doc id, score) pairs with a positive score, best first.
+        """
+        scores = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def save(self, path):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(
+            path,
+            terms=np.asarray(json.dumps(terms)),
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            tfs=self.tfs,
+            doc_lengths=self.doc_lengths,
+            params=np.asarray([self.k1, self.b]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            terms = json.loads(str(data["terms"]))
+            k1, b = data["params"].tolist()
+            return cls(
+                {term: i for i, term in enumerate(terms)},
+                data["indptr"], data["doc_ids"], data["tfs"], data["doc_lengths"], k1, b,
+            )
+
+
+class HybridFAISS(FAISS):
+    """
+    FAISS vector store that also carries a BM25 index over the same chunks and
+    saves / loads it alongside the FAISS files. The identity of the embedding
+    model is saved too, and loading with a different model fails instead of
+    mixing incompatible vectors.
+    """
+
+    lexical_index = None
+
+    def save_local(self, folder_path, index_name="index"):
+        super().save_local(folder_path, index_name)
+        if self.lexical_index is not None:
+            self.lexical_index.save(Path(folder_path) / f"{index_name}.bm25.npz")
+        with open(Path(folder_path) / f"{index_name}.model.json", "w", encoding="utf-8") as f:
+            json.dump({"embedding_model": model_id(self.embeddings), "dim": self.index.d}, f)
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings, index_name="index", **kwargs):
+        model_path = Path(folder_path) / f"{index_name}.model.json"
+        if model_path.exists():
+            with open(model_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)["embedding_model"]
+            if saved != model_id(embeddings):
+                raise ValueError(
+                    f"Index in {folder_path} holds {saved} vectors; it cannot be searched with {model_id(embeddings)}."
+                )
+        store = super().load_local(folder_path, embeddings, index_name=index_name, **kwargs)
+        path = Path(folder_path) / f"{index_name}.bm25.npz"
+        if path.exists():
+            store.lexical_index = BM25Index.load(path)
+        return store
+
+    def document(self, doc_id):
+        """
+        The Document stored for FAISS vector id `doc_id`.
+        """
+        return self.docstore.search(self.index_to_docstore_id[doc_id])
+
+    def vector_ids(self, docs):
+        """
+        FAISS vector ids of Documents returned by this store (None if unknown).
+        """
+        if len(getattr(self, "_vector_ids", ())) != len(self.index_to_docstore_id):
+            self._vector_ids = {doc_id: i for i, doc_id in self.index_to_docstore_id.items()}
+        return [self._vector_ids.get(doc.id) for doc in docs]
+
+
+def reciprocal_rank_fusion(*rankings, k=None):
+    """
+    Fuses ranked lists of ids: score(id) = sum(1 / (k + rank)).
+    Returns [(id, fused score), ...] best first.
+    """
+    k = k or config.RRF_K
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+def lexical_fast_path(query, hits, lexical_index):
+    """
+    True when BM25 alone can be trusted: the query names an identifier that
+    occurs in the index, and the best match clearly beats the runner-up (or,
+    when it is the only match, scores at least LEXICAL_FAST_PATH_MIN_SCORE).
+    """
+    if not hits:
+        return False
+    if not any(is_identifier(term) and lexical_index.doc_freq(term) > 0 for term in tokenize(query)):
+        return False
+    if len(hits) == 1:
+        return hits[0][1] >= config.LEXICAL_FAST_PATH_MIN_SCORE
+    return hits[0][1] >= config.LEXICAL_FAST_PATH_MARGIN * hits[1][1]
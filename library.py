@@ -0,0 +1,109 @@
+"""
+Pre-built document libraries written by bulk_ingest.py.
+
+A library directory holds numbered artifact versions plus a manifest naming
+the current one:
+
+    library/
+        manifest.json       current version, settings and per-document stats
+        v0003/              index.faiss, index.pkl, index.bm25.npz, meta.json
+        v0004/
+
+New versions are written next to the old ones and published by atomically
+replacing manifest.json, so apps loading the library never see a half-written
+index.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import config
+
+MANIFEST_FILE = "manifest.json"
+META_FILE = "meta.json"
+FORMAT = 1
+
+
+def version_dir(version):
+    return f"v{version:04d}"
+
+
+def read_manifest(library_dir):
+    """
+    The library's manifest, or None if nothing has been published there yet.
+    """
+    path = Path(library_dir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def publish(library_dir, knowledge_base, meta, manifest, keep_versions=None):
+    """
+    Saves the knowledge base as the next artifact version, points the manifest
+    at it and removes versions beyond the newest keep_versions.
+    Returns the manifest that was written.
+    """
+    library_dir = Path(library_dir)
+    library_dir.mkdir(parents=True, exist_ok=True)
+    keep_versions = keep_versions or config.LIBRARY_KEEP_VERSIONS
+    previous = read_manifest(library_dir)
+    existing = [int(p.name[1:]) for p in library_dir.glob("v[0-9]*") if p.name[1:].isdigit()]
+    version = max(existing + [previous["version"] if previous else 0]) + 1
+
+    tmp = library_dir / f".{version_dir(version)}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    knowledge_base.save_local(str(tmp))
+    with open(tmp / META_FILE, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, library_dir / version_dir(version))
+
+    manifest = {"format": FORMAT, "version": version, "artifacts": version_dir(version), **manifest}
+    tmp_manifest = library_dir / f".{MANIFEST_FILE}.tmp"
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, library_dir / MANIFEST_FILE)
+
+    for old in sorted(existing, reverse=True)[keep_versions - 1:]:
+        shutil.rmtree(library_dir / version_dir(old), ignore_errors=True)
+    return manifest
+
+
+def load_library(library_dir, embeddings):
+    """
+    Loads the current version of a library. Returns (knowledge_base, meta),
+    with the manifest included in meta. Raises ValueError when the library was
+    embedded with a different model than `embeddings`.
+    """
+    # FAISS and the index modules load here rather than at import time, so the
+    # apps can read the manifest before any of them are needed
+    import index_manager
+    from embedding_backends import model_id
+    from lexical import HybridFAISS
+
+    manifest = read_manifest(library_dir)
+    if manifest is None:
+        raise ValueError(f"No library has been published in {library_dir}.")
+    if manifest.get("format") == index_manager.FORMAT:
+        # Segmented library kept up to date by bulk_ingest.py --incremental
+        manager = index_manager.IndexManager(library_dir, embeddings)
+        return manager.snapshot, manager.meta()
+    if manifest.get("format") != FORMAT:
+        raise ValueError(f"Unsupported library format {manifest.get('format')!r} in {library_dir}.")
+    model = model_id(embeddings)
+    if manifest["settings"]["embedding_model"] != model:
+        raise ValueError(
+            f"Library {library_dir} was embedded with {manifest['settings']['embedding_model']}, "
+            f"but the app uses {model}."
+        )
+    artifacts = Path(library_dir) / manifest["artifacts"]
+    with open(artifacts / META_FILE, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    # Artifacts are only ever written by bulk_ingest.py, so unpickling is safe
+    knowledge_base = HybridFAISS.load_local(
+        str(artifacts), embeddings, allow_dangerous_deserialization=True
+    )
+    return knowledge_base, {**meta, "manifest": manifest}
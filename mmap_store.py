@@ -0,0 +1,349 @@
+"""
+Memory-mapped, read-only knowledge base format.
+
+A HybridFAISS keeps every vector as float32 inside the FAISS index and every
+chunk as a Document (text, metadata dict, docstore id) on the Python heap,
+including the overlap lines repeated at the start of the next chunk, and
+every process that loads it holds its own copy. write_store() saves a
+finished knowledge base as
+
+- vectors.npy   float16 vectors, memory-mapped and searched exactly in blocks
+                (norms.npy holds their squared norms); IVF indexes are also
+                saved as index.faiss, whose inverted lists FAISS memory-maps
+- texts.bin     all chunk texts as one UTF-8 blob, with a (start, end) byte
+                span per chunk in spans.npy; a chunk that begins with the
+                previous chunk's overlap lines points back into it, so the
+                overlap is stored once
+- fields.npy    integer metadata (pages, byte ranges) as one column per key;
+                string metadata (e.g. source) as indexes into a string table
+- bm25_*.npy    the BM25 postings
+- store.json    dimensions, column names, the string table and BM25 vocabulary
+
+and MappedStore opens it. Only the small parts (column names, string table,
+BM25 vocabulary and per-document norms) are read onto the heap; chunks are
+ChunkRecord views (__slots__) that become Documents only when retrieved.
+Processes opening the same store share its pages through the OS page cache.
+"""
+
+import json
+import mmap
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import config
+from embedding_backends import model_id
+from lexical import BM25Index
+
+FORMAT = 1
+STORE_FILE = "store.json"
+
+# Rows of vectors converted to float32 at a time by the exact search
+_BLOCK_ROWS = 4096
+
+
+def is_store(directory):
+    return (Path(directory) / STORE_FILE).is_file()
+
+
+def _all_vectors(index):
+    """
+    Every stored vector of a FAISS index, as float32 rows in id order.
+    """
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        # IVF indexes can only reconstruct once they have a direct map
+        faiss.extract_index_ivf(index).make_direct_map()
+        return index.reconstruct_n(0, index.ntotal)
+
+
+def _is_flat(index):
+    return isinstance(index, faiss.IndexFlat)
+
+
+def _write_texts(path, texts):
+    """
+    Writes the texts as one UTF-8 blob; returns their (start, end) byte spans.
+    Chunks overlap by whole lines, so a text that starts with lines the
+    previous one ends with reuses those bytes.
+    """
+    separator = config.CHUNK_SEPARATOR
+    spans = np.zeros((len(texts), 2), dtype=np.int64)
+    size = 0
+    previous = None
+    with open(path, "wb") as f:
+        for i, text in enumerate(texts):
+            start = size
+            rest = text
+            if previous is not None:
+                head, tail = previous.split(separator), text.split(separator)
+                overlap = next(
+                    (n for n in range(min(len(head), len(tail)), 0, -1) if head[-n:] == tail[:n]), 0
+                )
+                if overlap:
+                    shared = separator.join(tail[:overlap])
+                    start = size - len(shared.encode("utf-8"))
+                    rest = text[len(shared):]
+            data = rest.encode("utf-8")
+            f.write(data)
+            size += len(data)
+            spans[i] = (start, size)
+            previous = text
+    return spans
+
+
+def _columns(metadatas):
+    """
+    Splits metadata dicts into integer columns and string-table columns.
+    Every chunk of one knowledge base carries the same keys.
+    """
+    keys = list(metadatas[0]) if metadatas else []
+    if any(list(metadata) != keys for metadata in metadatas):
+        raise ValueError("Chunk metadata must have the same keys for every chunk")
+    strings, string_ids = [], {}
+    fields = {}
+    columns = np.zeros((len(metadatas), len(keys)), dtype=np.int64)
+    for column, key in enumerate(keys):
+        values = [metadata[key] for metadata in metadatas]
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            fields[key] = "int"
+            columns[:, column] = values
+        elif all(isinstance(value, str) for value in values):
+            fields[key] = "str"
+            for row, value in enumerate(values):
+                columns[row, column] = string_ids.setdefault(value, len(strings))
+                if string_ids[value] == len(strings):
+                    strings.append(value)
+        else:
+            raise ValueError(f"Metadata {key!r} must be all integers or all strings to be memory-mapped")
+    return fields, strings, columns
+
+
+def write_store(directory, knowledge_base):
+    """
+    Saves a finished HybridFAISS (vectors, chunks, BM25 index) in the
+    memory-mapped format under `directory`.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    index = knowledge_base.index
+    docs = [knowledge_base.document(i) for i in range(index.ntotal)]
+
+    vectors = _all_vectors(index).astype(np.float16)
+    np.save(directory / "vectors.npy", vectors)
+    # Norms of the stored (float16) vectors, so L2 distances match them exactly
+    stored = vectors.astype(np.float32)
+    np.save(directory / "norms.npy", np.einsum("ij,ij->i", stored, stored))
+    if not _is_flat(index):
+        faiss.write_index(index, str(directory / "index.faiss"))
+
+    np.save(directory / "spans.npy", _write_texts(directory / "texts.bin", [doc.page_content for doc in docs]))
+    fields, strings, columns = _columns([doc.metadata for doc in docs])
+    np.save(directory / "fields.npy", columns)
+
+    lexical = getattr(knowledge_base, "lexical_index", None)
+    if lexical is not None:
+        for name in ("indptr", "doc_ids", "tfs", "doc_lengths"):
+            np.save(directory / f"bm25_{name}.npy", getattr(lexical, name))
+
+    store = {
+        "format": FORMAT,
+        "num_chunks": index.ntotal,
+        "dim": index.d,
+        "metric": "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+        "embedding_model": model_id(knowledge_base.embeddings),
+        "fields": fields,
+        "strings": strings,
+        "bm25": None if lexical is None else {
+            "terms": sorted(lexical.vocabulary, key=lexical.vocabulary.get), "k1": lexical.k1, "b": lexical.b,
+        },
+    }
+    # Written last: a directory without it is not a store
+    with open(directory / STORE_FILE, "w", encoding="utf-8") as f:
+        json.dump(store, f)
+
+
+class ChunkRecord:
+    """
+    One chunk of a MappedStore, read from the mapped files on access.
+    """
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def page_content(self):
+        return self.store._text(self.row)
+
+    @property
+    def metadata(self):
+        return self.store._metadata(self.row)
+
+    def to_document(self):
+        return Document(id=str(self.row), page_content=self.page_content, metadata=self.metadata)
+
+    def __repr__(self):
+        return f"ChunkRecord(row={self.row})"
+
+
+class _MappedIndex:
+    """
+    The part of the faiss.Index interface the pipeline uses, over the
+    memory-mapped vectors: exact search in blocks, or the memory-mapped FAISS
+    index when the store has one.
+    """
+
+    def __init__(self, vectors, norms, metric, faiss_index=None):
+        self._vectors = vectors
+        self._norms = norms
+        self._inner_product = metric == "ip"
+        self._faiss_index = faiss_index
+        self.ntotal, self.d = vectors.shape
+        self.metric_type = faiss.METRIC_INNER_PRODUCT if self._inner_product else faiss.METRIC_L2
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype=np.float32)
+        if self._faiss_index is not None:
+            return self._faiss_index.search(queries, k)
+        # Smaller is better in both cases: L2 distances, or negated inner products
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        for start in range(0, self.ntotal, _BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+            products = queries @ block.T
+            if self._inner_product:
+                block_distances = -products
+            else:
+                block_distances = np.maximum(query_norms - 2 * products + self._norms[start:start + len(block)], 0)
+            merged_distances = np.concatenate([distances, block_distances], axis=1)
+            merged_ids = np.concatenate(
+                [ids, np.broadcast_to(np.arange(start, start + len(block)), block_distances.shape)], axis=1
+            )
+            top = np.argpartition(merged_distances, k - 1, axis=1)[:, :k]
+            distances = np.take_along_axis(merged_distances, top, axis=1)
+            ids = np.take_along_axis(merged_ids, top, axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")
+        distances = np.take_along_axis(distances, order, axis=1)
+        ids = np.take_along_axis(ids, order, axis=1)
+        ids[np.isinf(distances)] = -1
+        return (-distances if self._inner_product else distances), ids
+
+    def reconstruct(self, vector_id):
+        return np.asarray(self._vectors[vector_id], dtype=np.float32)
+
+
+class MappedStore(VectorStore):
+    """
+    Read-only knowledge base over a store written by write_store(); usable
+    wherever the pipeline takes a HybridFAISS.
+    """
+
+    def __init__(self, directory, embeddings):
+        directory = Path(directory)
+        with open(directory / STORE_FILE, "r", encoding="utf-8") as f:
+            store = json.load(f)
+        if store["embedding_model"] != model_id(embeddings):
+            raise ValueError(
+                f"Index in {directory} holds {store['embedding_model']} vectors; "
+                f"it cannot be searched with {model_id(embeddings)}."
+            )
+        self.directory = directory
+        self._embeddings = embeddings
+        self._fields = list(store["fields"].items())
+        self._strings = store["strings"]
+
+        vectors = np.load(directory / "vectors.npy", mmap_mode="r")
+        faiss_index = None
+        if (directory / "index.faiss").exists():
+            faiss_index = faiss.read_index(str(directory / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        # Norms are one float per chunk, read once for every search
+        self.index = _MappedIndex(vectors, np.load(directory / "norms.npy"), store["metric"], faiss_index)
+        self._spans = np.load(directory / "spans.npy", mmap_mode="r")
+        self._columns = np.load(directory / "fields.npy", mmap_mode="r")
+        with open(directory / "texts.bin", "rb") as f:
+            # An empty file cannot be mapped (a store of empty chunks)
+            self._texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if f.seek(0, 2) else b""
+
+        self.lexical_index = None
+        if store["bm25"] is not None:
+            arrays = {
+                name: np.load(directory / f"bm25_{name}.npy", mmap_mode="r")
+                for name in ("indptr", "doc_ids", "tfs", "doc_lengths")
+            }
+            self.lexical_index = BM25Index(
+                {term: i for i, term in enumerate(store["bm25"]["terms"])},
+                k1=store["bm25"]["k1"], b=store["bm25"]["b"], **arrays,
+            )
+
+    @property
+    def embeddings(self):
+        return self._embeddings
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def _text(self, row):
+        start, end = self._spans[row]
+        return self._texts[start:end].decode("utf-8")
+
+    def _metadata(self, row):
+        values = self._columns[row]
+        return {
+            key: int(value) if kind == "int" else self._strings[value]
+            for (key, kind), value in zip(self._fields, values)
+        }
+
+    def record(self, row):
+        return ChunkRecord(self, row)
+
+    def document(self, doc_id):
+        """
+        The Document for vector id `doc_id` (its id is the row number).
+        """
+        return self.record(int(doc_id)).to_document()
+
+    def vector_ids(self, docs):
+        """
+        Vector ids of Documents returned by this store (None if unknown).
+        """
+        return [int(doc.id) if doc.id is not None and doc.id.isdigit() else None for doc in docs]
+
+    def resident_bytes(self):
+        """
+        Rough heap size: what was read rather than mapped. The mapped vectors
+        and texts are shared page cache, not counted.
+        """
+        heap = self.index._norms.nbytes + sum(len(s) for s in self._strings)
+        if self.lexical_index is not None:
+            heap += self.lexical_index.idf.nbytes + self.lexical_index.norm.nbytes + 64 * len(self.lexical_index.vocabulary)
+        return heap
+
+    # VectorStore interface (used by the chain's retriever)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        distances, ids = self.index.search(np.asarray([embedding], dtype=np.float32), k)
+        return [(self.document(i), float(d)) for d, i in zip(distances[0], ids[0]) if i >= 0]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("MappedStore is read-only; build a HybridFAISS and save it with write_store()")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("MappedStore is read-only; build a HybridFAISS and save it with write_store()")
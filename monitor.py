@@ -1,141 +1,493 @@
+"""
+Monitoring for the PDF Q&A pipeline.
+
+Every step is emitted as one compact JSON line (monitor.jsonl). Records are
+handed to a queue and written by a background listener thread, started by
+the first Monitor(), so logging never blocks the request thread on file I/O.
+Timings are recorded through Monitor.span() / Monitor.record() and aggregated
+into per-stage latency histograms (p50/p95/p99) that can be exported as
+metrics.
+
+Every question is also timed on its own by a QueryTrace, which the apps show
+as a latency breakdown; when SLOW_QUERY_MS is set, questions slower than it
+are appended to a separate, size-capped slow-query log (slow_queries.jsonl)
+that slow_queries.py replays.
+
+The educational mode that explains each step in prose (monitor.log) is opt-in
+with MONITOR_VERBOSE=1; its messages are only formatted when it is enabled,
+and then on the listener thread.
+"""
+
+import atexit
+import json
 import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+
+import config
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queues the record untouched; formatting happens on the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {"ts": round(record.created, 3), "level": record.levelname.lower()}
+        if isinstance(record.msg, dict):
+            payload.update(record.msg)
+        else:
+            payload["message"] = record.getMessage()
+        return json.dumps(payload, default=str)
+
+
+class _Prose:
+    """
+    Lazily built verbose message.
+    """
+
+    def __init__(self, build):
+        self.build = build
+
+    def __str__(self):
+        return self.build()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener():
+    """
+    Starts the listener thread once per process, on the first Monitor().
+    Not at import: spawned worker processes import this module too, and
+    those that never log must not get a thread or open monitor.jsonl.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        _listener = _create_listener()
+
+
+def _create_listener():
+    events_handler = logging.FileHandler(config.MONITOR_EVENTS_FILE, encoding="utf-8", delay=True)
+    events_handler.setFormatter(_JsonFormatter())
+    events_handler.addFilter(logging.Filter("monitor.events"))
+
+    verbose_handler = logging.FileHandler(config.MONITOR_LOG_FILE, encoding="utf-8", delay=True)
+    verbose_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    verbose_handler.addFilter(logging.Filter("monitor.verbose"))
+
+    # Slow-query entries carry question, answer and chunk texts; the log is capped
+    slow_queries_handler = RotatingFileHandler(
+        config.SLOW_QUERY_LOG_FILE, encoding="utf-8", delay=True,
+        maxBytes=int(config.SLOW_QUERY_LOG_MAX_MB * 1024 * 1024), backupCount=config.SLOW_QUERY_LOG_BACKUPS,
+    )
+    slow_queries_handler.setFormatter(_JsonFormatter())
+    slow_queries_handler.addFilter(logging.Filter("monitor.slow_queries"))
+
+    queue = SimpleQueue()
+    for name in ("monitor.events", "monitor.verbose", "monitor.slow_queries"):
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(_DeferredQueueHandler(queue))
+
+    listener = QueueListener(queue, events_handler, verbose_handler, slow_queries_handler)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+_events = logging.getLogger("monitor.events")
+_verbose = logging.getLogger("monitor.verbose")
+_slow_queries = logging.getLogger("monitor.slow_queries")
+
+
+class LatencyHistogram:
+    """
+    Thread-safe latency histogram with log-spaced buckets (10% resolution,
+    0.1 ms to several hours), cheap enough to update on every request.
+    """
+
+    BOUNDS = [0.0001 * 1.1 ** i for i in range(200)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.BOUNDS, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, q):
+        """
+        Upper bound (seconds) of the bucket holding the q-th quantile.
+        """
+        with self._lock:
+            target = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if count and seen >= target:
+                    return self.BOUNDS[min(index, len(self.BOUNDS) - 1)]
+        return 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(1000 * self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(1000 * self.percentile(0.50), 3),
+            "p95_ms": round(1000 * self.percentile(0.95), 3),
+            "p99_ms": round(1000 * self.percentile(0.99), 3),
+        }
+
+
+# Histograms are process-wide so they aggregate across Streamlit reruns and sessions
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def _histogram(stage):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, LatencyHistogram())
+    return histogram
 
-# Configure logging to write to a file
-logging.basicConfig(
-    filename='monitor.log',
-    filemode='a',
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    level=logging.INFO
-)
 
 class Monitor:
     """
-    Educational Monitor for LLM/GenAI pipelines.
-    Logs each major step with explanations for new learners.
+    Monitor for LLM/GenAI pipelines.
+    Records a structured event and timing for each major step; in verbose mode
+    it also logs each step with explanations for new learners.
     """
 
+    def __init__(self, verbose=None):
+        _start_listener()
+        self.verbose = config.MONITOR_VERBOSE if verbose is None else verbose
+
+    # Structured events, spans and metrics
+
+    def event(self, name, level=logging.INFO, **fields):
+        """
+        Emits one JSON line for a pipeline event.
+        """
+        _events.log(level, {"event": name, **fields})
+
+    def record(self, stage, seconds, **fields):
+        """
+        Records how long a pipeline stage took.
+        """
+        if config.MONITOR_HISTOGRAMS:
+            _histogram(stage).observe(seconds)
+        self.event("span", stage=stage, ms=round(seconds * 1000, 3), **fields)
+
+    @contextmanager
+    def span(self, stage, **fields):
+        """
+        Times the enclosed block as one `stage` span:
+
+            with monitor.span("retrieve", k=4) as span:
+                ...
+                span["results"] = len(docs)
+
+        Fields added to the yielded dict are included in the record.
+        """
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    @staticmethod
+    def metrics():
+        """
+        Latency summary per stage: count, mean, p50, p95 and p99 in milliseconds.
+        """
+        return {stage: histogram.summary() for stage, histogram in sorted(_histograms.items())}
+
+    @staticmethod
+    def prometheus_metrics():
+        """
+        The latency histograms in Prometheus text exposition format (as summaries).
+        """
+        lines = [
+            "# HELP pdfqa_stage_latency_seconds Latency of each pipeline stage.",
+            "# TYPE pdfqa_stage_latency_seconds summary",
+        ]
+        for stage, histogram in sorted(_histograms.items()):
+            for q in (0.5, 0.95, 0.99):
+                lines.append(
+                    f'pdfqa_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {histogram.percentile(q):.6f}'
+                )
+            lines.append(f'pdfqa_stage_latency_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+            lines.append(f'pdfqa_stage_latency_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def _step(self, name, fields, prose, level=logging.INFO):
+        self.event(name, level=level, **fields)
+        if self.verbose:
+            _verbose.log(level, _Prose(prose))
+
+    # Pipeline steps
+
     def log_pdf_upload(self, filename):
         """
         Logs when a PDF file is uploaded by the user.
         """
-        logging.info(
+        self._step("pdf_upload", {"filename": filename}, lambda: (
             f"[STEP: PDF Upload]\nExplanation: The user has uploaded a PDF file. This is the entry point for the document Q&A pipeline.\nFilename: {filename}\n"
-        )
+        ))
+
+    def log_index_cache(self, key, hit):
+        """
+        Logs whether a previously built index was found in the on-disk cache.
+        """
+        self._step("index_cache", {"key": key[:16], "hit": hit}, lambda: (
+            f"[STEP: Index Cache]\nExplanation: The uploaded PDF is hashed together with the chunking settings and embedding model. If the same combination was processed before, the saved index is reused and extraction and embedding are skipped.\nCache key: {key[:16]}\nResult: {'hit' if hit else 'miss'}\n"
+        ))
 
     def log_text_extraction(self, num_pages, text_sample):
         """
         Logs the extraction of text from the PDF.
         """
-        logging.info(
+        self._step("text_extraction", {"pages": num_pages}, lambda: (
             f"[STEP: Text Extraction]\nExplanation: The text content is extracted from the uploaded PDF. This raw text will be processed further.\nNumber of pages: {num_pages}\nSample text: {text_sample[:200]}...\n"
-        )
+        ))
 
     def log_text_chunking(self, num_chunks, chunk_sizes):
         """
         Logs the chunking of extracted text into smaller pieces.
         """
-        logging.info(
+        fields = {"chunks": num_chunks}
+        if chunk_sizes:
+            fields["mean_chunk_size"] = round(sum(chunk_sizes) / len(chunk_sizes), 1)
+        self._step("text_chunking", fields, lambda: (
             f"[STEP: Text Chunking]\nExplanation: The extracted text is split into smaller, overlapping chunks. This helps the AI handle large documents and preserve context.\nNumber of chunks: {num_chunks}\nChunk sizes: {chunk_sizes}\n"
-        )
+        ))
 
     def log_embedding_creation(self, num_embeddings, embedding_dim):
         """
         Logs the creation of embeddings for all text chunks.
         """
-        logging.info(
+        self._step("embedding_creation", {"embeddings": num_embeddings, "dim": embedding_dim}, lambda: (
             f"[STEP: Embedding Creation]\nExplanation: Each text chunk is converted into a vector (embedding) using the Gemini embedding model. These vectors capture the meaning of the text.\nNumber of embeddings: {num_embeddings}\nEmbedding dimension: {embedding_dim}\n"
-        )
+        ))
+
+    def log_embedding_cache(self, hits, misses, total_hits, total_misses):
+        """
+        Logs how many embeddings were served from the per-chunk embedding cache.
+        """
+        self._step("embedding_cache", {
+            "hits": hits, "misses": misses, "total_hits": total_hits, "total_misses": total_misses,
+        }, lambda: (
+            f"[STEP: Embedding Cache]\nExplanation: Every chunk is looked up in a persistent cache of embeddings before calling the API. Chunks already embedded for any earlier PDF are reused, only new text is sent to the embedding model.\nHits: {hits}\nMisses: {misses}\nTotal hits/misses since start: {total_hits}/{total_misses}\n"
+        ))
+
+    def log_answer_cache(self, hit, similarity, total_hits, total_misses):
+        """
+        Logs a lookup in the semantic answer cache.
+        """
+        total = total_hits + total_misses
+        hit_rate = total_hits / total if total else 0.0
+        self._step("answer_cache", {
+            "hit": hit, "similarity": round(similarity, 4), "total_hits": total_hits,
+            "total_misses": total_misses, "hit_rate": round(hit_rate, 4),
+        }, lambda: (
+            f"[STEP: Answer Cache]\nExplanation: Before asking the LLM, the question's embedding is compared with earlier questions about the same document. A close enough match reuses the earlier answer.\nHit: {hit}\nBest similarity: {similarity:.4f}\nHit rate since start: {hit_rate:.1%}\n"
+        ))
+
+    def log_singleflight(self, operation, total_calls, total_coalesced):
+        """
+        Logs a request that was coalesced with an identical one already in flight.
+        """
+        self._step("singleflight", {
+            "operation": operation, "total_calls": total_calls, "total_coalesced": total_coalesced,
+        }, lambda: (
+            f"[STEP: Request Coalescing]\nExplanation: The same {operation} request for the same document was already running for another user, so this one waits for that result instead of calling the APIs again.\nCoalesced since start: {total_coalesced} of {total_calls} calls\n"
+        ))
+
+    def log_embedding_batch(self, batch_size, latency, retries):
+        """
+        Logs one batched request to the embedding API.
+        """
+        self.record("embed_request", latency, batch_size=batch_size, retries=retries)
+        if self.verbose:
+            _verbose.info(_Prose(lambda: (
+                f"[STEP: Embedding Batch]\nExplanation: Chunks are sent to the embedding API in batches, several at a time, while staying under the requests/min and tokens/min quota. Rate-limit (429) errors are retried after a randomized, growing delay.\nBatch size: {batch_size}\nLatency: {latency:.3f}s\nRetries: {retries}\n"
+            )))
 
     def log_vector_store_creation(self, num_vectors):
         """
         Logs the creation of the FAISS vector store.
         """
-        logging.info(
+        self._step("vector_store_creation", {"vectors": num_vectors}, lambda: (
             f"[STEP: Vector Store Creation]\nExplanation: All embeddings are stored in a FAISS vector database. This enables fast similarity search for relevant information.\nNumber of vectors stored: {num_vectors}\n"
-        )
+        ))
 
     def log_chain_creation(self, chain_type):
         """
         Logs the creation of the conversational retrieval chain.
         """
-        logging.info(
+        self._step("chain_creation", {"chain_type": chain_type}, lambda: (
             f"[STEP: Chain Creation]\nExplanation: The ConversationalRetrievalChain is set up. This chain manages the flow from user question to answer, using retrieval and the LLM.\nChain type: {chain_type}\n"
-        )
+        ))
 
     def log_user_question(self, question):
         """
         Logs when a user submits a question.
         """
-        logging.info(
+        self._step("user_question", {"question": question}, lambda: (
             f"[STEP: User Question]\nExplanation: The user has submitted a question. The system will now process this query through the pipeline.\nQuestion: {question}\n"
-        )
+        ))
 
     def log_error(self, error_message):
         """
         Logs errors and exceptions that occur during processing.
         """
-        logging.error(
+        self._step("error", {"error": str(error_message)}, lambda: (
             f"[STEP: Error Handling]\nExplanation: An error occurred during processing. This helps with debugging and improving the system.\nError: {error_message}\n"
-        )
+        ), level=logging.ERROR)
 
     def log_query_embedding(self, query, embedding):
         """
         Logs the process of converting a user question into a vector (embedding).
         Embeddings are how LLMs represent text as numbers for semantic understanding.
         """
-        logging.info(
+        self._step("query_embedding", {"query": query, "dim": len(embedding)}, lambda: (
             "[STEP: Query Embedding]"
             "\nExplanation: The user's question is converted into a high-dimensional vector (embedding). "
             "This allows the AI to compare the meaning of the question to the document chunks."
             f"\nQuery: {query}"
             f"\nEmbedding (first 100 chars): {str(embedding)[:100]}...\n"
-        )
+        ))
 
     def log_semantic_search(self, query_embedding, results):
         """
         Logs the semantic search step, where the system finds the most relevant document chunks.
         Semantic search uses embeddings to find text with similar meaning, not just keywords.
         """
-        logging.info(
+        self._step("semantic_search", {"results": len(results), "scores": [round(float(score), 4) for _, score in results]}, lambda: (
             "[STEP: Semantic Search]"
             "\nExplanation: The system searches the vector database for document chunks whose embeddings are most similar to the query embedding. "
             "This finds the most relevant information, even if the wording is different."
             f"\nQuery Embedding (first 100 chars): {str(query_embedding)[:100]}..."
             f"\nTop Results: {results}\n"
-        )
+        ))
 
     def log_knowledge_base_search(self, retrieved_chunks):
         """
         Logs the retrieval of relevant chunks from the knowledge base (vector store).
         This step collects the actual text that will be used to answer the question.
         """
-        logging.info(
+        self._step("knowledge_base_search", {"chunks": len(retrieved_chunks), "chars": sum(len(chunk) for chunk in retrieved_chunks)}, lambda: (
             "[STEP: Knowledge Base Search]"
             "\nExplanation: The most relevant text chunks are retrieved from the knowledge base (vector database). "
             "These chunks will be provided as context to the language model."
             f"\nRetrieved Chunks: {retrieved_chunks}\n"
-        )
+        ))
 
     def log_ranked_results(self, ranked_chunks):
         """
         Logs the ranking of retrieved chunks by relevance.
         Ranking helps the LLM focus on the most important information first.
         """
-        logging.info(
+        self._step("ranked_results", {"results": len(ranked_chunks)}, lambda: (
             "[STEP: Ranked Results]"
             "\nExplanation: The retrieved chunks are ranked by how closely they match the user's question. "
             "The top-ranked chunks are most likely to contain the answer."
             f"\nRanked Chunks: {ranked_chunks}\n"
-        )
+        ))
 
     def log_llm_response(self, answer):
         """
         Logs the final answer generated by the LLM (Generative AI).
         The LLM uses the retrieved context to generate a human-like answer.
         """
-        logging.info(
+        self._step("llm_response", {"answer_chars": len(answer)}, lambda: (
             "[STEP: LLM Generative AI Response]"
             "\nExplanation: The language model (LLM) uses the retrieved context to generate a natural language answer to the user's question. "
             "This is the final step, where the AI responds as if it were a human expert."
             f"\nAnswer: {answer}\n"
-        ) 
\ No newline at end of file
+        ))
+
+    def log_slow_query(self, entry):
+        """
+        Appends a question slower than SLOW_QUERY_MS, with what is needed to
+        replay it (see slow_queries.py), to the slow-query log.
+        """
+        _slow_queries.warning(entry)
+        trace = entry["trace"]
+        self._step("slow_query", {"total_ms": trace["total_ms"], "question": entry["question"][:80]}, lambda: (
+            "[STEP: Slow Query]"
+            "\nExplanation: This question took longer than the slow-query threshold. It has been written to the slow-query log "
+            "with its timings, settings and retrieved chunks so it can be replayed offline with slow_queries.py."
+            f"\nTotal: {trace['total_ms']:.0f} ms\nStages: {trace['stages']}\n"
+        ), level=logging.WARNING)
+
+
+class QueryTrace(Monitor):
+    """
+    Monitor for a single question. Everything is forwarded to the session's
+    monitor; the stage timings of this question are also kept, and summary()
+    turns them into the trace the apps show in their performance panel.
+    """
+
+    # (stage, label) in pipeline order; "llm_first_token" is part of "llm"
+    STAGES = [
+        ("condense", "History condense"),
+        ("retrieve_lexical", "Lexical search"),
+        ("embed_query", "Query embed"),
+        ("retrieve", "Vector search"),
+        ("pack_context", "Context packing"),
+        ("llm_first_token", "LLM first token"),
+        ("llm", "LLM total"),
+    ]
+
+    def __init__(self, monitor=None):
+        self.monitor = monitor or Monitor()
+        self.verbose = self.monitor.verbose
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    def event(self, name, level=logging.INFO, **fields):
+        self.monitor.event(name, level=level, **fields)
+
+    def record(self, stage, seconds, **fields):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.monitor.record(stage, seconds, **fields)
+
+    def summary(self, **fields):
+        """
+        {"total_ms", "stages": {stage: ms}, "other_ms", ...fields}. other_ms is
+        the time outside the traced stages (Python overhead, waiting).
+        """
+        total = time.perf_counter() - self.start
+        stages = {stage: self.stages[stage] for stage, _ in self.STAGES if stage in self.stages}
+        traced = sum(seconds for stage, seconds in stages.items() if stage != "llm_first_token")
+        return {
+            "total_ms": round(total * 1000, 1),
+            "stages": {stage: round(seconds * 1000, 1) for stage, seconds in stages.items()},
+            "other_ms": round(max(total - traced, 0.0) * 1000, 1),
+            **fields,
+        }
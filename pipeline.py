@@ -0,0 +1,226 @@
+"""
+Document ingestion pipeline shared by app.py and deploy/streamlit_app.py:
+PDF bytes -> text -> chunks -> embeddings -> FAISS knowledge base.
+"""
+
+import hashlib
+import threading
+import weakref
+
+from langchain_core.retrievers import BaseRetriever
+from pydantic import SecretStr
+
+import config
+from embedding_backends import REMOTE_BACKENDS, backend_id, create_backend, model_id, needs_api_key
+from embedding_cache import CachedEmbeddings
+from embedding_client import RateLimitedEmbeddings
+from index_cache import IndexCache, make_cache_key
+from ingest import IngestJob
+from library import load_library, read_manifest
+from monitor import Monitor
+from registry import default_registry
+from singleflight import default_flights
+
+# Chains built per (IngestJob, LLM); dropped together with their job
+_chains = weakref.WeakKeyDictionary()
+_chains_lock = threading.Lock()
+
+
+def wrap_embeddings(embeddings, monitor=None, store=None):
+    """
+    Puts an embeddings model behind the rate-limited batching client and the
+    persistent per-chunk embedding cache.
+    """
+    embeddings = RateLimitedEmbeddings(embeddings, monitor=monitor)
+    return CachedEmbeddings(embeddings, store=store, monitor=monitor)
+
+
+def create_embeddings(api_key=None, monitor=None, backend=None):
+    """
+    Embeddings from the configured backend (EMBEDDING_BACKEND). API backends
+    are wrapped for rate limiting and caching; the local model runs
+    in-process and needs neither.
+    """
+    backend = backend or config.EMBEDDING_BACKEND
+    embeddings = create_backend(backend, api_key)
+    if backend in REMOTE_BACKENDS:
+        return wrap_embeddings(embeddings, monitor=monitor)
+    return embeddings
+
+
+def _key_id(api_key):
+    # Registry keys identify the API key without holding it in plain text
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def shared_embeddings(api_key=None, monitor=None, registry=None):
+    """
+    The process-wide embeddings client for the configured backend (and API
+    key, for the remote one).
+    """
+    registry = registry or default_registry()
+    key_id = _key_id(api_key) if needs_api_key() else None
+    return registry.get(
+        ("embeddings", config.EMBEDDING_BACKEND, backend_id(), key_id),
+        lambda: create_embeddings(api_key, monitor=monitor),
+    )
+
+
+def shared_llm(api_key, registry=None):
+    """
+    The process-wide LLM client for this API key.
+    """
+    from langchain_google_genai import GoogleGenerativeAI
+
+    registry = registry or default_registry()
+    return registry.get(
+        ("llm", config.LLM_MODEL, _key_id(api_key)),
+        lambda: GoogleGenerativeAI(model=config.LLM_MODEL, google_api_key=SecretStr(api_key)),
+    )
+
+
+class _JobRetriever(BaseRetriever):
+    """
+    Retriever over whatever knowledge base the job holds right now, so a chain
+    built while indexing does not keep the in-heap index alive once the job
+    has switched to its memory-mapped copy. The job is held weakly: chains
+    are cached per job and must not keep it alive.
+    """
+
+    job: object  # weakref.ref to the IngestJob
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.job().knowledge_base.similarity_search(query, k=self.k)
+
+
+def shared_chain(job, llm, **kwargs):
+    """
+    ConversationalRetrievalChain over the job's knowledge base, built once per
+    (job, LLM, options) and shared by every session using that job.
+    """
+    # Only needed once a document can be queried, not while it is uploading
+    from langchain.chains import ConversationalRetrievalChain
+
+    with _chains_lock:
+        chains = _chains.setdefault(job, {})
+        key = (id(llm), tuple(sorted(kwargs.items())))
+        if key not in chains:
+            chains[key] = ConversationalRetrievalChain.from_llm(
+                llm=llm, retriever=_JobRetriever(job=weakref.ref(job)), **kwargs
+            )
+        return chains[key]
+
+
+def index_settings(embeddings):
+    """
+    Every setting that changes the index built for a document.
+    """
+    return {
+        "separator": config.CHUNK_SEPARATOR,
+        "chunk_tokens": config.CHUNK_TOKENS,
+        "chunk_overlap_tokens": config.CHUNK_OVERLAP_TOKENS,
+        "chunk_boilerplate_lookahead": config.CHUNK_BOILERPLATE_LOOKAHEAD,
+        # Which lines count as repeated headers (chunking._signature)
+        "chunk_boilerplate_match": "page-markers",
+        "embedding_model": model_id(embeddings),
+        "index_type": config.INDEX_TYPE,
+        "index_quantization": config.INDEX_QUANTIZATION,
+        "index_flat_max_vectors": config.INDEX_FLAT_MAX_VECTORS,
+        "lexical_index": "bm25",
+    }
+
+
+def index_cache_key(pdf_bytes, embeddings):
+    """
+    Cache key for the index built from these PDF bytes with the current settings.
+    """
+    return make_cache_key(pdf_bytes, **index_settings(embeddings))
+
+
+def start_ingest(pdf_bytes, embeddings, monitor=None, cache=None):
+    """
+    Returns an IngestJob for the PDF. When the same file was already processed
+    with the same settings the job is loaded from the index cache and is done
+    immediately; otherwise it runs in the background and saves its result to
+    the cache when it finishes. Calls for a document that is still being
+    ingested get the running job instead of starting a second one.
+    """
+    monitor = monitor or Monitor()
+    cache = cache or IndexCache()
+    key = index_cache_key(pdf_bytes, embeddings)
+
+    def start():
+        cached = cache.load(key, embeddings)
+        monitor.log_index_cache(key, hit=cached is not None)
+        if cached is not None:
+            return IngestJob.completed(*cached, key=key)
+
+        def save_to_cache(job):
+            cache.save(key, job.knowledge_base, job.meta)
+            if config.INDEX_STORE == "mmap":
+                # Serve from the shared mapped copy rather than this process' heap
+                saved = cache.load(key, embeddings)
+                if saved is not None:
+                    job.replace_knowledge_base(saved[0])
+
+        return IngestJob(
+            pdf_bytes, embeddings, monitor=monitor, on_complete=save_to_cache, key=key
+        ).start()
+
+    return default_flights().share((key, "ingest"), start)
+
+
+def open_library(library_dir, embeddings, monitor=None):
+    """
+    Returns a finished IngestJob for the current version of a library built by
+    bulk_ingest.py, so the apps can use it exactly like an uploaded PDF.
+    """
+    knowledge_base, meta = load_library(library_dir, embeddings)
+    (monitor or Monitor()).event(
+        "library_loaded", library=str(library_dir), version=meta["manifest"]["version"],
+        documents=meta["manifest"]["num_documents"], chunks=meta["num_chunks"],
+    )
+    manifest = meta["manifest"]
+    return IngestJob.completed(knowledge_base, meta, key=f"library:{library_dir}:{manifest['version']}")
+
+
+def acquire_ingest(pdf_bytes, embeddings, monitor=None, registry=None):
+    """
+    Lease on the process-wide IngestJob for this PDF and these settings.
+    Sessions uploading the same document share one job and one index.
+    """
+    registry = registry or default_registry()
+    key = ("document", index_cache_key(pdf_bytes, embeddings))
+    start = lambda: start_ingest(pdf_bytes, embeddings, monitor=monitor)
+    lease = registry.acquire(key, start, on_unused=_cancel_unfinished)
+    if lease.value.error is not None:
+        # A failed job is not handed out again; this upload starts over
+        lease.release()
+        registry.discard(key)
+        lease = registry.acquire(key, start, on_unused=_cancel_unfinished)
+    return lease
+
+
+def _cancel_unfinished(job):
+    # Nobody waits for this document any more: stop embedding it
+    return job.cancel()
+
+
+def acquire_library(library_dir, embeddings, monitor=None, registry=None):
+    """
+    Lease on the process-wide IngestJob for the current version of a library.
+    """
+    registry = registry or default_registry()
+    manifest = read_manifest(library_dir)
+    version = manifest["version"] if manifest else None
+    key = ("library", str(library_dir), version, getattr(embeddings, "model", None))
+    return registry.acquire(key, lambda: open_library(library_dir, embeddings, monitor=monitor))
+
+
+def build_knowledge_base(pdf_bytes, embeddings, monitor=None, cache=None):
+    """
+    Builds (or loads) the FAISS knowledge base and waits for it.
+    Returns (knowledge_base, meta).
+    """
+    return start_ingest(pdf_bytes, embeddings, monitor=monitor, cache=cache).wait()
@@ -0,0 +1,342 @@
+"""
+Question answering over a FAISS knowledge base.
+
+ConversationalRetrievalChain.invoke() embeds the question inside its retriever,
+so the monitoring calls in app.py had to embed and search a second (and third)
+time to see what was retrieved. ask() runs the same steps as the chain - using
+the chain's own condense-question and combine-documents components - but embeds
+the question once, searches once by vector, and hands that single result to
+both the monitor and the LLM.
+
+Knowledge bases built by ingest.py also carry a BM25 index (lexical.py).
+Retrieval fuses the lexical and vector rankings, and queries naming an
+identifier that BM25 matches unambiguously skip the embedding call entirely.
+
+When a document_key is given, identical questions about the same document
+asked concurrently (e.g. by several sessions) are coalesced by singleflight.py
+into one retrieval and one LLM call, and answers to standalone questions are
+kept in a per-document semantic answer cache (answer_cache.py).
+
+Retrieved chunks are packed into the prompt by context.py: adjacent chunks
+are merged, overlap is dropped and the context is filled up to a token
+budget rather than a fixed number of chunks.
+
+Each question is timed by its own monitor.QueryTrace: result["trace"] holds
+the latency of every stage plus tokens in and out, and (when SLOW_QUERY_MS is
+set) slower questions are written to the slow-query log for slow_queries.py.
+"""
+
+import time
+
+import numpy as np
+
+import config
+from answer_cache import default_answer_cache
+from context import pack_context
+from embedding_backends import model_id
+from embedding_client import estimate_tokens
+from history import needs_condense
+from lexical import lexical_fast_path, reciprocal_rank_fusion
+from monitor import Monitor, QueryTrace
+from singleflight import default_flights, normalize
+
+DEFAULT_K = 4
+
+
+def condense_question(chain, question, chat_history, monitor=None):
+    """
+    Rewrites a follow-up question into a standalone one using the chat history.
+    The LLM call is skipped when history.needs_condense() finds the question
+    already standalone. Returns (question to retrieve with, chat history as
+    text, whether it was condensed).
+    """
+    monitor = monitor or Monitor()
+    # Already imported with the chain; importing it here keeps qa light to load
+    from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+    get_chat_history = chain.get_chat_history or _get_chat_history
+    chat_history_str = get_chat_history(chat_history)
+    history_tokens = estimate_tokens(chat_history_str) if chat_history_str else 0
+    if not chat_history_str or not needs_condense(question, chat_history):
+        if chat_history_str:
+            monitor.event("condense_skipped", history_turns=len(chat_history), history_tokens=history_tokens)
+        return question, chat_history_str, False
+    generator = chain.question_generator
+    with monitor.span(
+        "condense", history_turns=len(chat_history),
+        prompt_tokens=estimate_tokens(question) + history_tokens,
+    ):
+        new_question = generator.invoke(
+            {"question": question, "chat_history": chat_history_str}
+        )[generator.output_key]
+    return new_question, chat_history_str, True
+
+
+def retrieve(knowledge_base, query, k=DEFAULT_K, monitor=None, mode=None):
+    """
+    Embeds the query once and runs one vector search, fused with BM25 when the
+    knowledge base has a lexical index. mode is "hybrid" | "vector" | "lexical".
+    Returns (query embedding, [(document, score), ...]). The embedding is None
+    when the lexical fast path answered without calling the embedding API;
+    scores are L2 distances for vector-only results and fused scores
+    (higher is better) otherwise. Results are always best first.
+    """
+    query_embedding, docs_and_scores, _ = _retrieve(knowledge_base, query, k, monitor, mode)
+    return query_embedding, docs_and_scores
+
+
+def _retrieve(knowledge_base, query, k, monitor=None, mode=None, lookup=None):
+    """
+    retrieve(), plus an answer cache check between embedding the query and
+    searching: lookup(query embedding) is called before the vector search, and
+    if it finds a cached answer the search is skipped. Returns (query
+    embedding, [(document, score), ...], cached answer or None).
+    """
+    monitor = monitor or Monitor()
+    mode = mode or config.RETRIEVAL_MODE
+    lexical_index = getattr(knowledge_base, "lexical_index", None)
+    hybrid = lexical_index is not None and mode != "vector"
+    if hybrid:
+        with monitor.span("retrieve_lexical", k=k) as span:
+            lexical_hits = lexical_index.search(query, config.HYBRID_CANDIDATES)
+            span["hits"] = len(lexical_hits)
+        if mode == "lexical" or (config.LEXICAL_FAST_PATH and lexical_fast_path(query, lexical_hits, lexical_index)):
+            monitor.event("lexical_fast_path", hits=len(lexical_hits))
+            return None, [(knowledge_base.document(i), score) for i, score in lexical_hits[:k]], None
+
+    with monitor.span("embed_query"):
+        query_embedding = knowledge_base.embeddings.embed_query(query)
+    cached = None if lookup is None else lookup(query_embedding)
+    if cached is not None:
+        return query_embedding, [], cached
+    if not hybrid:
+        with monitor.span("retrieve", k=k):
+            docs_and_scores = knowledge_base.similarity_search_with_score_by_vector(query_embedding, k=k)
+        return query_embedding, docs_and_scores, None
+
+    with monitor.span("retrieve", k=k, hybrid=True):
+        _, vector_ids = knowledge_base.index.search(
+            np.asarray([query_embedding], dtype=np.float32), config.HYBRID_CANDIDATES
+        )
+        fused = reciprocal_rank_fusion(
+            [int(i) for i in vector_ids[0] if i >= 0], [i for i, _ in lexical_hits]
+        )
+        docs_and_scores = [(knowledge_base.document(i), score) for i, score in fused[:k]]
+    return query_embedding, docs_and_scores, None
+
+
+def _prepare(chain, knowledge_base, question, chat_history, k, monitor, document_key=None):
+    """
+    Condenses the question, checks the answer cache and retrieves the context.
+    Returns the partial result dict plus the inputs for the combine-documents
+    chain. On an answer cache hit the result already holds the answer and its
+    sources, and neither the index search nor context packing has run.
+    """
+    new_question, chat_history_str, condensed = condense_question(chain, question, chat_history, monitor)
+    # Only standalone questions against a finished index are cached: when the
+    # question depends on the chat history, the same words can mean something else
+    lookup = None
+    if config.ANSWER_CACHE and document_key is not None and not condensed and getattr(knowledge_base, "done", True):
+        lookup = lambda vector: default_answer_cache().lookup(document_key, vector, monitor)
+    # With packing, more candidates than k; packing decides how many fit the token budget
+    candidates = max(k, config.CONTEXT_CANDIDATES) if config.CONTEXT_PACKING else k
+    query_embedding, docs_and_scores, cached = _retrieve(
+        knowledge_base, new_question, candidates, monitor, lookup=lookup
+    )
+    result = {
+        "answer": None,
+        "source_documents": None,
+        "generated_question": new_question,
+        "query_embedding": query_embedding,
+        "docs_and_scores": docs_and_scores,
+        "answer_cache": None,
+        "condensed": condensed,
+    }
+    if cached is not None:
+        result.update(answer=cached.answer, source_documents=cached.sources, answer_cache="hit")
+    else:
+        if lookup is not None and query_embedding is not None:
+            result["answer_cache"] = "miss"
+        docs = [doc for doc, _ in docs_and_scores]
+        if config.CONTEXT_PACKING:
+            with monitor.span("pack_context", candidates=len(docs)) as span:
+                docs = pack_context(knowledge_base, docs, query_embedding)
+                span["passages"] = len(docs)
+        result["source_documents"] = docs
+    inputs = {
+        "input_documents": result["source_documents"],
+        "question": new_question if chain.rephrase_question else question,
+        "chat_history": chat_history_str,
+    }
+    result["prompt_tokens"] = estimate_tokens(
+        inputs["question"] + "".join(doc.page_content for doc in result["source_documents"])
+    )
+    return result, inputs
+
+
+def _remember(document_key, result):
+    if result["answer_cache"] == "miss":
+        default_answer_cache().put(
+            document_key, result["query_embedding"], result["generated_question"],
+            result["answer"], result["source_documents"],
+        )
+
+
+def _remember_streamed(document_key, result, tokens):
+    """
+    Passes tokens through and caches the complete answer. Runs once per
+    shared stream (in its producer), not once per coalesced reader; a stream
+    stopped early caches nothing.
+    """
+    parts = []
+    for token in tokens:
+        parts.append(token)
+        yield token
+    _remember(document_key, dict(result, answer="".join(parts)))
+
+
+def _flight_key(document_key, operation, question, chat_history, k):
+    history = tuple((normalize(q), normalize(a)) for q, a in chat_history)
+    return (document_key, operation, normalize(question), history, k)
+
+
+def _finish_turn(trace, result, knowledge_base, question, chat_history, k, document_key):
+    # End-to-end latency of one question, with what shaped it
+    trace.record(
+        "turn", time.perf_counter() - trace.start, history_turns=len(chat_history),
+        condensed=result["condensed"], answer_cache=result["answer_cache"],
+        prompt_tokens=result["prompt_tokens"],
+    )
+    answered = result["answer_cache"] != "hit"
+    result["trace"] = trace.summary(
+        tokens_in=result["prompt_tokens"] if answered else 0,
+        tokens_out=estimate_tokens(result["answer"] or "") if answered else 0,
+        condensed=result["condensed"],
+        answer_cache=result["answer_cache"],
+        # Retrieval ran for a concurrent identical question (singleflight)
+        coalesced=not {"embed_query", "retrieve_lexical"} & trace.stages.keys(),
+    )
+    slow = 0 < config.SLOW_QUERY_MS <= result["trace"]["total_ms"]
+    result["trace"]["slow"] = slow
+    if slow:
+        trace.log_slow_query(_slow_query_entry(result, knowledge_base, question, chat_history, k, document_key))
+
+
+def _slow_query_entry(result, knowledge_base, question, chat_history, k, document_key):
+    """
+    What slow_queries.replay() needs to ask the question again offline: the
+    question and history, the settings it ran with and the retrieved chunks.
+    """
+    embeddings = getattr(knowledge_base, "embeddings", None)
+    index = getattr(knowledge_base, "index", None)
+    return {
+        "event": "slow_query",
+        "question": question,
+        "chat_history": [list(turn) for turn in chat_history],
+        "generated_question": result["generated_question"],
+        "k": k,
+        "document": document_key,
+        "embedding_model": None if embeddings is None else model_id(embeddings),
+        "index_vectors": getattr(index, "ntotal", None),
+        "settings": {
+            name: getattr(config, name) for name in (
+                "RETRIEVAL_MODE", "HYBRID_CANDIDATES", "LEXICAL_FAST_PATH", "CONTEXT_PACKING",
+                "CONTEXT_CANDIDATES", "CONTEXT_TOKEN_BUDGET",
+            )
+        },
+        "trace": result["trace"],
+        "retrieved": [
+            {"content": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+            for doc, score in result["docs_and_scores"]
+        ],
+        "answer": result["answer"],
+    }
+
+
+def ask(chain, knowledge_base, question, chat_history, k=DEFAULT_K, monitor=None, document_key=None):
+    """
+    Answers a question with a single query embedding and a single search.
+    Returns the chain's usual "answer" and "source_documents" plus the
+    intermediate results needed for monitoring and the question's "trace".
+    """
+    monitor = QueryTrace(monitor)
+
+    def run():
+        result, inputs = _prepare(chain, knowledge_base, question, chat_history, k, monitor, document_key)
+        if result["answer"] is not None:
+            return result
+        combine_docs_chain = chain.combine_docs_chain
+        with monitor.span(
+            "llm", context_chunks=len(result["source_documents"]), prompt_tokens=result["prompt_tokens"]
+        ):
+            result["answer"] = combine_docs_chain.invoke(inputs)[combine_docs_chain.output_key]
+        _remember(document_key, result)
+        return result
+
+    if document_key is None:
+        result = run()
+    else:
+        key = _flight_key(document_key, "ask", question, chat_history, k)
+        result = dict(default_flights().do(key, run))
+    _finish_turn(monitor, result, knowledge_base, question, chat_history, k, document_key)
+    return result
+
+
+def _stream_llm(combine_docs_chain, inputs):
+    """
+    Streams the combine-documents step token by token. The "stuff" chain's
+    prompt is filled in exactly as the chain would and sent to its LLM's
+    stream(); other chain types fall back to a single chunk.
+    """
+    llm_chain = getattr(combine_docs_chain, "llm_chain", None)
+    if llm_chain is None or not hasattr(combine_docs_chain, "_get_inputs"):
+        yield combine_docs_chain.invoke(inputs)[combine_docs_chain.output_key]
+        return
+    docs = inputs["input_documents"]
+    extra = {key: value for key, value in inputs.items() if key != "input_documents"}
+    prompt = llm_chain.prompt.format_prompt(**combine_docs_chain._get_inputs(docs, **extra))
+    for chunk in llm_chain.llm.stream(prompt):
+        # LLMs stream strings, chat models stream message chunks
+        yield getattr(chunk, "content", chunk)
+
+
+def ask_stream(chain, knowledge_base, question, chat_history, k=DEFAULT_K, monitor=None, document_key=None):
+    """
+    Like ask(), but streams the answer. Returns (result, tokens): retrieval has
+    already run, `tokens` is a generator of answer text pieces (suitable for
+    st.write_stream), and result["answer"] is filled in once it is exhausted.
+    Time to first token is recorded as the "llm_first_token" span, and
+    result["trace"] is filled in with the answer.
+    """
+    monitor = QueryTrace(monitor)
+    prepare = lambda: _prepare(chain, knowledge_base, question, chat_history, k, monitor, document_key)
+    if document_key is None:
+        result, inputs = prepare()
+        stream = _stream_llm(chain.combine_docs_chain, inputs)
+    else:
+        # Concurrent identical questions share retrieval and one LLM token stream
+        flights = default_flights()
+        result, inputs = flights.do(_flight_key(document_key, "retrieve", question, chat_history, k), prepare)
+        result = dict(result)
+        stream = flights.stream(
+            _flight_key(document_key, "answer", question, chat_history, k),
+            lambda: _remember_streamed(document_key, result, _stream_llm(chain.combine_docs_chain, inputs)),
+        ) if result["answer"] is None else [result["answer"]]
+
+    def tokens():
+        start = time.perf_counter()
+        parts = []
+        for token in stream:
+            if not parts and result["answer_cache"] != "hit":
+                monitor.record("llm_first_token", time.perf_counter() - start)
+            parts.append(token)
+            yield token
+        if result["answer_cache"] != "hit":
+            result["answer"] = "".join(parts)
+            monitor.record(
+                "llm", time.perf_counter() - start, context_chunks=len(result["source_documents"]),
+                prompt_tokens=result["prompt_tokens"], streamed=True,
+            )
+        _finish_turn(monitor, result, knowledge_base, question, chat_history, k, document_key)
+
+    return result, tokens()
@@ -0,0 +1,65 @@
+"""
+Rate-limit primitives shared by the embedding client and the LLM callers:
+token buckets for requests/min and tokens/min quotas, and recognizing a
+429 / quota error. Kept free of LangChain so the apps can import it at page
+load.
+"""
+
+import threading
+import time
+
+
+def is_rate_limit_error(error):
+    """
+    True for HTTP 429 / quota-exhausted errors from the Gemini client (or a stub).
+    """
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """
+        Blocks until `amount` tokens are available, then takes them.
+        """
+        # A single request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Quotas apply per API key and model, not per wrapper instance, so the
+# buckets are shared by every client in the process
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(name, rate_per_minute):
+    with _buckets_lock:
+        key = (name, rate_per_minute)
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate_per_minute)
+        return _buckets[key]
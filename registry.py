@@ -0,0 +1,243 @@
+"""
+Process-wide registry of shared, read-only resources.
+
+Streamlit runs every session in the same process, but each session used to
+build its own embedding client, LLM client, chain and FAISS index. The
+registry hands out one instance per key (document hash + settings, or model
++ API key) to every session that asks for it:
+
+- construction is lazy and happens once per key, under a per-key lock, so
+  concurrent sessions asking for the same key wait for the first builder
+  instead of building their own copy;
+- every acquire() returns a Lease; the entry's reference count drops when the
+  lease is released or garbage collected (e.g. with its session's state);
+- entries nobody holds are evicted least recently used first once the
+  estimated size of all entries exceeds the memory budget (sizes are
+  estimated when an entry is built and again when its last lease goes);
+- an entry can register an on_unused hook that runs when its last lease is
+  released, e.g. to cancel an ingestion no session is waiting for any more.
+"""
+
+import threading
+import time
+import weakref
+from collections import deque
+
+import config
+from monitor import Monitor
+
+
+def estimate_bytes(resource):
+    """
+    Rough resident size of a resource: the vectors and chunk text of a
+    knowledge base (or IngestJob), zero for small objects such as clients.
+    Memory-mapped stores (mmap_store.py) only count what they hold on the heap.
+    """
+    knowledge_base = getattr(resource, "knowledge_base", resource)
+    if hasattr(knowledge_base, "resident_bytes"):
+        return knowledge_base.resident_bytes()
+    index = getattr(knowledge_base, "index", None)
+    if index is None or not hasattr(index, "ntotal"):
+        return 0
+    # IngestJob keeps chunk sizes; reading them is safe while it is still indexing
+    chunk_sizes = getattr(resource, "chunk_sizes", None)
+    if chunk_sizes is None:
+        chunk_sizes = [len(doc.page_content) for doc in knowledge_base.docstore._dict.values()]
+    return index.ntotal * index.d * 4 + sum(chunk_sizes)
+
+
+class Lease:
+    """
+    A reference to a registry entry. Hold it for as long as the resource is used.
+    """
+
+    def __init__(self, registry, key, entry):
+        self.key = key
+        self.value = entry.value
+        # Bound to the entry, not the key, so a discarded entry is never confused with its successor
+        self._finalizer = weakref.finalize(self, registry._release, entry)
+
+    def release(self):
+        self._finalizer()
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+
+class _Entry:
+    def __init__(self, key, size_of, on_unused):
+        self.key = key
+        self.lock = threading.Lock()
+        self.value = None
+        self.ready = False
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.size_of = size_of
+        self.size = 0
+        self.on_unused = on_unused
+
+
+class ResourceRegistry:
+    """
+    Thread-safe, reference-counted, size-bounded cache of shared resources.
+    """
+
+    def __init__(self, max_bytes=None, monitor=None):
+        if max_bytes is None:
+            max_bytes = int(config.REGISTRY_MAX_MB * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.monitor = monitor or Monitor()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Lease releases waiting for the lock (see _release)
+        self._released = deque()
+
+    def acquire(self, key, factory, size_of=estimate_bytes, on_unused=None):
+        """
+        Returns a Lease on the resource for key, calling factory() to build it
+        if it is not registered yet. Exceptions from factory propagate and
+        leave nothing registered.
+
+        on_unused(value) is called (under the registry lock, so keep it quick)
+        when the last lease is released; if it returns True the value is no
+        longer usable and the entry is dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(key, size_of, on_unused)
+            entry.refs += 1
+            entry.last_used = time.monotonic()
+
+        # Only the first caller builds; the others block here until it is done
+        with entry.lock:
+            if not entry.ready:
+                with self._lock:
+                    self.misses += 1
+                try:
+                    with self.monitor.span("registry_build", key=_describe(key)):
+                        entry.value = factory()
+                except BaseException:
+                    with self._lock:
+                        entry.refs -= 1
+                        if self._entries.get(key) is entry and not entry.ready:
+                            del self._entries[key]
+                    raise
+                entry.size = size_of(entry.value)
+                entry.ready = True
+            else:
+                with self._lock:
+                    self.hits += 1
+        lease = Lease(self, key, entry)
+        self._evict()
+        self._drain()
+        return lease
+
+    def get(self, key, factory, size_of=estimate_bytes):
+        """
+        The resource for key, without holding a lease. For small, long-lived
+        objects such as API clients; they stay registered until evicted.
+        """
+        lease = self.acquire(key, factory, size_of)
+        value = lease.value
+        lease.release()
+        return value
+
+    def discard(self, key):
+        """
+        Forgets the entry for key; current lease holders keep their value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.ready:
+                del self._entries[key]
+        self._drain()
+
+    def _release(self, entry):
+        # The lease finalizer: it also runs from the garbage collector, which
+        # can fire on a thread that already holds self._lock. The release is
+        # queued and applied now only if the lock is free; otherwise the
+        # holder applies it when it is done (_drain).
+        self._released.append(entry)
+        if self._lock.acquire(blocking=False):
+            self._lock.release()
+            self._drain()
+
+    def _drain(self):
+        """
+        Applies queued lease releases. Call without holding self._lock.
+        """
+        while self._released:
+            try:
+                entry = self._released.popleft()
+            except IndexError:
+                return
+            with self._lock:
+                entry.refs -= 1
+                entry.last_used = time.monotonic()
+                if entry.refs == 0 and entry.ready:
+                    # It may have grown while in use (an ingestion finishing)
+                    entry.size = entry.size_of(entry.value)
+                    # Decided under the lock, so a concurrent acquire() either
+                    # keeps the entry alive or gets a fresh one
+                    if entry.on_unused is not None and entry.on_unused(entry.value):
+                        if self._entries.get(entry.key) is entry:
+                            del self._entries[entry.key]
+                        self.monitor.event("registry_unused", key=_describe(entry.key))
+            self._evict()
+
+    def _evict(self):
+        """
+        Drops unreferenced entries, least recently used first, until the
+        estimated total size fits the budget.
+        """
+        with self._lock:
+            ready = [(key, entry) for key, entry in self._entries.items() if entry.ready]
+            total = sum(entry.size for _, entry in ready)
+            for key, entry in sorted(ready, key=lambda item: item[1].last_used):
+                if total <= self.max_bytes:
+                    break
+                if entry.refs > 0 or entry.size == 0:
+                    continue
+                del self._entries[key]
+                total -= entry.size
+                self.evictions += 1
+                self.monitor.event("registry_evict", key=_describe(key), bytes=entry.size)
+
+    def stats(self):
+        self._drain()
+        with self._lock:
+            entries = [entry for entry in self._entries.values() if entry.ready]
+            return {
+                "entries": len(entries),
+                "in_use": sum(1 for entry in entries if entry.refs > 0),
+                "bytes": sum(entry.size for entry in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _describe(key):
+    # Keys hold document hashes; the first element names the kind of resource
+    return key[0] if isinstance(key, tuple) else str(key)
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def default_registry():
+    """
+    The process-wide ResourceRegistry shared by all Streamlit sessions.
+    """
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ResourceRegistry()
+        return _default_registry
@@ -0,0 +1,520 @@
+"""
+Headless HTTP service for the PDF Q&A pipeline.
+
+Streamlit reruns the whole script per interaction and cannot be called from
+other systems. This aiohttp service exposes the same pipeline (ingest.py,
+qa.py, the shared registry) over HTTP, with one index per document shared by
+every client:
+
+    POST   /documents                      PDF bytes -> 202 {"document": key, ...}
+    GET    /documents/{key}                indexing status
+    DELETE /documents/{key}                release one upload of the document
+    POST   /documents/{key}/ask            {"question", "chat_history", "k"} -> answer + sources
+    POST   /documents/{key}/ask/stream     same, streamed as NDJSON token events
+    POST   /documents/{key}/ask/batch      {"questions", "k"} -> answers + sources (batch_qa.py)
+    GET    /health                         limits, in-flight work and registry stats
+
+The document key "library" names LIBRARY_DIR when it is set; a newly
+published library version is picked up by the next request. Model clients
+come from the process-wide registry, so every request reuses the same
+connection pools. Load on each upstream is bounded: at most
+SERVICE_MAX_INGESTS documents embedding at once, and SERVICE_MAX_QUESTIONS
+questions at the LLM with SERVICE_MAX_WAITING more queued. Requests beyond
+that get 503 with Retry-After instead of piling up, and requests that run
+past SERVICE_TIMEOUT_S get 504. The blocking pipeline runs in a thread pool;
+work behind a 504 cannot be interrupted and runs to completion, holding its
+LLM slot until it does.
+
+    python service.py --port 8080            # Gemini (GOOGLE_API_KEY)
+    python service.py --port 8080 --fake     # local stand-ins, no API key
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import config
+from batch_qa import answer_batch, to_record
+from monitor import Monitor
+from pipeline import (
+    acquire_ingest, acquire_library, create_embeddings, index_cache_key, shared_chain, shared_embeddings, shared_llm,
+)
+from qa import DEFAULT_K, ask, ask_stream
+from rate_limits import is_rate_limit_error
+from library import read_manifest
+from registry import default_registry
+from singleflight import default_flights
+
+LIBRARY_KEY = "library"
+
+
+class Busy(Exception):
+    """
+    An upstream's concurrency limit and wait queue are both full.
+    """
+
+
+class Limiter:
+    """
+    At most `limit` concurrent holders and at most `max_waiting` callers
+    waiting for a slot; further callers are rejected at once (backpressure).
+
+        async with limiter.slot() as slot:
+            await service._run(fn, slot=slot)
+    """
+
+    def __init__(self, name, limit, max_waiting):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def slot(self):
+        return _Slot(self)
+
+    async def _acquire(self):
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Busy(self.name)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def _release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class _Slot:
+    """
+    One holder's slot of a Limiter. A request that times out leaves its work
+    running in a worker thread (threads cannot be interrupted); the slot then
+    stays taken until that work finishes, so the limit still bounds what
+    actually runs upstream.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._kept = False
+
+    async def __aenter__(self):
+        await self.limiter._acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if not self._kept:
+            self.limiter._release()
+
+    def keep_until_done(self, future, then=None):
+        """
+        Keeps the slot until future is done; then calls then() (if given) and
+        frees the slot.
+        """
+        if not self._kept:
+            self._kept = True
+            future.add_done_callback(lambda _: self._finish(then))
+
+    def _finish(self, then):
+        try:
+            if then is not None:
+                then()
+        finally:
+            self.limiter._release()
+
+
+def _error(status, message, **headers):
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+def _reject(exception_class, message):
+    return exception_class(text=json.dumps({"error": message}), content_type="application/json")
+
+
+def _event(payload):
+    # One NDJSON line of a streamed answer
+    return json.dumps(payload).encode("utf-8") + b"\n"
+
+
+def _sources(docs):
+    return [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+
+def _answer(result):
+    return {
+        "answer": result["answer"],
+        "generated_question": result["generated_question"],
+        "answer_cache": result["answer_cache"],
+        "sources": _sources(result["source_documents"]),
+        # Ranked retrieval results before context packing, for client-side monitoring
+        "retrieved": [
+            {"content": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+            for doc, score in result["docs_and_scores"]
+        ],
+        # Server-side latency of each stage (see monitor.QueryTrace)
+        "trace": result.get("trace"),
+    }
+
+
+def _status(key, job):
+    return {
+        "document": key,
+        "done": job.done,
+        "error": None if job.error is None else str(job.error),
+        "progress": job.progress,
+        "pages_indexed": job.pages_indexed,
+        "total_pages": job.total_pages,
+        "chunks_indexed": job.chunks_indexed,
+        "searchable": job.knowledge_base is not None,
+    }
+
+
+class QAService:
+    """
+    Request handlers plus the state they share: model clients, leases on the
+    documents clients have ingested, limiters and the worker threads.
+    """
+
+    def __init__(self, embeddings, llm, monitor=None, workers=None):
+        self.embeddings = embeddings
+        self.llm = llm
+        self.monitor = monitor or Monitor()
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or config.SERVICE_WORKERS, thread_name_prefix="qa-service"
+        )
+        # document key -> registry Lease. An uploaded document is held until
+        # every upload of it is matched by a DELETE (holders counts them) or,
+        # beyond SERVICE_MAX_DOCUMENTS, until it is the least recently used
+        self.leases = {}
+        self.holders = {}
+        self.last_used = {}
+        self.max_documents = config.SERVICE_MAX_DOCUMENTS
+        # Manifest version of the library lease (LIBRARY_KEY)
+        self.library_version = None
+        # Ingest jobs embed in the background, so they are bounded by count;
+        # keys whose job is being started hold their slot until it is leased
+        self.max_ingests = config.SERVICE_MAX_INGESTS
+        self.starting_ingests = set()
+        self.rejected_ingests = 0
+        self.llm_limiter = Limiter("llm", config.SERVICE_MAX_QUESTIONS, config.SERVICE_MAX_WAITING)
+
+    async def _run(self, fn, *args, timeout=None, slot=None, on_timeout=None):
+        """
+        Runs fn(*args) in the worker pool. On timeout the work keeps running
+        (and keeps `slot`, if given, until it finishes, after which
+        on_timeout() is called); the caller gets asyncio.TimeoutError.
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), config.SERVICE_TIMEOUT_S if timeout is None else timeout
+            )
+        except asyncio.TimeoutError:
+            if slot is not None:
+                slot.keep_until_done(future, then=on_timeout)
+            elif on_timeout is not None:
+                future.add_done_callback(lambda _: on_timeout())
+            raise
+
+    def _running_ingests(self):
+        return sum(not lease.value.done for lease in self.leases.values()) + len(self.starting_ingests)
+
+    async def _job(self, key):
+        if key == LIBRARY_KEY and config.LIBRARY_DIR:
+            await self._refresh_library()
+        lease = self.leases.get(key)
+        if lease is None:
+            return None
+        self.last_used[key] = time.monotonic()
+        return lease.value
+
+    def _drop(self, key):
+        lease = self.leases.pop(key)
+        self.holders.pop(key, None)
+        self.last_used.pop(key, None)
+        lease.release()
+
+    def _evict_documents(self, keep):
+        # Bounds what the service keeps leased, so the registry's memory
+        # budget still applies: least recently used indexed documents go
+        # first, even if a client still holds them (it gets 404 and uploads
+        # again, which the index cache answers without re-embedding)
+        uploaded = [key for key in self.leases if key not in (LIBRARY_KEY, keep)]
+        excess = len(uploaded) + 1 - self.max_documents
+        for key in sorted(uploaded, key=lambda key: self.last_used.get(key, 0.0)):
+            if excess <= 0:
+                break
+            if self.leases[key].value.done:
+                self._drop(key)
+                self.monitor.event("service_document_evicted", document=key)
+                excess -= 1
+
+    async def _refresh_library(self):
+        # A library republished by bulk_ingest.py or index_manager.py is
+        # picked up by the next request; loading it runs off the event loop
+        manifest = read_manifest(config.LIBRARY_DIR)
+        version = manifest["version"] if manifest else None
+        if LIBRARY_KEY in self.leases and version == self.library_version:
+            return
+        lease = await self._run(acquire_library, config.LIBRARY_DIR, self.embeddings, self.monitor)
+        previous = self.leases.get(LIBRARY_KEY)
+        self.leases[LIBRARY_KEY] = lease
+        self.library_version = version
+        if previous is not None:
+            previous.release()
+
+    @web.middleware
+    async def errors(self, request, handler):
+        start = time.perf_counter()
+        try:
+            return await handler(request)
+        except Busy as e:
+            return _error(503, f"Too many requests for the {e} backend", **{"Retry-After": "1"})
+        except asyncio.TimeoutError:
+            return _error(504, f"Request took longer than {config.SERVICE_TIMEOUT_S}s")
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            self.monitor.log_error(f"{request.method} {request.path} failed: {e}")
+            if is_rate_limit_error(e):
+                return _error(503, "Upstream rate limit exceeded", **{"Retry-After": "5"})
+            return _error(500, str(e))
+        finally:
+            self.monitor.record(
+                "service_request", time.perf_counter() - start, method=request.method,
+                route=request.match_info.route.resource.canonical if request.match_info.route.resource else request.path,
+            )
+
+    async def ingest(self, request):
+        pdf_bytes = await request.read()
+        if not pdf_bytes.startswith(b"%PDF"):
+            return _error(400, "Request body must be a PDF file")
+        # Hashing up to SERVICE_MAX_UPLOAD_MB would stall the event loop
+        key = await self._run(index_cache_key, pdf_bytes, self.embeddings)
+        known = key in self.leases or key in self.starting_ingests
+        if not known and self._running_ingests() >= self.max_ingests:
+            self.rejected_ingests += 1
+            raise Busy("embeddings")
+        # The slot is taken with no await since the check above, so
+        # concurrent uploads cannot all pass it
+        reserved = not known
+        if reserved:
+            self.starting_ingests.add(key)
+        try:
+            # Indexing continues in the background after the response
+            lease = await self._run(acquire_ingest, pdf_bytes, self.embeddings, self.monitor)
+        finally:
+            if reserved:
+                self.starting_ingests.discard(key)
+        # One lease per document (the newest, in case the previous job failed);
+        # each upload of it counts as one holder
+        previous = self.leases.get(key)
+        self.leases[key] = lease
+        if previous is not None:
+            previous.release()
+        self.holders[key] = self.holders.get(key, 0) + 1
+        self.last_used[key] = time.monotonic()
+        self._evict_documents(keep=key)
+        return web.json_response(_status(key, lease.value), status=202)
+
+    async def status(self, request):
+        key = request.match_info["key"]
+        job = await self._job(key)
+        if job is None:
+            return _error(404, f"Unknown document {key}")
+        return web.json_response(_status(key, job))
+
+    async def release(self, request):
+        key = request.match_info["key"]
+        if key == LIBRARY_KEY:
+            return _error(400, "The library is held by the service and cannot be released")
+        if key not in self.holders:
+            return _error(404, f"Unknown document {key}")
+        # The document stays loaded while other uploads of it are not released
+        self.holders[key] -= 1
+        if self.holders[key] == 0:
+            self._drop(key)
+        return web.json_response({"document": key, "released": True, "holders": self.holders.get(key, 0)})
+
+    async def _searchable(self, request):
+        key = request.match_info["key"]
+        job = await self._job(key)
+        if job is None:
+            raise _reject(web.HTTPNotFound, f"Unknown document {key}")
+        if job.error is not None:
+            raise _reject(web.HTTPConflict, str(job.error))
+        if job.knowledge_base is None:
+            raise _reject(web.HTTPConflict, "Document is still being indexed")
+        return job
+
+    async def _question(self, request):
+        job = await self._searchable(request)
+        body = await request.json()
+        if not body.get("question"):
+            raise _reject(web.HTTPBadRequest, "question is required")
+        chain = shared_chain(job, self.llm)
+        # Until indexing finishes, questions are answered from the partial index
+        knowledge_base = job.knowledge_base if job.done else job
+        history = [tuple(turn) for turn in body.get("chat_history", [])]
+        return job, chain, knowledge_base, body["question"], history, int(body.get("k", DEFAULT_K))
+
+    async def ask(self, request):
+        job, chain, knowledge_base, question, history, k = await self._question(request)
+        async with self.llm_limiter.slot() as slot:
+            result = await self._run(
+                lambda: ask(chain, knowledge_base, question, history, k=k, monitor=self.monitor, document_key=job.key),
+                slot=slot,
+            )
+        return web.json_response(_answer(result))
+
+    async def ask_stream(self, request):
+        job, chain, knowledge_base, question, history, k = await self._question(request)
+        async with self.llm_limiter.slot() as slot:
+            result, tokens = await self._run(
+                lambda: ask_stream(chain, knowledge_base, question, history, k=k, monitor=self.monitor, document_key=job.key),
+                slot=slot,
+            )
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            deadline = time.monotonic() + config.SERVICE_TIMEOUT_S
+            end = object()
+            try:
+                while True:
+                    # The LLM stream is produced ahead in its own thread (a
+                    # singleflight SharedStream); each hop waits for the next
+                    # token. On timeout the generator is closed once the
+                    # pending read returns, which stops the producer unless
+                    # a coalesced request is still reading it.
+                    token = await self._run(
+                        next, tokens, end, timeout=max(deadline - time.monotonic(), 0), slot=slot,
+                        on_timeout=tokens.close,
+                    )
+                    if token is end:
+                        break
+                    await response.write(_event({"token": token}))
+                await response.write(_event({"done": True, **_answer(result)}))
+            except asyncio.TimeoutError:
+                await response.write(_event({"error": f"Answer took longer than {config.SERVICE_TIMEOUT_S}s"}))
+            except ConnectionResetError:
+                # The client went away; the shared stream goes on only for
+                # coalesced requests still reading it
+                tokens.close()
+                return response
+            await response.write_eof()
+            return response
+
+    async def ask_batch(self, request):
+        job = await self._searchable(request)
+        if not job.done:
+            raise _reject(web.HTTPConflict, "Document is still being indexed")
+        body = await request.json()
+        questions = [question for question in body.get("questions", []) if question]
+        if not questions:
+            raise _reject(web.HTTPBadRequest, "questions is required")
+        if len(questions) > config.BATCH_QA_MAX_QUESTIONS:
+            raise _reject(web.HTTPBadRequest, f"At most {config.BATCH_QA_MAX_QUESTIONS} questions per batch")
+        chain = shared_chain(job, self.llm)
+        k = int(body.get("k", DEFAULT_K))
+        # One slot for the whole batch, which runs BATCH_QA_CONCURRENCY LLM
+        # calls of its own; the timeout allows for every round of them
+        rounds = -(-len(questions) // config.BATCH_QA_CONCURRENCY)
+        async with self.llm_limiter.slot() as slot:
+            results = await self._run(
+                lambda: answer_batch(
+                    chain, job.knowledge_base, questions, k=k, monitor=self.monitor, document_key=job.key
+                ),
+                timeout=config.SERVICE_TIMEOUT_S * rounds, slot=slot,
+            )
+        return web.json_response({"results": [to_record(result) for result in results]})
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok",
+            "documents": {key: lease.value.done for key, lease in self.leases.items()},
+            "limits": {
+                "embeddings": {
+                    "limit": self.max_ingests,
+                    "active": self._running_ingests(),
+                    "rejected": self.rejected_ingests,
+                },
+                "llm": self.llm_limiter.stats(),
+            },
+            "registry": default_registry().stats(),
+            "singleflight": default_flights().stats(),
+        })
+
+    async def close(self, app):
+        for lease in self.leases.values():
+            lease.release()
+        self.leases.clear()
+        self.holders.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(embeddings, llm, monitor=None, workers=None):
+    """
+    The aiohttp application. embeddings and llm are the (shared) model
+    clients every request uses.
+    """
+    service = QAService(embeddings, llm, monitor=monitor, workers=workers)
+    app = web.Application(middlewares=[service.errors], client_max_size=config.SERVICE_MAX_UPLOAD_MB * 1024 * 1024)
+    app["service"] = service
+    app.router.add_post("/documents", service.ingest)
+    app.router.add_get("/documents/{key}", service.status)
+    app.router.add_delete("/documents/{key}", service.release)
+    app.router.add_post("/documents/{key}/ask", service.ask)
+    app.router.add_post("/documents/{key}/ask/stream", service.ask_stream)
+    app.router.add_post("/documents/{key}/ask/batch", service.ask_batch)
+    app.router.add_get("/health", service.health)
+    app.on_cleanup.append(service.close)
+    return app
+
+
+def fake_clients(monitor=None):
+    """
+    Deterministic local embeddings and LLM (benchmarks/fakes.py), for running
+    and load-testing the service without an API key.
+    """
+    from benchmarks.fakes import FakeLLM
+
+    return create_embeddings(monitor=monitor, backend="fake"), FakeLLM()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP service for PDF question answering.")
+    parser.add_argument("--host", default=config.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVICE_PORT)
+    parser.add_argument("--fake", action="store_true", help="use local stand-in embeddings and LLM (no API key needed)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    monitor = Monitor()
+    if args.fake:
+        embeddings, llm = fake_clients(monitor)
+    else:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            print("GOOGLE_API_KEY not found in environment variables", file=sys.stderr)
+            return 1
+        embeddings, llm = shared_embeddings(api_key, monitor=monitor), shared_llm(api_key)
+    web.run_app(create_app(embeddings, llm, monitor=monitor), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
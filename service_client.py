@@ -0,0 +1,227 @@
+"""
+Client for service.py, used by the Streamlit apps when QA_SERVICE_URL is set.
+
+The apps then keep only the UI: documents are indexed and questions answered
+by the service, which shares its indexes and model clients with every other
+client. RemoteJob mirrors the parts of IngestJob the apps and
+ui.show_ingest_progress() read, and RemoteJob.ask_stream() returns
+(result, tokens) like qa.ask_stream().
+"""
+
+import json
+import threading
+import time
+
+import requests
+from langchain_core.documents import Document
+
+import config
+
+# Status is polled at most this often, however many attributes the UI reads
+_STATUS_TTL_S = 0.5
+
+
+class ServiceError(Exception):
+    """
+    An error response from the service; `code` is the HTTP status.
+    """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def _documents(items):
+    return [Document(page_content=item["content"], metadata=item["metadata"]) for item in items]
+
+
+class RemoteJob:
+    """
+    A document indexed by the service.
+    """
+
+    def __init__(self, client, key, status=None):
+        self.client = client
+        self.key = key
+        self._status = status
+        self._fetched = time.monotonic() if status else 0.0
+
+    def _get(self, field):
+        if time.monotonic() - self._fetched > _STATUS_TTL_S:
+            self._status = self.client.status(self.key)
+            self._fetched = time.monotonic()
+        return self._status[field]
+
+    @property
+    def done(self):
+        return self._get("done")
+
+    @property
+    def error(self):
+        error = self._get("error")
+        return None if error is None else ServiceError(409, error)
+
+    @property
+    def progress(self):
+        return self._get("progress")
+
+    @property
+    def pages_indexed(self):
+        return self._get("pages_indexed")
+
+    @property
+    def total_pages(self):
+        return self._get("total_pages")
+
+    @property
+    def chunks_indexed(self):
+        return self._get("chunks_indexed")
+
+    @property
+    def knowledge_base(self):
+        # Only tested against None by the apps: can questions be asked yet?
+        return self if self._get("searchable") else None
+
+    def ask(self, question, chat_history, k=None):
+        body = {"question": question, "chat_history": list(chat_history)}
+        if k is not None:
+            body["k"] = k
+        return self.client.post_json(f"/documents/{self.key}/ask", body)
+
+    def ask_stream(self, question, chat_history, k=None):
+        """
+        Streams the answer. Returns (result, tokens) like qa.ask_stream():
+        result["answer"] and result["source_documents"] are filled in once
+        `tokens` is exhausted.
+        """
+        body = {"question": question, "chat_history": list(chat_history)}
+        if k is not None:
+            body["k"] = k
+        response = self.client.post_json(f"/documents/{self.key}/ask/stream", body, stream=True)
+        result = {
+            "answer": None, "source_documents": [], "generated_question": question,
+            "query_embedding": None, "docs_and_scores": [], "answer_cache": None, "trace": None,
+        }
+
+        def tokens():
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if "token" in event:
+                        yield event["token"]
+                    elif "error" in event:
+                        raise ServiceError(504, event["error"])
+                    elif event.get("done"):
+                        result.update(
+                            answer=event["answer"],
+                            generated_question=event["generated_question"],
+                            answer_cache=event["answer_cache"],
+                            trace=event.get("trace"),
+                            source_documents=_documents(event["sources"]),
+                            docs_and_scores=[
+                                (doc, item["score"])
+                                for doc, item in zip(_documents(event["retrieved"]), event["retrieved"])
+                            ],
+                        )
+
+        return result, tokens()
+
+    def ask_batch(self, questions, k=None):
+        """
+        Answers a list of questions with batch_qa.answer_batch() on the
+        service. Returns results shaped like answer_batch()'s.
+        """
+        body = {"questions": list(questions)}
+        if k is not None:
+            body["k"] = k
+        rounds = -(-len(body["questions"]) // config.BATCH_QA_CONCURRENCY)
+        response = self.client.post_json(
+            f"/documents/{self.key}/ask/batch", body, timeout=self.client.timeout * max(rounds, 1)
+        )
+        return [
+            dict(record, sources=_documents(record["sources"]), retries=0) for record in response["results"]
+        ]
+
+
+class RemoteLease:
+    """
+    Stands in for a registry Lease: the service holds the document, so there
+    is nothing to release on the client.
+    """
+
+    def __init__(self, job):
+        self.value = job
+
+    def release(self):
+        pass
+
+
+class ServiceClient:
+    """
+    Thread-safe HTTP client with a pooled keep-alive session.
+    """
+
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = (base_url or config.QA_SERVICE_URL).rstrip("/")
+        # Allow for the service's own timeout plus the transfer
+        self.timeout = timeout or config.SERVICE_TIMEOUT_S + 10
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _check(self, response):
+        if response.status_code >= 400:
+            try:
+                message = response.json()["error"]
+            except ValueError:
+                message = response.text
+            response.close()
+            raise ServiceError(response.status_code, message)
+        return response
+
+    def status(self, key):
+        return self._check(self.session.get(f"{self.base_url}/documents/{key}", timeout=self.timeout)).json()
+
+    def post_json(self, path, body, stream=False, timeout=None):
+        response = self.session.post(
+            f"{self.base_url}{path}", json=body, timeout=timeout or self.timeout, stream=stream
+        )
+        return self._check(response) if stream else self._check(response).json()
+
+    def ingest(self, pdf_bytes):
+        """
+        Uploads a PDF. Returns a lease whose value is the RemoteJob.
+        """
+        response = self.session.post(
+            f"{self.base_url}/documents", data=pdf_bytes,
+            headers={"Content-Type": "application/pdf"}, timeout=self.timeout,
+        )
+        status = self._check(response).json()
+        return RemoteLease(RemoteJob(self, status["document"], status))
+
+    def library(self):
+        """
+        Lease on the service's document library (its LIBRARY_DIR).
+        """
+        return RemoteLease(RemoteJob(self, "library", self.status("library")))
+
+    def health(self):
+        return self._check(self.session.get(f"{self.base_url}/health", timeout=self.timeout)).json()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def default_client():
+    """
+    The process-wide ServiceClient for QA_SERVICE_URL, shared by all sessions.
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = ServiceClient()
+        return _default_client
@@ -0,0 +1,202 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+When several sessions upload the same PDF or ask the same question about the
+same document at the same moment, only the first caller does the work; the
+others wait on its shared future (or read its shared token stream) instead of
+repeating the same embedding and LLM calls. Keys are (document key,
+operation, normalized input); see normalize().
+"""
+
+import threading
+from concurrent.futures import Future
+
+from monitor import Monitor
+
+# Marks the end of a shared token stream
+_END = object()
+
+
+class StreamClosed(Exception):
+    """
+    A shared stream was stopped because every reader left before its end.
+    """
+
+
+def normalize(text):
+    """
+    Case- and whitespace-insensitive form of a question, for coalescing keys.
+    """
+    return " ".join(text.lower().split())
+
+
+class SharedStream:
+    """
+    Runs an iterable in a background thread and lets any number of readers
+    replay it from the start, so followers see every token the leader sees.
+    The producer runs ahead of its readers and keeps going while any of them
+    reads; once every reader has stopped early (closed its iterator), it
+    stops at the next item and closes the iterable, ending the LLM call.
+    """
+
+    def __init__(self, iterable):
+        self._items = []
+        self._error = None
+        self._readers = 0
+        self._cond = threading.Condition()
+        self.done = threading.Event()
+        threading.Thread(target=self._produce, args=(iterable,), daemon=True, name="singleflight-stream").start()
+
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                with self._cond:
+                    if self.done.is_set():
+                        break
+                    self._items.append(item)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+            self._end()
+
+    def _end(self, error=None):
+        with self._cond:
+            if self._items and self._items[-1] is _END:
+                return
+            if error is not None:
+                self._error = error
+            self._items.append(_END)
+            self._cond.notify_all()
+            self.done.set()
+
+    def __iter__(self):
+        with self._cond:
+            self._readers += 1
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: len(self._items) > position)
+                    item = self._items[position]
+                if item is _END:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                position += 1
+                yield item
+        finally:
+            with self._cond:
+                self._readers -= 1
+                abandoned = not self._readers and not (self._items and self._items[-1] is _END)
+            if abandoned:
+                self._end(StreamClosed("every reader stopped before the end of the stream"))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with equal keys. Safe to share between threads.
+    """
+
+    def __init__(self, monitor=None):
+        self.monitor = monitor or Monitor()
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._jobs = {}
+
+    def do(self, key, fn):
+        """
+        Calls fn() once for all concurrent callers with this key and returns
+        its result to each of them (exceptions are re-raised to each, too).
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            self._report(key)
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._flights[key]
+        return future.result()
+
+    def stream(self, key, make_iterable):
+        """
+        Like do() for a token stream: concurrent callers share one SharedStream
+        over make_iterable() until it is exhausted.
+        """
+        return self.share(key, lambda: SharedStream(make_iterable()))
+
+    def share(self, key, start):
+        """
+        Like do() for work that keeps running in the background: start()
+        returns an object with a `done` attribute (an IngestJob, a
+        SharedStream), and callers arriving before it is done receive the
+        same object instead of starting another one.
+        """
+        with self._lock:
+            running = self._jobs.get(key)
+            if running is not None and not _is_done(running):
+                self.calls += 1
+                self.coalesced += 1
+            else:
+                running = None
+        if running is not None:
+            self._report(key)
+            return running
+
+        def run():
+            job = start()
+            with self._lock:
+                # Forget finished work so the table only holds what is in flight
+                for other in [k for k, v in self._jobs.items() if _is_done(v)]:
+                    del self._jobs[other]
+                self._jobs[key] = job
+            return job
+
+        return self.do(key, run)
+
+    def _report(self, key):
+        self.monitor.log_singleflight(_operation(key), self.calls, self.coalesced)
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+def _is_done(job):
+    done = job.done
+    return done.is_set() if isinstance(done, threading.Event) else bool(done)
+
+
+def _operation(key):
+    # Keys are (document key, operation, input...)
+    return key[1] if isinstance(key, tuple) and len(key) > 1 else str(key)
+
+
+_default_flights = None
+_default_flights_lock = threading.Lock()
+
+
+def default_flights():
+    """
+    The process-wide SingleFlight shared by all Streamlit sessions.
+    """
+    global _default_flights
+    with _default_flights_lock:
+        if _default_flights is None:
+            _default_flights = SingleFlight()
+        return _default_flights
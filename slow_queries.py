@@ -0,0 +1,164 @@
+"""
+Offline replay of the slow-query log.
+
+With SLOW_QUERY_MS set, qa.py writes every question slower than that end to
+end to SLOW_QUERY_LOG_FILE, with its trace (monitor.QueryTrace), the retrieval
+settings it ran with and the chunks it retrieved. replay() indexes those
+chunks with the deterministic stand-ins from benchmarks/fakes.py and asks the
+question again through qa.ask_stream() under the same settings, so it can be
+timed and profiled without an API key.
+
+The stand-ins answer in (configurable) fixed time, so comparing the recorded
+and replayed timings tells API latency (query embed, history condense, LLM)
+from local work (search, context packing, everything else):
+
+    python slow_queries.py                          # replay the whole log
+    python slow_queries.py --last 5 --llm-latency 0.3
+    python slow_queries.py --log other.jsonl --json
+    python slow_queries.py --log slow_queries.jsonl.1    # a rotated log
+
+The replay index holds only the chunks the question retrieved; the recorded
+index size is reported next to it, since search time grows with the index.
+"""
+
+import argparse
+import json
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+import config
+from monitor import QueryTrace
+
+
+def read_log(path=None):
+    """
+    The entries of a slow-query log, oldest first. Lines that are not
+    complete slow-query entries (e.g. cut off by a crash) are skipped.
+    """
+    entries = []
+    with open(path or config.SLOW_QUERY_LOG_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("event") == "slow_query" and "trace" in entry:
+                entries.append(entry)
+    return entries
+
+
+@contextmanager
+def _settings(settings):
+    # The recorded retrieval settings, without the answer cache or slow-query
+    # logging (a replay must not log itself)
+    overrides = dict(settings, ANSWER_CACHE=False, SLOW_QUERY_MS=0)
+    saved = {name: getattr(config, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+def build_knowledge_base(entry, embeddings):
+    """
+    A hybrid (FAISS + BM25) knowledge base over the chunks the entry retrieved.
+    """
+    from lexical import BM25Index, HybridFAISS
+
+    texts = [item["content"] for item in entry["retrieved"]]
+    knowledge_base = HybridFAISS.from_texts(
+        texts, embeddings, metadatas=[item["metadata"] for item in entry["retrieved"]]
+    )
+    knowledge_base.lexical_index = BM25Index.build(texts)
+    return knowledge_base
+
+
+def replay(entry, embeddings=None, llm=None, monitor=None):
+    """
+    Asks a logged question again against the stand-ins. Returns the new trace.
+    """
+    # LangChain and FAISS are only needed for an actual replay
+    from langchain.chains import ConversationalRetrievalChain
+
+    from benchmarks.fakes import FakeEmbeddings, FakeLLM
+    from qa import ask_stream
+
+    if not entry["retrieved"]:
+        raise ValueError("Nothing was retrieved for this question; there is nothing to replay against")
+    embeddings = embeddings or FakeEmbeddings()
+    llm = llm or FakeLLM()
+    knowledge_base = build_knowledge_base(entry, embeddings)
+    chain = ConversationalRetrievalChain.from_llm(llm=llm, retriever=knowledge_base.as_retriever())
+    with _settings(entry["settings"]):
+        result, tokens = ask_stream(
+            chain, knowledge_base, entry["question"], [tuple(turn) for turn in entry["chat_history"]],
+            k=entry["k"], monitor=monitor,
+        )
+        for _ in tokens:
+            pass
+    return result["trace"]
+
+
+def format_comparison(entry, replayed):
+    """
+    Recorded vs replayed milliseconds per stage, as a text table.
+    """
+    recorded = entry["trace"]
+    question = entry["question"] if len(entry["question"]) <= 70 else entry["question"][:67] + "..."
+    lines = [
+        f"Q: {question}",
+        f"   index: {entry['index_vectors']} vectors recorded, {len(entry['retrieved'])} replayed; "
+        f"tokens in/out: {recorded['tokens_in']}/{recorded['tokens_out']}",
+        f"   {'Stage':<18} {'Recorded ms':>12} {'Replayed ms':>12}",
+    ]
+    for stage, label in QueryTrace.STAGES:
+        if stage in recorded["stages"] or stage in replayed["stages"]:
+            before, after = recorded["stages"].get(stage), replayed["stages"].get(stage)
+            lines.append(
+                f"   {label:<18} {'-' if before is None else before:>12} {'-' if after is None else after:>12}"
+            )
+    lines.append(f"   {'Other':<18} {recorded['other_ms']:>12} {replayed['other_ms']:>12}")
+    lines.append(f"   {'Total':<18} {recorded['total_ms']:>12} {replayed['total_ms']:>12}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay logged slow questions against the offline stand-ins.")
+    parser.add_argument("--log", default=None, help="slow-query log (default: SLOW_QUERY_LOG_FILE)")
+    parser.add_argument("--last", type=int, default=0, help="replay only the N most recent entries")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="stand-in embedding latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stand-in LLM time to first token (s)")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="stand-in LLM delay per token (s)")
+    parser.add_argument("--json", action="store_true", help="print JSON lines with both traces")
+    args = parser.parse_args(argv)
+
+    from benchmarks.fakes import FakeEmbeddings, FakeLLM
+
+    path = Path(args.log or config.SLOW_QUERY_LOG_FILE)
+    if not path.exists():
+        print(f"No slow-query log at {path}", file=sys.stderr)
+        return 1
+    entries = read_log(path)
+    if args.last:
+        entries = entries[-args.last:]
+    for entry in entries:
+        embeddings = FakeEmbeddings(latency=args.embed_latency)
+        llm = FakeLLM(first_token_latency=args.llm_latency, token_latency=args.llm_token_latency)
+        try:
+            replayed = replay(entry, embeddings, llm)
+        except ValueError as e:
+            print(f"Skipped {entry['question'][:70]!r}: {e}", file=sys.stderr)
+            continue
+        if args.json:
+            print(json.dumps({"question": entry["question"], "recorded": entry["trace"], "replayed": replayed}))
+        else:
+            print(format_comparison(entry, replayed), end="\n\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Cold-start profiling for the Streamlit apps.
+
+Each profile runs in a fresh interpreter (as a new container would) with
+`python -X importtime`, importing what each startup stage needs:
+
+- page:          the app module itself - everything before the upload page renders
+- first upload:  the ingestion pipeline, loaded when a PDF is uploaded
+- first answer:  the chain modules, loaded when the first question is asked
+
+and reports the wall time of every stage plus the slowest imports. check()
+is the regression guard used by deploy/deploy.py: the page stage must stay
+within STARTUP_BUDGET_S and must not import any of HEAVY_MODULES.
+
+    python startup_profile.py
+    python startup_profile.py --module streamlit_app --path deploy --budget 1.5
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import config
+
+ROOT = Path(__file__).resolve().parent
+
+STAGES = [
+    ("page", ["{module}"]),
+    ("first upload", ["pipeline", "qa", "ingest", "langchain_google_genai"]),
+    ("first answer", ["langchain.chains.conversational_retrieval.base"]),
+]
+
+# Modules the upload page must render without
+HEAVY_MODULES = ("langchain", "langchain_community", "langchain_google_genai", "PyPDF2", "faiss")
+
+# Runs in the child interpreter; prints one JSON line with the stage timings
+_SCRIPT = """
+import importlib, json, sys, time
+stages, heavy = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+report = []
+for name, modules in stages:
+    start = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    report.append({"stage": name, "seconds": time.perf_counter() - start,
+                   "heavy_loaded": [m for m in heavy if m in sys.modules]})
+print(json.dumps(report))
+"""
+
+_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr):
+    """
+    [(module, self seconds, cumulative seconds, depth)] from -X importtime output.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us) / 1e6, int(cumulative_us) / 1e6, len(indent) // 2))
+    return imports
+
+
+def profile(module="app", path=None, timeout=120):
+    """
+    Profiles a cold start of `module` (found on `path`, default the repository
+    root). Returns {"stages": [...], "imports": [...]} with times in seconds.
+    """
+    stages = [(name, [m.format(module=module) for m in modules]) for name, modules in STAGES]
+    search_path = os.pathsep.join(str(p) for p in [path or ROOT, ROOT] if p)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [search_path, os.getenv("PYTHONPATH")])))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT, json.dumps(stages), json.dumps(HEAVY_MODULES)],
+        capture_output=True, text=True, timeout=timeout, env=env, cwd=str(path or ROOT),
+    )
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError("\n".join(errors[-10:]))
+    return {"stages": json.loads(result.stdout.strip().splitlines()[-1]), "imports": parse_importtime(result.stderr)}
+
+
+def check(module="app", path=None, budget_s=None):
+    """
+    The cold-start regression check. Returns (ok, problems, report).
+    """
+    budget_s = budget_s or config.STARTUP_BUDGET_S
+    report = profile(module, path)
+    page = report["stages"][0]
+    problems = []
+    if page["seconds"] > budget_s:
+        problems.append(f"importing {module} took {page['seconds']:.2f}s (budget {budget_s:.2f}s)")
+    if page["heavy_loaded"]:
+        problems.append(f"importing {module} loads {', '.join(page['heavy_loaded'])}; import them on first use instead")
+    return not problems, problems, report
+
+
+def format_report(report, top=15):
+    lines = ["Stage            Seconds"]
+    lines += [f"{stage['stage']:<16} {stage['seconds']:>7.3f}" for stage in report["stages"]]
+    lines += ["", f"Slowest imports (self time, top {top}):", "Module                                            Self  Cumulative"]
+    slowest = sorted(report["imports"], key=lambda item: -item[1])[:top]
+    lines += [f"{module:<46} {self_s:>7.3f} {cumulative_s:>10.3f}" for module, self_s, cumulative_s, _ in slowest]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the cold start of a Streamlit app module.")
+    parser.add_argument("--module", default="app", help="app module to import (default: app)")
+    parser.add_argument("--path", default=None, help="directory containing the module (default: repository root)")
+    parser.add_argument("--budget", type=float, default=None, help="page stage budget in seconds (default: STARTUP_BUDGET_S)")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args(argv)
+
+    ok, problems, report = check(args.module, args.path, args.budget)
+    print(json.dumps(report) if args.json else format_report(report, args.top))
+    for problem in problems:
+        print(f"FAIL: {problem}", file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The pipeline modules live in the repository root, as for app.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,145 @@
+"""
+RateLimitedEmbeddings against the 429-injecting stub from benchmarks/fakes.py:
+retries, jittered backoff, pacing and rate-limit error classification.
+"""
+
+import itertools
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import embedding_client
+from benchmarks.fakes import FakeEmbeddings, FakeRateLimitError
+from embedding_client import RateLimitedEmbeddings
+from rate_limits import TokenBucket, is_rate_limit_error
+
+_models = itertools.count()
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self, **kwargs):
+        # Buckets are shared per model name; a fresh name keeps tests apart
+        super().__init__(model=f"test/embedding-{next(_models)}", **kwargs)
+        self.calls = 0
+
+    def _request(self, texts):
+        self.calls += 1
+        return super()._request(texts)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """
+    Records the backoff the client would sleep instead of sleeping it.
+    """
+    delays = []
+    monkeypatch.setattr(embedding_client, "random", SimpleNamespace(uniform=lambda low, high: high))
+    monkeypatch.setattr(embedding_client, "time", SimpleNamespace(sleep=delays.append, perf_counter=time.perf_counter))
+    return delays
+
+
+def _client(embeddings, **kwargs):
+    return RateLimitedEmbeddings(embeddings, batch_size=4, max_concurrency=2, **kwargs)
+
+
+class TestIsRateLimitError:
+    def test_stub_error(self):
+        assert is_rate_limit_error(FakeRateLimitError("429 Resource has been exhausted"))
+
+    @pytest.mark.parametrize("error", [
+        type("ResourceExhausted", (Exception,), {})("exhausted"),
+        type("HTTPError", (Exception,), {"status_code": 429})("too many"),
+        RuntimeError("Quota exceeded for this project"),
+        RuntimeError("rate limit reached"),
+    ])
+    def test_recognized(self, error):
+        assert is_rate_limit_error(error)
+
+    @pytest.mark.parametrize("error", [ValueError("bad input"), RuntimeError("500 internal error")])
+    def test_other_errors(self, error):
+        assert not is_rate_limit_error(error)
+
+
+class TestRetries:
+    def test_retries_until_success(self, no_backoff):
+        stub = CountingEmbeddings(rate_limit_rate=0.5, seed=1)
+        texts = [f"clause {i} payment terms" for i in range(20)]
+        vectors = _client(stub, max_retries=50).embed_documents(texts)
+        assert vectors == FakeEmbeddings().embed_documents(texts)
+        # Five batches of four, and the stub rejected some of the requests
+        assert stub.calls > 5
+        assert len(no_backoff) == stub.calls - 5
+
+    def test_gives_up_after_max_retries(self, no_backoff):
+        stub = CountingEmbeddings(rate_limit_rate=1.0)
+        with pytest.raises(FakeRateLimitError):
+            _client(stub, max_retries=3).embed_query("termination notice")
+        assert stub.calls == 4
+
+    def test_other_errors_are_not_retried(self, no_backoff):
+        stub = CountingEmbeddings()
+
+        def broken(texts):
+            stub.calls += 1
+            raise ValueError("bad input")
+
+        stub.embed_documents = broken
+        with pytest.raises(ValueError):
+            _client(stub).embed_documents(["a"])
+        assert stub.calls == 1
+        assert no_backoff == []
+
+    def test_backoff_is_exponential_and_capped(self, no_backoff, monkeypatch):
+        monkeypatch.setattr(config, "EMBED_BACKOFF_BASE_S", 1.0)
+        monkeypatch.setattr(config, "EMBED_BACKOFF_MAX_S", 5.0)
+        with pytest.raises(FakeRateLimitError):
+            _client(CountingEmbeddings(rate_limit_rate=1.0), max_retries=5).embed_query("q")
+        # random.uniform(0, cap) returns its upper bound here
+        assert no_backoff == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+    def test_backoff_is_jittered(self, monkeypatch):
+        bounds = []
+        monkeypatch.setattr(
+            embedding_client, "random", SimpleNamespace(uniform=lambda low, high: bounds.append((low, high)) or 0.0)
+        )
+        with pytest.raises(FakeRateLimitError):
+            _client(CountingEmbeddings(rate_limit_rate=1.0), max_retries=2).embed_query("q")
+        base = config.EMBED_BACKOFF_BASE_S
+        assert bounds == [(0, base), (0, 2 * base)]
+
+
+class TestPacing:
+    def test_token_bucket_waits_for_refill(self):
+        bucket = TokenBucket(rate_per_minute=600, capacity=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        # One token is available at once, the other five arrive at 10/s
+        assert time.monotonic() - start >= 0.45
+
+    def test_request_larger_than_bucket_waits_for_a_full_bucket(self):
+        bucket = TokenBucket(rate_per_minute=600, capacity=2)
+        bucket.acquire(2)
+        start = time.monotonic()
+        bucket.acquire(100)
+        assert 0.15 <= time.monotonic() - start < 1.0
+
+    def test_client_requests_are_paced(self):
+        client = _client(CountingEmbeddings())
+        client.requests = TokenBucket(rate_per_minute=600, capacity=1)
+        start = time.monotonic()
+        for i in range(6):
+            client.embed_query(f"question {i}")
+        assert time.monotonic() - start >= 0.45
+
+    def test_rate_limited_retries_are_paced_too(self, monkeypatch):
+        monkeypatch.setattr(config, "EMBED_BACKOFF_BASE_S", 0.0)
+        stub = CountingEmbeddings(rate_limit_rate=0.5, seed=3)
+        client = _client(stub, max_retries=50)
+        client.requests = TokenBucket(rate_per_minute=1200, capacity=1)
+        start = time.monotonic()
+        client.embed_query("payment schedule")
+        # Every attempt, including each retry, takes a request from the bucket
+        assert time.monotonic() - start >= (stub.calls - 1) / 20 - 0.02
@@ -0,0 +1,113 @@
+"""
+Streamlit widgets shared by app.py and deploy/streamlit_app.py.
+"""
+
+import time
+from pathlib import Path
+
+import streamlit as st
+
+
+def show_ingest_progress(job):
+    """
+    Shows indexing progress for a running IngestJob. The fragment refreshes
+    itself every second and reruns the whole app once the job has finished.
+    """
+
+    @st.fragment(run_every=1.0)
+    def progress_panel():
+        if job.done:
+            st.rerun()
+        st.progress(
+            job.progress,
+            text=f"🧠 Indexing PDF: {job.pages_indexed}/{job.total_pages} pages, "
+                 f"{job.chunks_indexed} chunks embedded",
+        )
+        if job.knowledge_base is not None:
+            st.warning(
+                f"⏳ Indexing in progress - answers only cover the first "
+                f"{job.pages_indexed} of {job.total_pages} pages so far."
+            )
+
+    progress_panel()
+
+
+def show_batch_qa(answer_all, document_key):
+    """
+    Batch questions panel: a question list is answered in one go with
+    answer_all(questions, on_result) (see batch_qa.answer_batch()) and the
+    answers can be downloaded as CSV or JSON.
+    """
+    # batch_qa loads the retrieval stack, which the upload page renders without
+    from batch_qa import format_results, parse_questions, source_label
+
+    with st.expander("📋 Batch questions"):
+        questions_file = st.file_uploader(
+            "Question list (one question per line, or .csv / .json)", type=["txt", "csv", "json"],
+            key="batch_questions",
+        )
+        if questions_file is not None and st.button("Answer all questions"):
+            questions = parse_questions(questions_file.getvalue().decode("utf-8"), questions_file.name)
+            progress = st.progress(0.0, text=f"Answering {len(questions)} questions...")
+            start = time.perf_counter()
+            results = answer_all(
+                questions, lambda done, total: progress.progress(done / total, text=f"{done}/{total} answered")
+            )
+            progress.empty()
+            st.session_state.batch_results = (document_key, questions_file.name, results, time.perf_counter() - start)
+
+        # Kept across reruns (a download button click reruns the app)
+        batch = st.session_state.get("batch_results")
+        if batch is None or batch[0] != document_key:
+            return
+        _, name, results, seconds = batch
+        failed = sum(result["error"] is not None for result in results)
+        st.caption(
+            f"{len(results)} questions answered in {seconds:.1f}s" + (f" ({failed} failed)" if failed else "")
+        )
+        st.dataframe([
+            {
+                "Question": result["question"],
+                "Answer": result["answer"] if result["error"] is None else f"Error: {result['error']}",
+                "Sources": "; ".join(source_label(doc) for doc in result["sources"]),
+            }
+            for result in results
+        ])
+        stem = Path(name).stem
+        csv_column, json_column = st.columns(2)
+        csv_column.download_button(
+            "Download CSV", format_results(results, "csv"), file_name=f"{stem}-answers.csv", mime="text/csv"
+        )
+        json_column.download_button(
+            "Download JSON", format_results(results, "json"), file_name=f"{stem}-answers.json",
+            mime="application/json",
+        )
+
+
+def show_trace(trace):
+    """
+    Collapsible latency breakdown of one answer: qa's result["trace"] (see
+    monitor.QueryTrace), or the service's when answered remotely.
+    """
+    if not trace:
+        return
+    from monitor import QueryTrace
+
+    with st.expander(f"⏱️ Performance ({trace['total_ms'] / 1000:.2f}s)"):
+        st.dataframe(
+            [
+                {"Stage": label, "ms": trace["stages"][stage]}
+                for stage, label in QueryTrace.STAGES if stage in trace["stages"]
+            ] + [{"Stage": "Other", "ms": trace["other_ms"]}],
+            hide_index=True,
+        )
+        notes = [f"~{trace['tokens_in']} tokens in, ~{trace['tokens_out']} tokens out"]
+        if trace["answer_cache"] == "hit":
+            notes.append("answered from the answer cache")
+        if trace["coalesced"]:
+            notes.append("retrieval shared with an identical concurrent question")
+        if trace["condensed"]:
+            notes.append("question condensed with the chat history")
+        st.caption("; ".join(notes))
+        if trace["slow"]:
+            st.warning("Slower than the slow-query threshold; logged for offline replay (slow_queries.py).")